@@ -0,0 +1,186 @@
+"""Пул аккаунтов user bot для распределения подписок и квоты пересылок."""
+import collections
+import logging
+import time
+from typing import Deque, Dict, Iterable, List, Optional, Set
+from pyrogram import Client
+from config import ACCOUNT_FORWARDS_PER_MINUTE, PEER_FLOOD_COOLDOWN
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Дольше этого ждать освобождения аккаунта в обработчике сообщения не имеет смысла
+MAX_FLOOD_SLEEP = 600
+
+
+class Account:
+    """Аккаунт пула: клиент, членство в чатах, назначенные чаты и состояние флуда."""
+
+    def __init__(self, name: str, client: Client):
+        self.name = name
+        self.client = client
+        self.user_id: Optional[int] = None
+        self.member_chats: Set[int] = set()
+        self.assigned_chats: Set[int] = set()
+        self.flood_until = 0.0
+        self.recent_forwards: Deque[float] = collections.deque()
+
+    def forwards_last_minute(self, now: float) -> int:
+        """Число пересылок за последнюю минуту."""
+        while self.recent_forwards and now - self.recent_forwards[0] > 60:
+            self.recent_forwards.popleft()
+        return len(self.recent_forwards)
+
+    def has_quota(self, now: float, quota: int) -> bool:
+        """Может ли аккаунт пересылать сейчас."""
+        if self.flood_until > now:
+            return False
+        return not quota or self.forwards_last_minute(now) < quota
+
+    def available_at(self, now: float, quota: int) -> float:
+        """Момент, когда у аккаунта снова появится квота."""
+        moment = max(now, self.flood_until)
+        if quota and self.forwards_last_minute(now) >= quota:
+            moment = max(moment, self.recent_forwards[0] + 60)
+        return moment
+
+    def record_forward(self):
+        self.recent_forwards.append(time.time())
+
+    def __repr__(self) -> str:
+        return f"Account({self.name})"
+
+
+class AccountPool:
+    """
+    Пул сессий Pyrogram.
+
+    Каждый подписанный чат закрепляется за одним аккаунтом-владельцем
+    (по членству и нагрузке) - только он обрабатывает сообщения чата, чтобы
+    они не дублировались. Пересылки идут через участников чата с оставшейся
+    квотой: аккаунт не из чата не может переслать из закрытого канала или
+    группы. Состояние FloodWait/PEER_FLOOD учитывается отдельно для каждого.
+    """
+
+    def __init__(self, clients: Iterable[Client], forward_quota: int = ACCOUNT_FORWARDS_PER_MINUTE):
+        """
+        Args:
+            clients: Клиенты Pyrogram (можно поддельные)
+            forward_quota: Максимум пересылок в минуту на аккаунт (0 - без ограничения)
+        """
+        self.accounts: List[Account] = [Account(getattr(c, "name", f"account{i}"), c) for i, c in enumerate(clients)]
+        self.forward_quota = forward_quota
+        self._owners: Dict[int, Account] = {}
+        self._by_client: Dict[int, Account] = {id(account.client): account for account in self.accounts}
+        self.membership_loaded = False
+
+        for account in self.accounts:
+            metrics.ACCOUNT_FLOODED.set_function(
+                lambda account=account: float(account.flood_until > time.time()), account.name
+            )
+            metrics.ACCOUNT_ASSIGNED_CHATS.set_function(lambda account=account: len(account.assigned_chats), account.name)
+
+    @property
+    def primary(self) -> Account:
+        return self.accounts[0]
+
+    def account_for_client(self, client: Client) -> Optional[Account]:
+        return self._by_client.get(id(client))
+
+    async def start(self):
+        """Запуск всех клиентов и загрузка списков чатов, в которых состоят аккаунты."""
+        for account in self.accounts:
+            await account.client.start()
+            me = await account.client.get_me()
+            account.user_id = me.id
+            async for dialog in account.client.get_dialogs():
+                account.member_chats.add(dialog.chat.id)
+            logger.info("Аккаунт %s (ID %s): чатов %d", account.name, me.id, len(account.member_chats))
+        self.membership_loaded = True
+
+    async def stop(self):
+        for account in self.accounts:
+            # Клиент не подключен, если запуск прервался раньше
+            if account.client.is_connected:
+                await account.client.stop()
+
+    def assign(self, chat_id: int, receiver: Optional[Account] = None) -> Account:
+        """
+        Закрепление чата за аккаунтом: среди участников чата выбирается наименее
+        загруженный; если участников нет, - наименее загруженный вообще.
+        """
+        owner = self._owners.get(chat_id)
+        if owner:
+            return owner
+
+        if receiver:
+            receiver.member_chats.add(chat_id)
+        candidates = [account for account in self.accounts if chat_id in account.member_chats]
+        if not candidates:
+            candidates = self.accounts
+            if self.membership_loaded:
+                logger.warning("Ни один аккаунт пула не состоит в чате %s", chat_id)
+
+        owner = min(candidates, key=lambda account: len(account.assigned_chats))
+        owner.assigned_chats.add(chat_id)
+        self._owners[chat_id] = owner
+        return owner
+
+    def unassign(self, chat_id: int):
+        """Снятие закрепления чата, на который не осталось подписок."""
+        owner = self._owners.pop(chat_id, None)
+        if owner:
+            owner.assigned_chats.discard(chat_id)
+
+    def is_owner(self, client: Client, chat_id: int) -> bool:
+        """Должен ли аккаунт, получивший сообщение, его обрабатывать."""
+        receiver = self.account_for_client(client)
+        if receiver is None or len(self.accounts) == 1:
+            return True
+        return self.assign(chat_id, receiver) is receiver
+
+    def forwarders(self, source_chat_id: int) -> List[Account]:
+        """
+        Аккаунты, которые могут пересылать из чата: его участники. Если ни один
+        аккаунт не известен как участник (членство еще не загружено или чат
+        публичный), - все аккаунты пула.
+        """
+        members = [account for account in self.accounts if source_chat_id in account.member_chats]
+        return members or self.accounts
+
+    def pick_forwarder(self, source_chat_id: int, exclude: Set[str] = frozenset()) -> Optional[Account]:
+        """
+        Выбор аккаунта для пересылки среди forwarders: с квотой, не в флуде,
+        предпочтительно владелец чата, затем наименее загруженный.
+        """
+        now = time.time()
+        ready = [
+            account for account in self.forwarders(source_chat_id)
+            if account.name not in exclude and account.has_quota(now, self.forward_quota)
+        ]
+        if not ready:
+            return None
+
+        owner = self._owners.get(source_chat_id)
+        if owner in ready:
+            return owner
+        return min(ready, key=lambda account: account.forwards_last_minute(now))
+
+    def mark_no_access(self, account: Account, chat_id: int):
+        """Аккаунт больше не может читать чат (вышел, заблокирован): он не участник."""
+        account.member_chats.discard(chat_id)
+        logger.warning("Аккаунт %s: нет доступа к чату %s", account.name, chat_id)
+
+    def seconds_until_available(self, source_chat_id: Optional[int] = None) -> float:
+        """Через сколько секунд хотя бы у одного аккаунта (из forwarders чата) появится квота."""
+        now = time.time()
+        accounts = self.accounts if source_chat_id is None else self.forwarders(source_chat_id)
+        return max(0.0, min(account.available_at(now, self.forward_quota) for account in accounts) - now)
+
+    def mark_flood_wait(self, account: Account, seconds: float):
+        account.flood_until = max(account.flood_until, time.time() + seconds)
+        logger.warning("Аккаунт %s: FloodWait на %s сек", account.name, seconds)
+
+    def mark_peer_flood(self, account: Account):
+        account.flood_until = max(account.flood_until, time.time() + PEER_FLOOD_COOLDOWN)
+        logger.warning("Аккаунт %s: PEER_FLOOD, пересылки приостановлены на %s сек", account.name, PEER_FLOOD_COOLDOWN)
@@ -0,0 +1,234 @@
+"""Догрузка сообщений, опубликованных, пока user bot был остановлен."""
+import asyncio
+import heapq
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+from pyrogram.types import Message
+from sqlalchemy import select
+from database import get_session
+from models import ChatProgress
+from config import (
+    BACKFILL_MAX_MESSAGES, BACKFILL_BATCH_SIZE, BACKFILL_BATCH_DELAY, PROGRESS_FLUSH_INTERVAL
+)
+import metrics
+
+if TYPE_CHECKING:
+    from user_bot import UserBot
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressTracker:
+    """
+    Граница обработанных сообщений по чатам.
+
+    Потребители очереди завершают сообщения не по порядку, поэтому граница -
+    не самый большой обработанный message_id, а последний перед самым
+    младшим незавершенным: принятое в очередь сообщение отмечается begin, а
+    после обработки - mark, и граница сдвигается только по непрерывному ряду
+    завершенных. Сообщения, которые очередь отбросила, в учет не попадают.
+    Отметки копятся в памяти и периодически сохраняются в таблицу
+    chat_progress, чтобы не писать в БД на каждое сообщение.
+    """
+
+    def __init__(self, flush_interval: int = PROGRESS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.last_ids: Dict[int, int] = {}
+        self._dirty: Dict[int, int] = {}
+        # Кучи принятых и завершенных message_id выше границы
+        self._started: Dict[int, List[int]] = {}
+        self._finished: Dict[int, List[int]] = {}
+        self._held: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def begin(self, chat_id: int, message_id: int):
+        """Сообщение принято в обработку: граница не перейдет его до mark."""
+        heapq.heappush(self._started.setdefault(chat_id, []), message_id)
+
+    def mark(self, chat_id: int, message_id: int):
+        """Отметка обработанного сообщения."""
+        heapq.heappush(self._finished.setdefault(chat_id, []), message_id)
+        if chat_id not in self._held:
+            self._advance(chat_id)
+
+    def _advance(self, chat_id: int):
+        started = self._started.get(chat_id)
+        finished = self._finished.get(chat_id)
+        last = None
+        while finished and not (started and started[0] < finished[0]):
+            last = heapq.heappop(finished)
+            if started and started[0] == last:
+                heapq.heappop(started)
+        if last is not None and last > self.last_ids.get(chat_id, 0):
+            self.last_ids[chat_id] = last
+            self._dirty[chat_id] = last
+
+    def hold(self, chat_id: int):
+        """Придержать границу чата, пока догрузка не приняла пропущенные сообщения,
+        иначе живые отметки перескочили бы еще не прочитанную историю."""
+        self._held.add(chat_id)
+
+    def release(self, chat_id: int):
+        if chat_id in self._held:
+            self._held.discard(chat_id)
+            self._advance(chat_id)
+
+    async def load(self):
+        async for session in get_session():
+            result = await session.execute(select(ChatProgress.chat_id, ChatProgress.last_message_id))
+            for chat_id, last_message_id in result.all():
+                self.last_ids[chat_id] = max(self.last_ids.get(chat_id, 0), last_message_id)
+
+    async def flush(self):
+        """Сохранение накопленных отметок одной транзакцией."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        now = time.time()
+        async for session in get_session():
+            result = await session.execute(select(ChatProgress).where(ChatProgress.chat_id.in_(dirty)))
+            existing = {entry.chat_id: entry for entry in result.scalars().all()}
+            for chat_id, message_id in dirty.items():
+                entry = existing.get(chat_id)
+                if entry is None:
+                    session.add(ChatProgress(chat_id=chat_id, last_message_id=message_id, updated_at=now))
+                elif message_id > entry.last_message_id:
+                    entry.last_message_id = message_id
+                    entry.updated_at = now
+            await session.commit()
+
+    def start(self):
+        if self.flush_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(), name="progress-flush")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось сохранить прогресс чатов")
+
+
+class Backfiller:
+    """
+    Прогон пропущенных сообщений подписанных чатов через конвейер фильтрации.
+
+    Для каждого чата история читается от новых к старым до последнего
+    обработанного сообщения (не больше max_messages), затем обрабатывается от
+    старых к новым пачками с паузами. Сообщения, уже полученные обработчиком
+    в реальном времени, пропускаются. Пока очередь приема занята, догрузка ждет.
+    """
+
+    def __init__(self, bot: "UserBot", max_messages: int = BACKFILL_MAX_MESSAGES,
+                 batch_size: int = BACKFILL_BATCH_SIZE, batch_delay: float = BACKFILL_BATCH_DELAY):
+        self.bot = bot
+        self.max_messages = max_messages
+        self.batch_size = max(1, batch_size)
+        self.batch_delay = batch_delay
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, chat_ids: List[int]):
+        if self._task is None:
+            for chat_id in chat_ids:
+                self.bot.progress.hold(chat_id)
+            self._task = asyncio.create_task(self.run(chat_ids), name="backfill")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self, chat_ids: List[int]):
+        total = 0
+        for chat_id in chat_ids:
+            try:
+                total += await self._backfill_chat(chat_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Не удалось догрузить историю чата %s: %s", chat_id, e)
+            finally:
+                self.bot.progress.release(chat_id)
+        logger.info("Догрузка истории завершена: обработано %d сообщений", total)
+
+    async def _backfill_chat(self, chat_id: int) -> int:
+        progress = self.bot.progress
+        last_id = progress.last_ids.get(chat_id)
+        client = self.bot.pool.assign(chat_id).client
+
+        if last_id is None:
+            # Чат встречается впервые: запоминаем текущую позицию вместо прогона всей истории
+            async for message in client.get_chat_history(chat_id, limit=1):
+                progress.mark(chat_id, message.id)
+            return 0
+
+        missed: List[Message] = []
+        async for message in client.get_chat_history(chat_id, limit=self.max_messages):
+            if message.id <= last_id:
+                break
+            missed.append(message)
+        else:
+            if len(missed) >= self.max_messages:
+                logger.warning("Чат %s: пропущено больше %d сообщений, догружаются только последние",
+                               chat_id, self.max_messages)
+
+        # Все, что новее первого сообщения из обработчика, уже обработано вживую
+        live_first = self.bot.live_first_ids.get(chat_id)
+        if live_first is not None:
+            missed = [message for message in missed if message.id < live_first]
+        if not missed:
+            return 0
+
+        missed.reverse()
+        # Пропущенные сообщения держат границу, пока не обработаны (и после остановки посреди догрузки)
+        for message in missed:
+            progress.begin(chat_id, message.id)
+        progress.release(chat_id)
+        logger.info("Чат %s: догрузка %d пропущенных сообщений", chat_id, len(missed))
+        for start in range(0, len(missed), self.batch_size):
+            await self._wait_for_idle_queue()
+            batch = missed[start:start + self.batch_size]
+            # Доставки этих сообщений могли выпасть из журнала в памяти
+            try:
+                await self.bot.ledger.load_messages(chat_id, [message.id for message in batch])
+            except Exception as e:
+                # Повтор пересылки все равно отсечет уникальный ключ таблицы deliveries
+                logger.warning("Чат %s: не удалось загрузить доставки пачки: %s", chat_id, e)
+            for message in batch:
+                await self._process(chat_id, message)
+            await asyncio.sleep(self.batch_delay)
+        return len(missed)
+
+    async def _process(self, chat_id: int, message: Message):
+        """Обработка одного сообщения истории; отметка ставится и после ошибки, как у потребителей очереди."""
+        cancelled = False
+        try:
+            record = self.bot._normalize(message)
+            if record:
+                await self.bot.process_record(record)
+                metrics.BACKFILL_MESSAGES.inc()
+        except asyncio.CancelledError:
+            # Прерванное остановкой сообщение держит границу, после перезапуска его догрузят снова
+            cancelled = True
+            raise
+        except Exception:
+            logger.exception("Чат %s: ошибка обработки сообщения %s при догрузке", chat_id, message.id)
+        finally:
+            if not cancelled:
+                self.bot.progress.mark(chat_id, message.id)
+
+    async def _wait_for_idle_queue(self):
+        """Живые сообщения в приоритете: пачка начинается, только когда очередь приема почти пуста."""
+        ingestion = self.bot.ingestion
+        while ingestion.queue.qsize() >= ingestion.consumer_count:
+            await asyncio.sleep(self.batch_delay or 0.1)
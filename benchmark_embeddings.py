@@ -0,0 +1,107 @@
+"""Точность и память компактных эмбеддингов (float16, int8) относительно float32.
+
+Кодирует тексты корпусов и темы из benchmark_filters, считает косинусную
+схожесть в каждом формате и сравнивает с float32: максимальное и среднее
+отклонение схожести и долю сообщений, у которых изменилась ближайшая тема
+или решение по порогу SEMANTIC_THRESHOLD. Отдельно выводится память на
+миллион векторов для размерности модели.
+
+Без локальной модели (или с --random) используются случайные векторы:
+так проверяется только ошибка квантизации, а не реальное распределение схожестей.
+
+Пример:
+    python benchmark_embeddings.py --output bench_embeddings.json
+"""
+import argparse
+import json
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from benchmark_filters import CORPORA, TOPIC_SETS
+from config import SEMANTIC_MODEL, SEMANTIC_THRESHOLD
+from embedding_store import DTYPES, bytes_per_vector, compact, cosine_matrix
+
+
+def encode_all(texts: List[str], topics: List[str], use_random: bool, dim: int) -> Tuple[np.ndarray, np.ndarray, str]:
+    """Эмбеддинги текстов и тем в float32 и название источника."""
+    if not use_random:
+        try:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(SEMANTIC_MODEL)
+            return (
+                model.encode(texts, convert_to_numpy=True, normalize_embeddings=True),
+                model.encode(topics, convert_to_numpy=True, normalize_embeddings=True),
+                SEMANTIC_MODEL,
+            )
+        except Exception as e:
+            print(f"Модель недоступна ({e}), используются случайные векторы")
+    rng = np.random.default_rng(0)
+    return (
+        rng.standard_normal((len(texts), dim)).astype(np.float32),
+        rng.standard_normal((len(topics), dim)).astype(np.float32),
+        f"random-{dim}d",
+    )
+
+
+def evaluate(texts: np.ndarray, topics: np.ndarray, threshold: float) -> Dict[str, dict]:
+    """Отклонения схожести и решений каждого формата от float32."""
+    reference = cosine_matrix(compact(texts, "float32"), compact(topics, "float32"))
+    results = {}
+    for dtype in DTYPES:
+        left, right = compact(texts, dtype), compact(topics, dtype)
+        similarities = cosine_matrix(left, right)
+        error = np.abs(similarities - reference)
+        results[dtype] = {
+            "max_abs_error": float(error.max()),
+            "mean_abs_error": float(error.mean()),
+            "top_topic_changed": float((similarities.argmax(axis=1) != reference.argmax(axis=1)).mean()),
+            "threshold_changed": float(
+                ((similarities.max(axis=1) >= threshold) != (reference.max(axis=1) >= threshold)).mean()
+            ),
+            "bytes_per_vector": bytes_per_vector(texts.shape[1], dtype),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--random", action="store_true", help="Случайные векторы вместо модели")
+    parser.add_argument("--dim", type=int, default=1024, help="Размерность случайных векторов")
+    parser.add_argument("--threshold", type=float, default=SEMANTIC_THRESHOLD, help="Порог схожести")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    texts = [text for corpus in CORPORA.values() for text in corpus]
+    topics = list(dict.fromkeys(
+        topic.strip() for topic_set in TOPIC_SETS.values() for topic in topic_set.split(",") if topic.strip()
+    ))
+    text_vectors, topic_vectors, source = encode_all(texts, topics, args.random, args.dim)
+    dim = text_vectors.shape[1]
+
+    results = {
+        "source": source,
+        "dim": dim,
+        "texts": len(texts),
+        "topics": len(topics),
+        "threshold": args.threshold,
+        "dtypes": evaluate(text_vectors, topic_vectors, args.threshold),
+    }
+
+    print(f"Источник: {source}, размерность {dim}, текстов {len(texts)}, тем {len(topics)}")
+    print(f"{'формат':<9} {'МБ/млн':>9} {'макс. ошибка':>13} {'ср. ошибка':>11} {'смена темы':>11} {'смена порога':>13}")
+    for dtype, stats in results["dtypes"].items():
+        print(
+            f"{dtype:<9} {stats['bytes_per_vector'] * 1_000_000 / 2 ** 20:>9.0f} "
+            f"{stats['max_abs_error']:>13.5f} {stats['mean_abs_error']:>11.5f} "
+            f"{stats['top_topic_changed']:>11.1%} {stats['threshold_changed']:>13.1%}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Микробенчмарки матчеров FilterEngine.
+
+Измеряет match_keywords, match_semantic, _check_false_positive и should_forward
+на параметризованных корпусах русских/английских новостей, а также холодный
+старт (загрузку модели), теплый одиночный и пакетный скоринг. Результаты
+сохраняются в JSON, чтобы сравнивать их между коммитами.
+
+Пример:
+    python benchmark_filters.py --output bench_filters.json
+    python benchmark_filters.py --keyword-only --compare bench_filters.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from filter_engine import FilterEngine
+from config import SEMANTIC_MODEL, SEMANTIC_PROVIDER
+
+NEWS_RU = [
+    "Центробанк сохранил ключевую ставку на прежнем уровне",
+    "Команда разработчиков выпустила новую версию приложения на Python",
+    "Совещание по проекту перенесли на четверг, дедлайн сдачи отчета в пятницу",
+    "Курс доллара на бирже снизился после заявления министерства финансов",
+    "В Москве ожидается сильный снегопад и понижение температуры до минус двадцати",
+    "Стартап в области искусственного интеллекта привлек инвестиции от крупного фонда",
+    "Сборная России по футболу сыграет товарищеский матч в следующем месяце",
+    "Крайний срок подачи налоговых деклараций истекает в конце апреля",
+]
+
+NEWS_EN = [
+    "The central bank kept its key interest rate unchanged",
+    "Developers shipped a new release of the Python application",
+    "The project meeting was moved to Thursday, report deadline is Friday",
+    "Oil prices climbed after the cartel announced production cuts",
+    "Heavy snowfall is expected in the capital with temperatures dropping sharply",
+    "An artificial intelligence startup raised funding from a large venture fund",
+    "The national football team will play a friendly match next month",
+    "The deadline for filing tax returns expires at the end of April",
+]
+
+CORPORA = {
+    "ru_short": NEWS_RU,
+    "en_short": NEWS_EN,
+    "ru_long": [" ".join(NEWS_RU[i:] + NEWS_RU[:i]) for i in range(len(NEWS_RU))],
+    "mixed_long": [" ".join(NEWS_RU[i:i + 4] + NEWS_EN[i:i + 4]) * 3 for i in range(len(NEWS_RU))],
+}
+
+KEYWORD_SETS = {
+    "small": "python, дедлайн",
+    "medium": "python, дедлайн, ставка, доллар, футбол, deadline, release, oil",
+    "large": ", ".join([
+        "python", "дедлайн", "ставка", "доллар", "футбол", "снегопад", "инвестиции", "налог",
+        "deadline", "release", "oil", "snowfall", "funding", "football", "interest rate", "tax",
+        "совещание", "встреча", "программирование", "разработка", "стартап", "биржа", "нефть", "матч",
+    ]),
+}
+
+TOPIC_SETS = {
+    "single": "дедлайн",
+    "rules": "дедлайн, программирование, встреча",
+    "news": "экономика, спорт, погода, технологии, финансы",
+}
+
+BATCH_SIZES = (1, 8, 32)
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Замер функции repeat раз, результат в микросекундах."""
+    samples = []
+    sink = io.StringIO()
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(sink):
+            started = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - started) * 1e6)
+        sink.seek(0)
+        sink.truncate()
+    samples.sort()
+    return {
+        "mean_us": statistics.fmean(samples),
+        "p50_us": samples[len(samples) // 2],
+        "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "runs": len(samples),
+    }
+
+
+def per_text(func: Callable[[str], object], texts: List[str]) -> Callable[[], None]:
+    """Функция, прогоняющая func по всем текстам корпуса."""
+    def run():
+        for text in texts:
+            func(text)
+    return run
+
+
+def git_revision() -> Optional[str]:
+    """Текущий коммит для привязки результатов."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def bench_keywords(engine: FilterEngine, repeat: int, results: dict):
+    """Замеры match_keywords по корпусам и наборам ключевых слов."""
+    for corpus_name, texts in CORPORA.items():
+        for set_name, keywords in KEYWORD_SETS.items():
+            stats = measure(per_text(lambda t: engine.match_keywords(t, keywords), texts), repeat)
+            stats["per_message_us"] = stats["mean_us"] / len(texts)
+            results[f"match_keywords/{corpus_name}/{set_name}"] = stats
+
+
+def bench_false_positive(engine: FilterEngine, repeat: int, results: dict):
+    """Замеры _check_false_positive для тем с правилами."""
+    for corpus_name, texts in CORPORA.items():
+        for topic in ("дедлайн", "программирование", "встреча"):
+            stats = measure(per_text(lambda t: engine._check_false_positive(t, topic), texts), repeat)
+            stats["per_message_us"] = stats["mean_us"] / len(texts)
+            results[f"check_false_positive/{corpus_name}/{topic}"] = stats
+
+
+def bench_should_forward(engine: FilterEngine, repeat: int, results: dict, semantic: bool):
+    """Замеры should_forward на наборе фильтров пользователя."""
+    filters = [{"keywords": keywords, "topics": None, "use_semantic": False}
+               for keywords in KEYWORD_SETS.values()]
+    if semantic:
+        filters += [{"keywords": None, "topics": topics, "use_semantic": True}
+                    for topics in TOPIC_SETS.values()]
+    compiled = engine.compile_filters(filters)
+    for corpus_name, texts in CORPORA.items():
+        stats = measure(per_text(lambda t: engine.should_forward(t, compiled), texts), repeat)
+        stats["per_message_us"] = stats["mean_us"] / len(texts)
+        results[f"should_forward/{corpus_name}/{'mixed' if semantic else 'keywords'}"] = stats
+
+
+def bench_semantic(engine: FilterEngine, repeat: int, results: dict):
+    """Холодный старт, теплый match_semantic и пакетный скоринг."""
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine._init_semantic()
+    results["semantic/cold_start"] = {"mean_us": (time.perf_counter() - started) * 1e6, "runs": 1}
+    if not engine.semantic_model:
+        results["semantic/cold_start"]["skipped"] = "модель не загружена"
+        return
+    # Корпус прогоняется многократно: без отключения кэша замерялся бы поиск в кэше, а не кодирование
+    engine.text_cache.maxsize = 0
+
+    for corpus_name, texts in CORPORA.items():
+        for set_name, topics in TOPIC_SETS.items():
+            stats = measure(per_text(lambda t: engine.match_semantic(t, topics), texts), repeat)
+            stats["per_message_us"] = stats["mean_us"] / len(texts)
+            results[f"match_semantic/{corpus_name}/{set_name}"] = stats
+
+    topic_list = [t.strip() for t in TOPIC_SETS["news"].split(",")]
+    topic_embeddings = engine.semantic_model.encode(topic_list, convert_to_tensor=True)
+    from torch.nn.functional import cosine_similarity
+
+    for corpus_name, texts in CORPORA.items():
+        for batch_size in BATCH_SIZES:
+            batch = (texts * batch_size)[:batch_size]
+
+            def score_batch():
+                embeddings = engine.semantic_model.encode(batch, convert_to_tensor=True)
+                cosine_similarity(embeddings.unsqueeze(1), topic_embeddings.unsqueeze(0), dim=-1).max(dim=1)
+
+            stats = measure(score_batch, repeat)
+            stats["per_message_us"] = stats["mean_us"] / batch_size
+            results[f"batch_score/{corpus_name}/b{batch_size}"] = stats
+
+
+def compare(results: dict, baseline_path: str, tolerance: float):
+    """Сравнение с сохраненными результатами, вывод регрессий."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    regressions = 0
+    for name, stats in sorted(results.items()):
+        old = baseline.get(name)
+        if not old or "skipped" in stats or "skipped" in old:
+            continue
+        key = "per_message_us" if "per_message_us" in stats and "per_message_us" in old else "mean_us"
+        delta = (stats[key] - old[key]) / old[key] if old[key] else 0.0
+        marker = ""
+        if delta > tolerance:
+            marker = "  РЕГРЕССИЯ"
+            regressions += 1
+        print(f"{name:<55} {old[key]:>12.1f} -> {stats[key]:>12.1f} us ({delta:+.1%}){marker}")
+    print(f"\nРегрессий: {regressions}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=30, help="Число повторов каждого замера")
+    parser.add_argument("--keyword-only", action="store_true", help="Пропустить семантические замеры")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON с прошлыми результатами для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Допустимое замедление (доля)")
+    args = parser.parse_args()
+
+    engine = FilterEngine()
+    results: Dict[str, dict] = {}
+    semantic = not args.keyword_only and SEMANTIC_PROVIDER == "local"
+
+    if semantic:
+        bench_semantic(engine, args.repeat, results)
+        semantic = engine.semantic_model is not None
+    bench_keywords(engine, args.repeat, results)
+    bench_false_positive(engine, args.repeat, results)
+    bench_should_forward(engine, args.repeat, results, semantic)
+
+    for name, stats in sorted(results.items()):
+        per_message = stats.get("per_message_us")
+        suffix = f" ({per_message:.1f} us/msg)" if per_message is not None else ""
+        print(f"{name:<55} {stats['mean_us']:>12.1f} us{suffix}")
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "provider": SEMANTIC_PROVIDER,
+        "model": SEMANTIC_MODEL if semantic else None,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+    if args.compare:
+        print()
+        if compare(results, args.compare, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""Replay-бенчмарк пропускной способности конвейера обработки сообщений.
+
+Прогоняет синтетический или записанный корпус сообщений (JSONL) через
+UserBot.process_message с поддельными Message/Client и локальной SQLite БД.
+Для каждой комбинации (подписчики, фильтры, длина текста) выводит
+сообщения/сек, перцентили задержки по этапам и пиковый RSS. Длина текста
+задает только синтетический корпус: с --corpus перебор длин отключается,
+а в результате указывается средняя длина текстов корпуса в словах.
+
+Пример:
+    python benchmark_pipeline.py --subscribers 1,10,100 --filters 1,5 --text-lengths 10,200
+    python benchmark_pipeline.py --corpus messages.jsonl --output bench.json
+
+Без модели и сети семантический путь измеряется с тестовым провайдером:
+    SEMANTIC_PROVIDER=mock MOCK_PROVIDER_LATENCY_MS=50 python benchmark_pipeline.py --semantic-ratio 0.5
+
+Формат строки корпуса: {"chat_id": -100123, "text": "..."} (chat_id необязателен).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+# БД и учетные данные подменяются до импорта модулей проекта, т.к. config читает их при импорте
+_db_dir = tempfile.mkdtemp(prefix="news_bot_bench_")
+os.environ.setdefault("BENCH_DATABASE_URL", f"sqlite+aiosqlite:///{_db_dir}/bench.db")
+os.environ["DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+
+from database import engine, Base, get_session  # noqa: E402
+from models import User, Filter, Subscription  # noqa: E402
+from user_bot import UserBot  # noqa: E402
+
+STAGES = ("routing", "keyword", "semantic", "forward", "total")
+
+WORDS = (
+    "новости рынок акции python программирование разработка релиз дедлайн встреча "
+    "совещание погода экономика банк курс доллар нефть выборы спорт футбол матч "
+    "технологии искусственный интеллект нейросеть стартап инвестиции update release "
+    "market stocks election football weather deadline meeting code"
+).split()
+
+
+class FakeChat(SimpleNamespace):
+    """Поддельный объект чата Pyrogram."""
+
+
+class FakeMessage:
+    """Поддельное сообщение Pyrogram с минимальным набором полей."""
+
+    def __init__(self, chat_id: int, message_id: int, text: str):
+        self.id = message_id
+        self.chat = FakeChat(id=chat_id, title=f"Bench chat {chat_id}", type="channel", username=None)
+        self.text = text
+        self.caption = None
+        self.from_user = None
+
+
+class FakeClient:
+    """Поддельный клиент Pyrogram, считающий пересылки."""
+
+    def __init__(self, forward_latency: float = 0.0):
+        self.name = "bench"
+        self.forward_latency = forward_latency
+        self.forwarded = 0
+
+    async def get_chat(self, chat_id):
+        return FakeChat(id=chat_id, title=f"Bench chat {chat_id}", first_name=None,
+                        type=SimpleNamespace(value="channel"), username=None)
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids):
+        if self.forward_latency:
+            await asyncio.sleep(self.forward_latency)
+        self.forwarded += 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по отсортированной выборке (ближайший ранг)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def mean_words(corpus: List[dict]) -> float:
+    """Средняя длина текстов корпуса в словах."""
+    if not corpus:
+        return 0.0
+    return sum(len(item["text"].split()) for item in corpus) / len(corpus)
+
+
+def load_corpus(path: Optional[str], size: int, text_length: Optional[int], chat_ids: List[int], seed: int) -> List[dict]:
+    """Загрузка корпуса из JSONL или генерация синтетического."""
+    rng = random.Random(seed)
+    if path:
+        corpus = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                corpus.append({
+                    "chat_id": item.get("chat_id") or rng.choice(chat_ids),
+                    "text": item["text"]
+                })
+        return corpus
+
+    return [
+        {"chat_id": rng.choice(chat_ids), "text": " ".join(rng.choices(WORDS, k=text_length))}
+        for _ in range(size)
+    ]
+
+
+async def seed_database(subscribers: int, filters_per_user: int, chat_ids: List[int],
+                        semantic_ratio: float, seed: int):
+    """Пересоздание схемы и заполнение пользователей, подписок и фильтров."""
+    rng = random.Random(seed)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    async for session in get_session():
+        for index in range(subscribers):
+            user_id = 10_000 + index
+            session.add(User(user_id=user_id, username=f"bench{index}", target_chat_id=user_id))
+            for chat_id in chat_ids:
+                session.add(Subscription(user_id=user_id, chat_id=chat_id,
+                                         chat_title=f"Bench chat {chat_id}", chat_type="channel"))
+            for _ in range(filters_per_user):
+                if rng.random() < semantic_ratio:
+                    session.add(Filter(user_id=user_id, topics=rng.choice(WORDS), use_semantic=True))
+                else:
+                    keywords = ", ".join(rng.sample(WORDS, 3))
+                    session.add(Filter(user_id=user_id, keywords=keywords, use_semantic=False))
+        await session.commit()
+
+
+def instrument(bot: UserBot, timings: Dict[str, float]):
+    """Обертка этапов конвейера таймерами, накапливающими время в timings."""
+    engine_ = bot.filter_engine
+
+    def timed_sync(stage, func):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings[stage] += time.perf_counter() - started
+        return wrapper
+
+    def timed_async(stage, func):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                timings[stage] += time.perf_counter() - started
+        return wrapper
+
+    engine_._evaluate_keywords = timed_sync("keyword", engine_._evaluate_keywords)
+    engine_._score_topics_async = timed_async("semantic", engine_._score_topics_async)
+    bot.forward_message = timed_async("forward", bot.forward_message)
+
+
+async def run_case(args, subscribers: int, filters_per_user: int, text_length: Optional[int]) -> dict:
+    """Прогон одной комбинации параметров (text_length=None - записанный корпус)."""
+    chat_ids = [-(1_000_000_000_000 + i) for i in range(args.chats)]
+    await seed_database(subscribers, filters_per_user, chat_ids, args.semantic_ratio, args.seed)
+    corpus = load_corpus(args.corpus, args.messages, text_length, chat_ids, args.seed)
+
+    client = FakeClient(forward_latency=args.forward_latency)
+    bot = UserBot(client=client)
+    bot.min_forward_interval = 0
+    bot.pool.forward_quota = 0
+
+    timings: Dict[str, float] = dict.fromkeys(STAGES, 0.0)
+    instrument(bot, timings)
+    # Журнал совпадений пишется в фоне, как в работающем боте
+    bot.match_log.start()
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+
+    sink = io.StringIO() if not args.verbose else sys.stdout
+    started = time.perf_counter()
+    for message_id, item in enumerate(corpus, start=1):
+        message = FakeMessage(item["chat_id"], message_id, item["text"])
+        for stage in STAGES:
+            timings[stage] = 0.0
+        with contextlib.redirect_stdout(sink):
+            message_started = time.perf_counter()
+            await bot.process_message(message)
+            timings["total"] = time.perf_counter() - message_started
+        timings["routing"] = max(0.0, timings["total"] - timings["keyword"]
+                                 - timings["semantic"] - timings["forward"])
+        for stage in STAGES:
+            samples[stage].append(timings[stage] * 1000)
+        if not args.verbose:
+            sink.seek(0)
+            sink.truncate()
+    elapsed = time.perf_counter() - started
+    await bot.match_log.stop()
+    await bot.filter_engine.close()
+
+    return {
+        "provider": bot.filter_engine.semantic_provider,
+        "subscribers": subscribers,
+        "filters": filters_per_user,
+        "corpus": args.corpus,
+        "text_length": text_length if text_length is not None else mean_words(corpus),
+        "messages": len(corpus),
+        "forwards": client.forwarded,
+        "messages_per_sec": len(corpus) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            stage: {
+                "p50": percentile(samples[stage], 50),
+                "p95": percentile(samples[stage], 95),
+                "p99": percentile(samples[stage], 99),
+            }
+            for stage in STAGES
+        },
+        # ru_maxrss на Linux в КБ
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_result(result: dict):
+    """Вывод строки результата."""
+    latency = result["latency_ms"]
+    stages = " ".join(
+        f"{stage}={latency[stage]['p50']:.2f}/{latency[stage]['p95']:.2f}/{latency[stage]['p99']:.2f}"
+        for stage in STAGES
+    )
+    length = f"~{result['text_length']:.0f}" if result["corpus"] else str(result["text_length"])
+    print(
+        f"subs={result['subscribers']:<5} filters={result['filters']:<3} len={length:<5} "
+        f"{result['messages_per_sec']:8.1f} msg/s  fwd={result['forwards']:<6} "
+        f"rss={result['peak_rss_mb']:.0f}MB  p50/p95/p99 ms: {stages}"
+    )
+
+
+def parse_list(value: str) -> List[int]:
+    """Разбор списка чисел через запятую."""
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="JSONL-файл с сообщениями (по умолчанию синтетический корпус)")
+    parser.add_argument("--messages", type=int, default=500, help="Размер синтетического корпуса")
+    parser.add_argument("--chats", type=int, default=5, help="Число подписанных чатов")
+    parser.add_argument("--subscribers", type=parse_list, default=[1, 10, 100])
+    parser.add_argument("--filters", type=parse_list, default=[1, 5])
+    parser.add_argument("--text-lengths", type=parse_list, default=None,
+                        help="Длины синтетических текстов в словах (по умолчанию 10,100; не используется с --corpus)")
+    parser.add_argument("--semantic-ratio", type=float, default=0.0,
+                        help="Доля семантических фильтров (требует модели или SEMANTIC_PROVIDER=mock)")
+    parser.add_argument("--forward-latency", type=float, default=0.0, help="Имитация задержки пересылки, сек")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    parser.add_argument("--verbose", action="store_true", help="Не подавлять вывод бота")
+    args = parser.parse_args()
+
+    if args.corpus:
+        if args.text_lengths:
+            print("--text-lengths игнорируется: длина текстов задана корпусом", file=sys.stderr)
+        text_lengths = [None]
+    else:
+        text_lengths = args.text_lengths or [10, 100]
+
+    results = []
+    for subscribers, filters_per_user, text_length in itertools.product(
+            args.subscribers, args.filters, text_lengths):
+        result = await run_case(args, subscribers, filters_per_user, text_length)
+        print_result(result)
+        results.append(result)
+
+    await engine.dispose()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""Офлайн-подбор порогов семантической схожести по оценкам пользователей.
+
+Читает оценки 👍/👎 из таблицы match_feedback и для каждого пользователя
+(и каждой его темы, если оценок достаточно) подбирает порог, максимизирующий
+F1 для полезных пересылок. Результат записывается в semantic_thresholds,
+откуда user bot перечитывает его раз в THRESHOLD_RELOAD_INTERVAL секунд.
+
+Оценки есть только у пересланных сообщений, поэтому подобранный порог может
+отсечь лишние пересылки, но не вернуть пропущенные.
+
+Пример:
+    python calibrate_thresholds.py --min-samples 20 --dry-run
+"""
+import argparse
+import asyncio
+import json
+from database import engine, init_db
+from feedback import calibrate
+from config import FEEDBACK_MIN_VOTES_PER_CLASS
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-samples", type=int, default=10, help="Минимум оценок для подбора порога")
+    parser.add_argument(
+        "--min-votes-per-class", type=int, default=FEEDBACK_MIN_VOTES_PER_CLASS,
+        help="Минимум оценок 👍 и минимум оценок 👎 для подбора порога"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Показать пороги без записи в БД")
+    parser.add_argument("--output", help="Сохранить подобранные пороги в JSON")
+    args = parser.parse_args()
+
+    await init_db()
+    fitted = await calibrate(
+        min_samples=args.min_samples, dry_run=args.dry_run, min_per_class=args.min_votes_per_class
+    )
+    await engine.dispose()
+
+    if not fitted:
+        print(
+            f"Недостаточно оценок: нужно хотя бы {args.min_samples} на пользователя или тему, "
+            f"из них не меньше {args.min_votes_per_class} 👍 и {args.min_votes_per_class} 👎"
+        )
+    for item in fitted:
+        topic = item["topic"] or "(все темы)"
+        print(
+            f"user={item['user_id']:<12} topic={topic:<30} threshold={item['threshold']:.3f} "
+            f"samples={item['samples']} 👍={item['positive']}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(fitted, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    if not args.dry_run:
+        print(f"Записано порогов: {len(fitted)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
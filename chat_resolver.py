@@ -0,0 +1,226 @@
+"""Кэширующий резолвер чатов для запросов get_chat."""
+import collections
+import time
+from typing import List, NamedTuple, Optional, Tuple, Union
+from pyrogram import Client
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from database import get_session
+from models import ChatCache
+from config import CHAT_CACHE_TTL, CHAT_CACHE_NEGATIVE_TTL, CHAT_CACHE_MEMORY_SIZE
+import metrics
+
+# Тип чата в записи кэша, которую не удалось разрешить (chat_id такой записи - 0)
+UNRESOLVED_CHAT_TYPE = "unresolved"
+
+
+class ChatNotResolved(LookupError):
+    """Чат недавно не удалось разрешить; get_chat не повторяется до истечения CHAT_CACHE_NEGATIVE_TTL."""
+
+
+class ResolvedChat(NamedTuple):
+    """Результат разрешения чата."""
+    chat_id: int
+    title: str
+    chat_type: str
+    username: Optional[str]
+
+
+# Общий для всех резолверов процесса LRU-кэш в памяти: ключ → (время разрешения, чат
+# или None для неудачного разрешения); записи старше TTL считаются промахом, как и в БД
+_memory_cache: "collections.OrderedDict[str, Tuple[float, Optional[ResolvedChat]]]" = collections.OrderedDict()
+
+
+def _remember(key: str, resolved_at: float, resolved: Optional[ResolvedChat]):
+    _memory_cache[key] = (resolved_at, resolved)
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > CHAT_CACHE_MEMORY_SIZE:
+        _memory_cache.popitem(last=False)
+
+
+def chat_type_name(chat) -> str:
+    """Получение строкового типа чата из объекта Pyrogram."""
+    chat_type = getattr(chat, "type", None)
+    if chat_type is None:
+        return "unknown"
+    return getattr(chat_type, "value", str(chat_type))
+
+
+class ChatResolver:
+    """
+    Резолвер username/ID → (chat_id, название, тип) с кэшем в памяти и в БД.
+
+    Неудачное разрешение тоже кэшируется (на negative_ttl секунд), чтобы
+    недоступные подписки не запрашивались у Telegram при каждом запуске.
+    """
+
+    def __init__(self, *clients: Client, ttl: int = CHAT_CACHE_TTL, negative_ttl: int = CHAT_CACHE_NEGATIVE_TTL):
+        """
+        Инициализация резолвера.
+
+        Args:
+            clients: Клиенты Pyrogram, через которые выполняется get_chat (по порядку)
+            ttl: Время жизни записи кэша в секундах
+            negative_ttl: Время жизни неудачного разрешения в секундах
+        """
+        self.clients: List[Client] = list(clients)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def add_client(self, client: Client):
+        """Добавление резервного клиента для get_chat."""
+        if client not in self.clients:
+            self.clients.append(client)
+
+    @staticmethod
+    def normalize_key(identifier: Union[str, int]) -> str:
+        """Приведение username или ID к ключу кэша."""
+        if isinstance(identifier, int):
+            return str(identifier)
+        identifier = identifier.strip()
+        try:
+            return str(int(identifier))
+        except ValueError:
+            return identifier.lstrip("@").lower()
+
+    def _is_fresh(self, resolved_at: float, negative: bool = False) -> bool:
+        """Проверка, не истёк ли срок жизни записи (у неудачных разрешений он свой)."""
+        return time.time() - resolved_at < (self.negative_ttl if negative else self.ttl)
+
+    async def resolve(self, identifier: Union[str, int], retry_failed: bool = False) -> ResolvedChat:
+        """
+        Разрешение чата по username или ID.
+
+        Сначала проверяется кэш в памяти, затем таблица chat_cache,
+        и только при промахе выполняется запрос get_chat к Telegram.
+
+        Args:
+            identifier: Username или ID чата
+            retry_failed: Запросить Telegram, даже если чат недавно не удалось разрешить
+                (пользователь мог выдать доступ)
+
+        Raises:
+            ChatNotResolved: если чат недавно не удалось разрешить
+            Exception: если ни один из клиентов не смог получить чат
+        """
+        key = self.normalize_key(identifier)
+
+        cached = _memory_cache.get(key)
+        if cached and self._is_fresh(cached[0], cached[1] is None) and (cached[1] is not None or not retry_failed):
+            _memory_cache.move_to_end(key)
+            metrics.CHAT_RESOLVER_LOOKUPS.inc("memory")
+            return self._cached_result(key, cached[1])
+
+        found, resolved = await self._load_from_db(key)
+        if found and (resolved is not None or not retry_failed):
+            metrics.CHAT_RESOLVER_LOOKUPS.inc("database")
+            return self._cached_result(key, resolved)
+
+        metrics.CHAT_RESOLVER_LOOKUPS.inc("telegram")
+
+        try:
+            chat = await self._fetch(identifier)
+        except Exception:
+            await self._store(key, None)
+            raise
+        resolved = ResolvedChat(
+            chat_id=chat.id,
+            title=chat.title or chat.first_name or str(identifier),
+            chat_type=chat_type_name(chat),
+            username=chat.username
+        )
+        await self._store(key, resolved)
+        return resolved
+
+    @staticmethod
+    def _cached_result(key: str, resolved: Optional[ResolvedChat]) -> ResolvedChat:
+        if resolved is None:
+            raise ChatNotResolved(f"Чат {key} недавно не удалось разрешить")
+        return resolved
+
+    async def _fetch(self, identifier: Union[str, int]):
+        """Запрос get_chat через доступных клиентов по очереди."""
+        if isinstance(identifier, str):
+            key = self.normalize_key(identifier)
+            identifier = int(key) if key.lstrip("-").isdigit() else identifier.strip()
+
+        last_error: Optional[Exception] = None
+        for client in self.clients:
+            try:
+                return await client.get_chat(identifier)
+            except Exception as e:
+                last_error = e
+        raise last_error or ValueError(f"Нет клиентов для разрешения чата {identifier}")
+
+    async def _load_from_db(self, key: str) -> Tuple[bool, Optional[ResolvedChat]]:
+        """Свежая запись из таблицы chat_cache: (найдена ли, чат или None для неудачного разрешения)."""
+        async for session in get_session():
+            result = await session.execute(select(ChatCache).where(ChatCache.lookup_key == key))
+            entry = result.scalar_one_or_none()
+            if not entry:
+                return False, None
+            negative = entry.chat_type == UNRESOLVED_CHAT_TYPE
+            if not self._is_fresh(entry.resolved_at, negative=negative):
+                return False, None
+
+            resolved = None if negative else ResolvedChat(
+                chat_id=entry.chat_id,
+                title=entry.chat_title,
+                chat_type=entry.chat_type,
+                username=entry.username
+            )
+            _remember(key, entry.resolved_at, resolved)
+            return True, resolved
+        return False, None
+
+    async def _store(self, key: str, resolved: Optional[ResolvedChat]):
+        """
+        Сохранение результата под исходным ключом, ID и username (None - неудачное разрешение).
+
+        Несколько процессов могут одновременно вставить один lookup_key: при
+        нарушении уникальности записи перечитываются и обновляются.
+        """
+        now = time.time()
+        keys = {key}
+        if resolved is not None:
+            keys.add(str(resolved.chat_id))
+            if resolved.username:
+                keys.add(resolved.username.lower())
+
+        for attempt in range(2):
+            try:
+                await self._upsert(keys, resolved, now)
+                break
+            except IntegrityError:
+                if attempt:
+                    raise
+        for lookup_key in keys:
+            _remember(lookup_key, now, resolved)
+
+    @staticmethod
+    async def _upsert(keys: set, resolved: Optional[ResolvedChat], now: float):
+        async for session in get_session():
+            result = await session.execute(select(ChatCache).where(ChatCache.lookup_key.in_(keys)))
+            existing = {entry.lookup_key: entry for entry in result.scalars().all()}
+
+            for lookup_key in keys:
+                entry = existing.get(lookup_key)
+                if not entry:
+                    entry = ChatCache(lookup_key=lookup_key)
+                    session.add(entry)
+                if resolved is None:
+                    # Неудачное разрешение не затирает известный ранее чат
+                    if entry.chat_id and entry.chat_type != UNRESOLVED_CHAT_TYPE:
+                        continue
+                    entry.chat_id = 0
+                    entry.chat_title = None
+                    entry.chat_type = UNRESOLVED_CHAT_TYPE
+                    entry.username = None
+                else:
+                    entry.chat_id = resolved.chat_id
+                    entry.chat_title = resolved.title
+                    entry.chat_type = resolved.chat_type
+                    entry.username = resolved.username
+                entry.resolved_at = now
+
+            await session.commit()
@@ -0,0 +1,83 @@
+"""Предохранитель (circuit breaker) для вызовов внешних сервисов."""
+import logging
+import time
+from typing import Callable
+import metrics
+from config import PROVIDER_FAILURE_THRESHOLD, PROVIDER_RESET_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Учет здоровья провайдера по результатам вызовов.
+
+    closed - вызовы разрешены; failure_threshold ошибок подряд размыкают цепь.
+    open - вызовы сразу отклоняются, не дожидаясь таймаутов; через
+    reset_timeout секунд цепь переходит в half_open. half_open - разрешен один
+    пробный вызов: успех замыкает цепь, ошибка снова размыкает. Вызывающий
+    обязан завершить каждый разрешенный вызов record_success, record_failure
+    или, если вызов отменен и ничего не говорит о здоровье провайдера,
+    release; иначе пробный вызов не освободится.
+    Состояние видно в метрике newsbot_provider_state (0/1/2).
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = PROVIDER_FAILURE_THRESHOLD,
+                 reset_timeout: float = PROVIDER_RESET_TIMEOUT, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        metrics.PROVIDER_STATE.set(0, name)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            metrics.PROVIDER_STATE.set(self.STATE_VALUES[state], self.name)
+            if state == self.OPEN:
+                metrics.PROVIDER_TRIPS.inc(self.name)
+
+    def allow(self) -> bool:
+        """Можно ли вызывать провайдер сейчас (в half_open - только один пробный вызов)."""
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self._set_state(self.HALF_OPEN)
+            self._probing = False
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Провайдер %s снова доступен", self.name)
+        self.failures = 0
+        self._probing = False
+        self._set_state(self.CLOSED)
+
+    def release(self):
+        """Завершение вызова без результата (отмена): освобождается только пробный вызов."""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    "Провайдер %s недоступен (%d ошибок подряд), повторная проверка через %s сек",
+                    self.name, self.failures, self.reset_timeout
+                )
+            self.opened_at = self.clock()
+            self._set_state(self.OPEN)
@@ -1,16 +1,34 @@
 """Classic Bot для управления фильтрами и подписками."""
+import logging
 from pyrogram import Client, filters
-from pyrogram.types import Message
+from pyrogram.types import CallbackQuery, Message
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_session, init_db
-from models import User, Filter, Subscription
-from config import BOT_TOKEN, API_ID, API_HASH
+from models import User, Filter, Subscription, DeliverySettings
+from chat_resolver import ChatResolver
+from subscription_registry import registry
+from filter_cache import filter_cache
+from filter_expr import FilterSyntaxError, compile_expression
+from digest import DELIVERY_MODES, DIGEST_FORMATS
+from feedback import FeedbackPrompter, CALLBACK_PREFIX
+import metrics
+from config import (
+    BOT_TOKEN, API_ID, API_HASH, DIGEST_DEFAULT_INTERVAL, DIGEST_DEFAULT_SIZE,
+    TOP_K_DEFAULT_WINDOW, TOP_K_DEFAULT_SIZE, FEEDBACK_ENABLED
+)
+
+logger = logging.getLogger(__name__)
 
 
 class ClassicBot:
     """Classic Bot для управления через команды."""
 
+    COMMANDS = [
+        "start", "help", "add_filter", "add_topic", "list_filters", "delete_filter",
+        "add_subscription", "list_subscriptions", "remove_subscription", "set_target_chat", "delivery"
+    ]
+
     def __init__(self):
         """Инициализация Classic Bot."""
         self.client = Client(
@@ -19,11 +37,17 @@ class ClassicBot:
             api_id=API_ID,
             api_hash=API_HASH
         )
+        self.chat_resolver = ChatResolver(self.client)
+        self.feedback = FeedbackPrompter(self.client)
         self._register_handlers()
 
     def _register_handlers(self):
         """Регистрация всех обработчиков команд."""
 
+        @self.client.on_message(filters.command(self.COMMANDS), group=-1)
+        async def count_command_handler(client: Client, message: Message):
+            metrics.COMMANDS.inc(message.command[0])
+
         @self.client.on_message(filters.command("start"))
         async def start_handler(client: Client, message: Message):
             await self.handle_start(message)
@@ -64,6 +88,14 @@ class ClassicBot:
         async def set_target_chat_handler(client: Client, message: Message):
             await self.handle_set_target_chat(message)
 
+        @self.client.on_message(filters.command("delivery"))
+        async def delivery_handler(client: Client, message: Message):
+            await self.handle_delivery(message)
+
+        @self.client.on_callback_query(filters.regex(f"^{CALLBACK_PREFIX}"))
+        async def feedback_handler(client: Client, callback_query: CallbackQuery):
+            await self.feedback.handle_vote(callback_query)
+
     async def handle_start(self, message: Message):
         """Обработка команды /start."""
         user_id = message.from_user.id
@@ -91,7 +123,8 @@ class ClassicBot:
                 "/add_subscription <username или ID> - добавить подписку на канал/чат\n"
                 "/list_subscriptions - список подписок\n"
                 "/remove_subscription <id> - удалить подписку\n"
-                "/set_target_chat - установить целевой чат для пересылки"
+                "/set_target_chat - установить целевой чат для пересылки\n"
+                "/delivery - режим доставки: мгновенно, дайджестом или top-K"
             )
             await message.reply_text(welcome_text)
 
@@ -101,6 +134,8 @@ class ClassicBot:
             "Доступные команды:\n\n"
             "Фильтры:\n"
             "/add_filter <ключевые слова через запятую> - добавить фильтр\n"
+            "   выражения: ставк AND ЦБ, NOT реклама, (нефть OR газ), "
+            "\"фраза целиком\", /регулярное выражение/ (также И, ИЛИ, НЕ)\n"
             "/add_topic <тема> - добавить тему для семантического поиска\n"
             "/list_filters - показать все фильтры\n"
             "/delete_filter <id> - удалить фильтр\n\n"
@@ -109,7 +144,13 @@ class ClassicBot:
             "/list_subscriptions - показать все подписки\n"
             "/remove_subscription <id> - отписаться\n\n"
             "Настройки:\n"
-            "/set_target_chat - установить чат для пересылки сообщений"
+            "/set_target_chat - установить чат для пересылки сообщений\n"
+            "/delivery instant - пересылать каждое совпадение сразу\n"
+            "/delivery digest [минуты] [совпадений] [links|excerpts] - присылать сводку "
+            f"раз в N минут (по умолчанию {DIGEST_DEFAULT_INTERVAL}) или каждые K совпадений "
+            f"(по умолчанию {DIGEST_DEFAULT_SIZE}) со ссылками или выдержками\n"
+            "/delivery top [минуты] [K] - пересылать только K самых релевантных совпадений "
+            f"за окно (по умолчанию {TOP_K_DEFAULT_SIZE} за {TOP_K_DEFAULT_WINDOW} мин)"
         )
         await message.reply_text(help_text)
 
@@ -119,10 +160,19 @@ class ClassicBot:
         command_parts = message.text.split(maxsplit=1)
 
         if len(command_parts) < 2:
-            await message.reply_text("Использование: /add_filter <ключевые слова через запятую>")
+            await message.reply_text(
+                "Использование: /add_filter <ключевые слова через запятую или выражение>\n"
+                "Пример: /add_filter (нефть OR газ) AND NOT спорт"
+            )
             return
 
         keywords = command_parts[1]
+        try:
+            if compile_expression(keywords) is None:
+                raise FilterSyntaxError("Пустой фильтр")
+        except FilterSyntaxError as e:
+            await message.reply_text(f"Ошибка в фильтре: {e}\nСправка по выражениям: /help")
+            return
 
         async for session in get_session():
             user_query = select(User).where(User.user_id == user_id)
@@ -142,6 +192,7 @@ class ClassicBot:
             )
             session.add(new_filter)
             await session.commit()
+            await filter_cache.invalidate(user_id)
 
             await message.reply_text(f"Фильтр добавлен! ID: {new_filter.id}")
 
@@ -174,6 +225,7 @@ class ClassicBot:
             )
             session.add(new_filter)
             await session.commit()
+            await filter_cache.invalidate(user_id)
 
             await message.reply_text(f"Тема добавлена для семантического поиска! ID: {new_filter.id}")
 
@@ -230,6 +282,7 @@ class ClassicBot:
 
             await session.delete(filter_obj)
             await session.commit()
+            await filter_cache.invalidate(user_id)
 
             await message.reply_text(f"Фильтр {filter_id} удален.")
 
@@ -256,31 +309,21 @@ class ClassicBot:
                 await session.refresh(user)
 
             try:
-                chat_id = None
-                chat_title = "Unknown"
-                
                 if chat_identifier.startswith("@"):
                     try:
-                        chat = await self.client.get_chat(chat_identifier)
-                        chat_id = chat.id
-                        chat_title = chat.title or chat.first_name or chat_identifier
-                    except Exception as e:
+                        resolved = await self.chat_resolver.resolve(chat_identifier, retry_failed=True)
+                    except Exception:
                         await message.reply_text(
                             f"Не удалось получить информацию о {chat_identifier}.\n"
                             f"Убедитесь, что Classic Bot имеет доступ к этому чату, или используйте числовой ID."
                         )
                         return
+                    chat_id = resolved.chat_id
+                    chat_title = resolved.title
+                    chat_type = resolved.chat_type
                 else:
                     try:
                         chat_id = int(chat_identifier.strip())
-                        chat_title = f"Chat {chat_id}"
-                        
-                        try:
-                            chat = await self.client.get_chat(chat_id)
-                            chat_title = chat.title or chat.first_name or f"Chat {chat_id}"
-                        except Exception:
-                            pass
-                            
                     except ValueError:
                         await message.reply_text(
                             "Неверный формат. Используйте:\n"
@@ -289,6 +332,15 @@ class ClassicBot:
                         )
                         return
 
+                    chat_title = f"Chat {chat_id}"
+                    chat_type = "unknown"
+                    try:
+                        resolved = await self.chat_resolver.resolve(chat_id)
+                        chat_title = resolved.title
+                        chat_type = resolved.chat_type
+                    except Exception:
+                        pass
+
                 existing_query = select(Subscription).where(
                     Subscription.user_id == user_id,
                     Subscription.chat_id == chat_id
@@ -300,11 +352,6 @@ class ClassicBot:
                     await message.reply_text("Вы уже подписаны на этот канал/чат.")
                     return
 
-                if chat_id < 0:
-                    chat_type = "group"
-                else:
-                    chat_type = "channel" if abs(chat_id) > 1000000000000 else "private"
-
                 subscription = Subscription(
                     user_id=user_id,
                     chat_id=chat_id,
@@ -313,6 +360,7 @@ class ClassicBot:
                 )
                 session.add(subscription)
                 await session.commit()
+                registry.add(chat_id)
 
                 await message.reply_text(
                     f"Подписка добавлена: {chat_title} (ID: {subscription.id})\n"
@@ -369,8 +417,10 @@ class ClassicBot:
                 return
 
             chat_title = subscription.chat_title
+            chat_id = subscription.chat_id
             await session.delete(subscription)
             await session.commit()
+            await registry.refresh_on_subscription_removed(chat_id)
 
             await message.reply_text(f"Подписка '{chat_title}' удалена.")
 
@@ -412,16 +462,98 @@ class ClassicBot:
 
             await message.reply_text(f"Целевой чат установлен: {target_chat_id}")
 
+    async def handle_delivery(self, message: Message):
+        """Обработка команды /delivery."""
+        user_id = message.from_user.id
+        args = message.text.split()[1:]
+
+        async for session in get_session():
+            user_query = select(User).where(User.user_id == user_id)
+            result = await session.execute(user_query)
+            user = result.scalar_one_or_none()
+
+            if not user:
+                user = User(user_id=user_id, username=message.from_user.username)
+                session.add(user)
+                await session.commit()
+
+            settings_query = select(DeliverySettings).where(DeliverySettings.user_id == user_id)
+            result = await session.execute(settings_query)
+            settings = result.scalar_one_or_none()
+
+            if not args:
+                await message.reply_text(self._describe_delivery(settings))
+                return
+
+            mode = args[0].lower()
+            if mode not in DELIVERY_MODES:
+                await message.reply_text(
+                    "Использование: /delivery instant, /delivery digest [минуты] [совпадений] [links|excerpts] "
+                    "или /delivery top [минуты] [K]"
+                )
+                return
+
+            numbers = []
+            digest_format = "links"
+            for arg in args[1:]:
+                if arg.lower() in DIGEST_FORMATS:
+                    digest_format = arg.lower()
+                    continue
+                try:
+                    numbers.append(int(arg))
+                except ValueError:
+                    await message.reply_text(f"Неизвестный параметр: {arg}")
+                    return
+            if any(value <= 0 for value in numbers):
+                await message.reply_text("Интервал и размер дайджеста должны быть больше нуля.")
+                return
+            if mode == "top":
+                default_interval, default_size = TOP_K_DEFAULT_WINDOW, TOP_K_DEFAULT_SIZE
+            else:
+                default_interval, default_size = DIGEST_DEFAULT_INTERVAL, DIGEST_DEFAULT_SIZE
+            interval = numbers[0] if numbers else default_interval
+            size = numbers[1] if len(numbers) > 1 else default_size
+
+            if not settings:
+                settings = DeliverySettings(user_id=user_id)
+                session.add(settings)
+            settings.mode = mode
+            settings.digest_interval = interval
+            settings.digest_size = size
+            settings.digest_format = digest_format
+            await session.commit()
+
+            await message.reply_text(self._describe_delivery(settings))
+
+    @staticmethod
+    def _describe_delivery(settings) -> str:
+        """Описание режима доставки для ответа пользователю."""
+        if not settings or settings.mode == "instant":
+            return "Режим доставки: мгновенная пересылка."
+        if settings.mode == "top":
+            return (
+                f"Режим доставки: {settings.digest_size} самых релевантных совпадений "
+                f"за каждые {settings.digest_interval} мин."
+            )
+        return (
+            f"Режим доставки: дайджест раз в {settings.digest_interval} мин "
+            f"или каждые {settings.digest_size} совпадений ({settings.digest_format})."
+        )
+
     async def start(self):
         """Запуск classic bot."""
         await init_db()
         await self.client.start()
-        print("Classic Bot запущен")
+        if FEEDBACK_ENABLED:
+            self.feedback.start()
+        logger.info("Classic Bot запущен")
 
     async def stop(self):
         """Остановка classic bot."""
-        await self.client.stop()
-        print("Classic Bot остановлен")
+        await self.feedback.stop()
+        if self.client.is_connected:
+            await self.client.stop()
+        logger.info("Classic Bot остановлен")
 
     def run(self):
         """Запуск classic bot в цикле событий."""
@@ -51,6 +51,140 @@ YANDEX_API_KEY = os.getenv("YANDEX_API_KEY", "")
 YANDEX_FOLDER_ID = os.getenv("YANDEX_FOLDER_ID", "")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "text-embedding-3-small")
+# Таймаут запроса к провайдеру семантики (секунды)
+SEMANTIC_PROVIDER_TIMEOUT = _get_int_env("SEMANTIC_PROVIDER_TIMEOUT", 10)
+# Запасные провайдеры семантики по порядку после SEMANTIC_PROVIDER (через запятую, например local);
+# если недоступны все, семантические фильтры пропускаются и работают только ключевые слова
+SEMANTIC_FALLBACK = [name.strip() for name in os.getenv("SEMANTIC_FALLBACK", "").split(",") if name.strip()]
+# Предохранитель провайдера: ошибок подряд до размыкания, секунд до пробного запроса;
+# ответ медленнее PROVIDER_SLOW_CALL_MS считается ошибкой (0 - не учитывать)
+PROVIDER_FAILURE_THRESHOLD = _get_int_env("PROVIDER_FAILURE_THRESHOLD", 5)
+PROVIDER_RESET_TIMEOUT = _get_int_env("PROVIDER_RESET_TIMEOUT", 30)
+PROVIDER_SLOW_CALL_MS = _get_int_env("PROVIDER_SLOW_CALL_MS", 0)
+# Тестовый провайдер (SEMANTIC_PROVIDER=mock): задержка ответа и разброс (мс),
+# доля ошибок, зерно и размерность векторов
+MOCK_PROVIDER_LATENCY_MS = _get_int_env("MOCK_PROVIDER_LATENCY_MS", 20)
+MOCK_PROVIDER_JITTER_MS = _get_int_env("MOCK_PROVIDER_JITTER_MS", 0)
+MOCK_PROVIDER_ERROR_RATE = float(os.getenv("MOCK_PROVIDER_ERROR_RATE", "0.0"))
+MOCK_PROVIDER_SEED = _get_int_env("MOCK_PROVIDER_SEED", 0)
+MOCK_PROVIDER_DIM = _get_int_env("MOCK_PROVIDER_DIM", 256)
 
+# Кэш разрешения чатов: время жизни записей (секунды), время жизни неудачных
+# разрешений (секунды) и размер LRU-кэша в памяти (записей)
+CHAT_CACHE_TTL = _get_int_env("CHAT_CACHE_TTL", 86400)
+CHAT_CACHE_NEGATIVE_TTL = _get_int_env("CHAT_CACHE_NEGATIVE_TTL", 600)
+CHAT_CACHE_MEMORY_SIZE = _get_int_env("CHAT_CACHE_MEMORY_SIZE", 10000)
 
+# Логирование: уровень (DEBUG, INFO, WARNING, ...) и формат (text или json)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
 
+# Эндпоинт метрик Prometheus (0 - выключен)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = _get_int_env("METRICS_PORT", 0)
+
+# Трассировка этапов обработки: доля сэмплируемых сообщений (0 - выключено),
+# выгрузка в файл (file) или в OTLP/HTTP-коллектор (otlp)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "file")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+
+# Число процессов-воркеров user bot (0 - один процесс, как раньше)
+USER_BOT_WORKERS = _get_int_env("USER_BOT_WORKERS", 0)
+
+# Пул аккаунтов user bot: имена сессий через запятую, квота пересылок в минуту
+# на аккаунт (0 - без ограничения) и пауза после PEER_FLOOD (секунды)
+USER_BOT_SESSIONS = [name.strip() for name in os.getenv("USER_BOT_SESSIONS", "user_bot_session").split(",") if name.strip()]
+ACCOUNT_FORWARDS_PER_MINUTE = _get_int_env("ACCOUNT_FORWARDS_PER_MINUTE", 20)
+PEER_FLOOD_COOLDOWN = _get_int_env("PEER_FLOOD_COOLDOWN", 3600)
+
+# Отложенные пересылки, когда ни у одного аккаунта нет квоты: размер очереди и число попыток
+FORWARD_RETRY_QUEUE_SIZE = _get_int_env("FORWARD_RETRY_QUEUE_SIZE", 1000)
+FORWARD_RETRY_ATTEMPTS = _get_int_env("FORWARD_RETRY_ATTEMPTS", 3)
+
+# Очередь приема сообщений: размер, число потребителей и доли заполненности, при которых
+# отбрасываются чаты без подписчиков и отключается семантический поиск
+INGEST_QUEUE_SIZE = _get_int_env("INGEST_QUEUE_SIZE", 1000)
+INGEST_CONSUMERS = _get_int_env("INGEST_CONSUMERS", 4)
+INGEST_SHED_RATIO = float(os.getenv("INGEST_SHED_RATIO", "0.5"))
+INGEST_DEGRADE_RATIO = float(os.getenv("INGEST_DEGRADE_RATIO", "0.8"))
+
+# Период перечитывания подписок из БД, сек (нужен в режиме супервизора, где classic bot
+# работает в другом процессе; 0 - выключено)
+SUBSCRIPTION_REFRESH_INTERVAL = _get_int_env("SUBSCRIPTION_REFRESH_INTERVAL", 30)
+
+# Период перечитывания и перекомпиляции фильтров из БД, сек (в одном процессе classic bot
+# сообщает об изменениях сразу; 0 - выключено)
+FILTER_REFRESH_INTERVAL = _get_int_env("FILTER_REFRESH_INTERVAL", 30)
+
+# Фоновый прогрев локальной модели при старте user bot
+SEMANTIC_WARMUP = os.getenv("SEMANTIC_WARMUP", "true").lower() in ("1", "true", "yes")
+# Пауза перед повторной загрузкой модели после неудачи (сек)
+MODEL_LOAD_RETRY_INTERVAL = _get_int_env("MODEL_LOAD_RETRY_INTERVAL", 300)
+
+# Догрузка сообщений, пропущенных за время простоя: максимум сообщений на чат,
+# размер пачки и пауза между пачками (сек), период сохранения прогресса (сек)
+BACKFILL_ENABLED = os.getenv("BACKFILL_ENABLED", "true").lower() in ("1", "true", "yes")
+BACKFILL_MAX_MESSAGES = _get_int_env("BACKFILL_MAX_MESSAGES", 500)
+BACKFILL_BATCH_SIZE = _get_int_env("BACKFILL_BATCH_SIZE", 20)
+BACKFILL_BATCH_DELAY = float(os.getenv("BACKFILL_BATCH_DELAY", "1.0"))
+PROGRESS_FLUSH_INTERVAL = _get_int_env("PROGRESS_FLUSH_INTERVAL", 10)
+
+# Журнал совпадений и пересылок (таблицы matches и forwards): запись пакетами по
+# MATCH_LOG_BATCH_SIZE строк или через MATCH_LOG_FLUSH_MS мс, не больше MATCH_LOG_MAX_BUFFER
+# строк в памяти; записи старше MATCH_LOG_RETENTION_DAYS дней удаляются (0 - хранить всегда)
+MATCH_LOG_ENABLED = os.getenv("MATCH_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+MATCH_LOG_BATCH_SIZE = _get_int_env("MATCH_LOG_BATCH_SIZE", 500)
+MATCH_LOG_FLUSH_MS = _get_int_env("MATCH_LOG_FLUSH_MS", 1000)
+MATCH_LOG_MAX_BUFFER = _get_int_env("MATCH_LOG_MAX_BUFFER", 50000)
+MATCH_LOG_RETENTION_DAYS = _get_int_env("MATCH_LOG_RETENTION_DAYS", 30)
+
+# Журнал доставок (пересылка ровно один раз): ключей (целевой чат, чат, сообщение) в памяти,
+# за сколько часов доставки загружаются из таблицы deliveries при старте и сколько дней хранятся
+DELIVERY_LEDGER_SIZE = _get_int_env("DELIVERY_LEDGER_SIZE", 100000)
+DELIVERY_LEDGER_WINDOW = _get_int_env("DELIVERY_LEDGER_WINDOW", 48)
+DELIVERY_LEDGER_RETENTION_DAYS = _get_int_env("DELIVERY_LEDGER_RETENTION_DAYS", 30)
+
+# Дайджесты: интервал по умолчанию (мин), размер по умолчанию (совпадений),
+# период проверки буфера (сек), длина выдержки (символов)
+DIGEST_DEFAULT_INTERVAL = _get_int_env("DIGEST_DEFAULT_INTERVAL", 60)
+DIGEST_DEFAULT_SIZE = _get_int_env("DIGEST_DEFAULT_SIZE", 20)
+DIGEST_CHECK_INTERVAL = _get_int_env("DIGEST_CHECK_INTERVAL", 30)
+DIGEST_EXCERPT_LENGTH = _get_int_env("DIGEST_EXCERPT_LENGTH", 200)
+
+# Доставка top-K: окно по умолчанию (мин) и число сообщений за окно
+TOP_K_DEFAULT_WINDOW = _get_int_env("TOP_K_DEFAULT_WINDOW", 60)
+TOP_K_DEFAULT_SIZE = _get_int_env("TOP_K_DEFAULT_SIZE", 5)
+# Оценка совпадения по ключевому слову на шкале схожести тем: сильное семантическое
+# совпадение обходит ключевое слово при ранжировании, пограничное - нет
+KEYWORD_MATCH_SCORE = float(os.getenv("KEYWORD_MATCH_SCORE", "0.6"))
+
+# Оценки пересланных семантических совпадений: запрос оценки у пользователя,
+# период отправки запросов classic bot (сек) и перечитывания подобранных порогов (сек)
+FEEDBACK_ENABLED = os.getenv("FEEDBACK_ENABLED", "true").lower() in ("1", "true", "yes")
+FEEDBACK_PROMPT_INTERVAL = _get_int_env("FEEDBACK_PROMPT_INTERVAL", 15)
+# Доля пересылок, по которым запрашивается оценка (каждый запрос - лишнее сообщение пользователю)
+FEEDBACK_SAMPLE_RATE = float(os.getenv("FEEDBACK_SAMPLE_RATE", "0.1"))
+# Минимум оценок 👍 и 👎 для подбора порога: без обоих классов порог не подбирается
+FEEDBACK_MIN_VOTES_PER_CLASS = _get_int_env("FEEDBACK_MIN_VOTES_PER_CLASS", 3)
+THRESHOLD_RELOAD_INTERVAL = _get_int_env("THRESHOLD_RELOAD_INTERVAL", 300)
+
+# Длинные тексты для семантического поиска разбиваются на окна предложений:
+# максимум слов в окне и окон на сообщение
+SEMANTIC_CHUNK_WORDS = _get_int_env("SEMANTIC_CHUNK_WORDS", 64)
+SEMANTIC_MAX_CHUNKS = _get_int_env("SEMANTIC_MAX_CHUNKS", 8)
+
+# Хранение эмбеддингов тем и кэша сообщений: float32, float16 или int8;
+# размер LRU-кэша эмбеддингов недавних сообщений
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float16")
+EMBEDDING_TEXT_CACHE_SIZE = _get_int_env("EMBEDDING_TEXT_CACHE_SIZE", 256)
+
+# Лемматизация слов при сравнении ключевых слов (нужен pymorphy3 или pymorphy2)
+# и размер LRU-кэша слово -> лемма
+TEXT_LEMMATIZE = os.getenv("TEXT_LEMMATIZE", "false").lower() in ("1", "true", "yes")
+LEMMA_CACHE_SIZE = _get_int_env("LEMMA_CACHE_SIZE", 50000)
+
+# Предел времени одного поиска регулярного выражения фильтра, мс (нужен модуль regex;
+# без него действует только проверка шаблона при создании фильтра)
+REGEX_TIMEOUT_MS = _get_int_env("REGEX_TIMEOUT_MS", 50)
@@ -0,0 +1,155 @@
+"""Журнал доставок для пересылки каждого сообщения в чат не больше одного раза."""
+import collections
+import logging
+import time
+from typing import Iterable, Tuple
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from database import get_session
+from models import Delivery
+from config import DELIVERY_LEDGER_SIZE, DELIVERY_LEDGER_WINDOW, DELIVERY_LEDGER_RETENTION_DAYS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# (целевой чат, чат-источник, message_id)
+DeliveryKey = Tuple[int, int, int]
+
+
+class DeliveryLedger:
+    """
+    Доставленные и пересылаемые сейчас сообщения по ключу (target_chat_id, chat_id, message_id).
+
+    Сообщение может прийти повторно (Pyrogram повторяет апдейты после
+    переподключения, догрузка после сбоя повторяет последние сообщения), а
+    несколько подписчиков могут делить один чат доставки. Перед пересылкой
+    ключ занимается (claim), поэтому второй обработчик того же сообщения
+    получает отказ, даже если первый еще ждет квоты. После неудачной
+    пересылки ключ освобождается (release).
+
+    Ключи хранятся в памяти, проверка - одна операция со словарем. Самые
+    старые ключи вытесняются сверх size. Успешная доставка сразу
+    записывается в таблицу deliveries с уникальным ключом (record), поэтому
+    журнал не зависит от журнала пересылок (match_log) и его задержки. После
+    перезапуска ключи за последние window_hours часов загружаются из этой
+    таблицы, а догрузка истории проверяет ее для своих сообщений
+    (load_messages). Ключ, которого нет в памяти (вытеснен или старше окна),
+    перед пересылкой проверяется в таблице (claim_async).
+    """
+
+    def __init__(self, size: int = DELIVERY_LEDGER_SIZE, window_hours: int = DELIVERY_LEDGER_WINDOW,
+                 retention_days: int = DELIVERY_LEDGER_RETENTION_DAYS):
+        self.size = max(1, size)
+        self.window_hours = window_hours
+        self.retention_days = retention_days
+        self._keys: "collections.OrderedDict[DeliveryKey, None]" = collections.OrderedDict()
+        metrics.DELIVERY_LEDGER_SIZE.set_function(lambda: len(self._keys))
+
+    def __contains__(self, key: DeliveryKey) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def claim(self, key: DeliveryKey) -> bool:
+        """Занять ключ перед пересылкой; False, если сообщение уже доставлено или пересылается."""
+        if key in self._keys:
+            return False
+        self._add(key)
+        return True
+
+    async def claim_async(self, key: DeliveryKey) -> bool:
+        """
+        То же, что claim, но при промахе памяти ключ ищется в таблице deliveries.
+
+        Ключ занимается в памяти до запроса к БД, поэтому параллельный
+        обработчик того же сообщения получает отказ сразу. Если БД недоступна,
+        пересылка разрешается: повтор лучше потерянной новости.
+        """
+        if not self.claim(key):
+            return False
+        try:
+            delivered = await self.delivered(key)
+        except Exception:
+            logger.exception("Не удалось проверить доставку %s", key)
+            return True
+        # Найденный ключ остается в памяти: сообщение уже доставлено
+        return not delivered
+
+    async def delivered(self, key: DeliveryKey) -> bool:
+        """Есть ли доставка ключа в таблице deliveries."""
+        target_chat_id, chat_id, message_id = key
+        query = (
+            select(Delivery.id)
+            .where(
+                Delivery.target_chat_id == target_chat_id,
+                Delivery.chat_id == chat_id,
+                Delivery.message_id == message_id
+            )
+            .limit(1)
+        )
+        found = None
+        async for session in get_session():
+            found = (await session.execute(query)).scalar_one_or_none()
+        return found is not None
+
+    def release(self, key: DeliveryKey):
+        """Освободить ключ после неудачной пересылки, чтобы сообщение можно было переслать снова."""
+        self._keys.pop(key, None)
+
+    def _add(self, key: DeliveryKey):
+        self._keys[key] = None
+        if len(self._keys) > self.size:
+            self._keys.popitem(last=False)
+
+    async def record(self, key: DeliveryKey, user_id: int):
+        """Сохранение доставки; повтор ключа (другой процесс уже записал его) не ошибка."""
+        target_chat_id, chat_id, message_id = key
+        try:
+            async for session in get_session():
+                session.add(Delivery(
+                    target_chat_id=target_chat_id, chat_id=chat_id, message_id=message_id,
+                    user_id=user_id, created_at=time.time()
+                ))
+                await session.commit()
+        except IntegrityError:
+            logger.debug("Доставка %s уже записана", key)
+        except Exception:
+            logger.exception("Не удалось сохранить доставку %s", key)
+
+    async def load(self):
+        """Загрузка недавних доставок из таблицы deliveries (от старых к новым) и удаление устаревших."""
+        if self.retention_days > 0:
+            cutoff = time.time() - self.retention_days * 86400
+            async for session in get_session():
+                await session.execute(delete(Delivery).where(Delivery.created_at < cutoff))
+                await session.commit()
+        if self.window_hours <= 0:
+            return
+        since = time.time() - self.window_hours * 3600
+        query = (
+            select(Delivery.target_chat_id, Delivery.chat_id, Delivery.message_id)
+            .where(Delivery.created_at >= since)
+            .order_by(Delivery.created_at.desc())
+            .limit(self.size)
+        )
+        async for session in get_session():
+            rows = (await session.execute(query)).all()
+        for target_chat_id, chat_id, message_id in reversed(rows):
+            self._add((target_chat_id, chat_id, message_id))
+        if rows:
+            logger.info("Загружено доставок за %d ч.: %d", self.window_hours, len(rows))
+
+    async def load_messages(self, chat_id: int, message_ids: Iterable[int]):
+        """Загрузка доставок сообщений чата (перед догрузкой истории, которая старше окна в памяти)."""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return
+        query = (
+            select(Delivery.target_chat_id, Delivery.message_id)
+            .where(Delivery.chat_id == chat_id, Delivery.message_id.in_(message_ids))
+        )
+        async for session in get_session():
+            rows = (await session.execute(query)).all()
+        for target_chat_id, message_id in rows:
+            self._add((target_chat_id, chat_id, message_id))
@@ -0,0 +1,212 @@
+"""Режим доставки дайджестами: совпадения копятся в БД и отправляются одной сводкой."""
+import asyncio
+import html
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from pyrogram.enums import ParseMode
+from pyrogram.errors import FloodWait, PeerFlood
+from sqlalchemy import delete, func, select
+from database import get_session
+from models import DeliverySettings, DigestItem, User
+from ingestion import MessageRecord
+from config import DIGEST_DEFAULT_INTERVAL, DIGEST_DEFAULT_SIZE, DIGEST_CHECK_INTERVAL, DIGEST_EXCERPT_LENGTH
+import metrics
+
+if TYPE_CHECKING:
+    from user_bot import UserBot
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_MODES = ("instant", "digest", "top")
+DIGEST_FORMATS = ("links", "excerpts")
+
+# Ограничение Telegram на длину текста сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+
+def message_link(chat_id: int, message_id: int, username: Optional[str] = None) -> str:
+    """Ссылка на сообщение: публичная по username или t.me/c/ для закрытых чатов."""
+    if username:
+        return f"https://t.me/{username}/{message_id}"
+    internal_id = str(chat_id)
+    if internal_id.startswith("-100"):
+        internal_id = internal_id[4:]
+    return f"https://t.me/c/{internal_id.lstrip('-')}/{message_id}"
+
+
+def make_excerpt(text: str, length: int = DIGEST_EXCERPT_LENGTH) -> str:
+    """Первые length символов текста в одну строку."""
+    text = " ".join(text.split())
+    return text if len(text) <= length else text[:length].rstrip() + "…"
+
+
+def format_digest(items: List[DigestItem], digest_format: str) -> List[Tuple[str, List[DigestItem]]]:
+    """Тексты сообщений дайджеста (HTML), разбитые по лимиту длины Telegram, с совпадениями каждого текста."""
+    lines = []
+    for index, item in enumerate(items, start=1):
+        link = message_link(item.chat_id, item.message_id, item.chat_username)
+        title = html.escape(item.chat_title or str(item.chat_id))
+        line = f'{index}. <a href="{link}">{title}</a>'
+        if digest_format == "excerpts" and item.excerpt:
+            line += f"\n{html.escape(item.excerpt)}"
+        lines.append(line)
+
+    separator = "\n\n" if digest_format == "excerpts" else "\n"
+    parts = []
+    current = f"Дайджест, совпадений: {len(items)}"
+    current_items: List[DigestItem] = []
+    for item, line in zip(items, lines):
+        if current_items and len(current) + len(separator) + len(line) > MAX_MESSAGE_LENGTH:
+            parts.append((current, current_items))
+            current, current_items = line, [item]
+        else:
+            current += separator + line
+            current_items.append(item)
+    parts.append((current, current_items))
+    return parts
+
+
+class DigestBuffer:
+    """
+    Буфер совпадений для пользователей в режиме дайджеста.
+
+    Совпадения хранятся в таблице digest_items и переживают перезапуск.
+    Дайджест отправляется, когда накопилось digest_size совпадений или
+    самому старому исполнилось digest_interval минут. В режиме шардирования
+    совпадения из чатов всех шардов собирает в один дайджест воркер, за
+    которым закреплен пользователь (ShardFilter.owns_user); остальные
+    воркеры только добавляют совпадения в буфер. Если дайджест состоит из
+    нескольких сообщений, совпадения удаляются по мере отправки каждого,
+    поэтому сбой посередине не повторяет уже отправленные части.
+    """
+
+    def __init__(self, bot: "UserBot", check_interval: int = DIGEST_CHECK_INTERVAL):
+        self.bot = bot
+        self.check_interval = check_interval
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _owns_user(self, user_id: int) -> bool:
+        return not self.bot.shard or self.bot.shard.owns_user(user_id)
+
+    async def add(self, user: User, settings: DeliverySettings, record: MessageRecord):
+        """Добавление совпадения в буфер; при достижении размера дайджест отправляется сразу."""
+        async for session in get_session():
+            session.add(DigestItem(
+                user_id=user.user_id,
+                chat_id=record.chat_id,
+                message_id=record.message_id,
+                chat_title=record.chat_title,
+                chat_username=record.chat_username,
+                excerpt=make_excerpt(record.text),
+                created_at=time.time()
+            ))
+            await session.commit()
+            pending = await session.execute(
+                select(func.count(DigestItem.id)).where(DigestItem.user_id == user.user_id)
+            )
+            pending_count = pending.scalar_one()
+        metrics.DIGEST_ITEMS.inc()
+
+        # Буфер другого воркера отправит его владелец при ближайшей проверке
+        if pending_count >= (settings.digest_size or DIGEST_DEFAULT_SIZE) and self._owns_user(user.user_id):
+            await self.flush_user(user.user_id)
+
+    async def flush_user(self, user_id: int):
+        """Отправка дайджеста пользователю из всех накопленных совпадений."""
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            async for session in get_session():
+                user = (await session.execute(select(User).where(User.user_id == user_id))).scalar_one_or_none()
+                settings = (await session.execute(
+                    select(DeliverySettings).where(DeliverySettings.user_id == user_id)
+                )).scalar_one_or_none()
+                result = await session.execute(
+                    select(DigestItem).where(DigestItem.user_id == user_id).order_by(DigestItem.id)
+                )
+                items = result.scalars().all()
+                if not user or not items:
+                    return
+
+                digest_format = settings.digest_format if settings and settings.digest_format else "links"
+                sent = 0
+                for text, part in format_digest(items, digest_format):
+                    if not await self._send(user, text, part[0].chat_id):
+                        break
+                    await session.execute(delete(DigestItem).where(DigestItem.id.in_([item.id for item in part])))
+                    await session.commit()
+                    sent += len(part)
+                if not sent:
+                    return
+                if sent == len(items):
+                    metrics.DIGESTS_SENT.inc()
+                logger.info("Отправлен дайджест пользователю %s: %d из %d совпадений", user_id, sent, len(items))
+
+    async def _send(self, user: User, text: str, source_chat_id: int) -> bool:
+        """Отправка одного текста дайджеста через аккаунт пула с квотой; False - повторить позже."""
+        target_chat_id = self.bot.target_chat_id(user)
+        account = self.bot.pool.pick_forwarder(source_chat_id)
+        if account is None:
+            logger.warning("Нет аккаунтов с квотой для дайджеста пользователю %s, повтор позже", user.user_id)
+            return False
+        try:
+            await account.client.send_message(
+                target_chat_id, text, parse_mode=ParseMode.HTML, disable_web_page_preview=True
+            )
+            account.record_forward()
+            metrics.ACCOUNT_FORWARDS.inc(account.name)
+        except FloodWait as e:
+            metrics.FORWARD_ERRORS.inc("flood_wait")
+            metrics.FLOOD_WAIT_SECONDS.inc(amount=e.value)
+            self.bot.pool.mark_flood_wait(account, e.value)
+            return False
+        except PeerFlood:
+            metrics.FORWARD_ERRORS.inc("peer_flood")
+            self.bot.pool.mark_peer_flood(account)
+            return False
+        except Exception as e:
+            metrics.FORWARD_ERRORS.inc("other")
+            logger.error("Ошибка отправки дайджеста пользователю %s: %s", user.user_id, e)
+            return False
+        return True
+
+    async def flush_due(self):
+        """Отправка дайджестов, у которых истек интервал или набрался размер (своих пользователей)."""
+        now = time.time()
+        async for session in get_session():
+            result = await session.execute(
+                select(
+                    DigestItem.user_id, func.min(DigestItem.created_at), func.count(DigestItem.id),
+                    DeliverySettings.digest_interval, DeliverySettings.digest_size
+                )
+                .outerjoin(DeliverySettings, DeliverySettings.user_id == DigestItem.user_id)
+                .group_by(DigestItem.user_id, DeliverySettings.digest_interval, DeliverySettings.digest_size)
+            )
+            due = [
+                user_id for user_id, oldest, count, interval, size in result.all()
+                if self._owns_user(user_id) and (
+                    now - oldest >= (interval or DIGEST_DEFAULT_INTERVAL) * 60
+                    or count >= (size or DIGEST_DEFAULT_SIZE)
+                )
+            ]
+        for user_id in due:
+            await self.flush_user(user_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="digest-flush")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.flush_due()
+            except Exception:
+                logger.exception("Ошибка отправки дайджестов")
@@ -0,0 +1,233 @@
+"""Компактное хранение эмбеддингов (float32, float16 или int8) в непрерывных массивах numpy."""
+import collections
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set
+import numpy as np
+
+DTYPES = ("float32", "float16", "int8")
+
+
+class CompactVectors(NamedTuple):
+    """Нормированные векторы в компактной форме; scales - множители строк для int8."""
+    data: np.ndarray
+    scales: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+
+def compact(vectors: np.ndarray, dtype: str) -> CompactVectors:
+    """
+    Нормирование векторов по L2 и приведение к компактной форме.
+
+    int8 - симметричная квантизация по строкам: q = round(v / scale), scale = max|v| / 127.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.maximum(norms, 1e-12)
+
+    if dtype == "float32":
+        return CompactVectors(np.ascontiguousarray(vectors))
+    if dtype == "float16":
+        return CompactVectors(vectors.astype(np.float16))
+    if dtype == "int8":
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        data = np.rint(vectors / scales[:, np.newaxis]).astype(np.int8)
+        return CompactVectors(data, scales.astype(np.float32))
+    raise ValueError(f"Неизвестный тип эмбеддингов: {dtype}")
+
+
+def cosine_matrix(left: CompactVectors, right: CompactVectors) -> np.ndarray:
+    """
+    Косинусная схожесть всех пар строк (len(left) x len(right)) по компактным векторам.
+
+    Если обе стороны int8, скалярные произведения int8·int8 накапливаются в
+    int32 и масштабируются множителями строк. Иначе умножение идет во float32,
+    а множители применяются к той стороне, у которой они есть. Приведенные
+    копии живут только на время вызова и не хранятся.
+    """
+    if left.scales is not None and right.scales is not None:
+        products = np.matmul(left.data, right.data.T, dtype=np.int32)
+        return products.astype(np.float32) * np.outer(left.scales, right.scales)
+    products = left.data.astype(np.float32, copy=False) @ right.data.astype(np.float32, copy=False).T
+    if left.scales is not None:
+        products *= left.scales[:, np.newaxis]
+    if right.scales is not None:
+        products *= right.scales[np.newaxis, :]
+    return products
+
+
+class EmbeddingStore:
+    """
+    Эмбеддинги по ключу (например, тексту темы) в одном непрерывном массиве.
+
+    Массив растет удвоением емкости, поэтому добавление амортизированно O(1),
+    а выборка строк по индексам не копирует отдельные объекты тензоров.
+    Строку можно закрепить за ключом заранее (rows), а вектор записать позже:
+    так скомпилированные фильтры хранят номера строк, не дожидаясь модели.
+    Строки, полученные через rows, считаются по ссылкам: когда последний
+    фильтр с темой освобождает ее (release), строка переиспользуется для
+    новых ключей, и хранилище не растет от удаленных и измененных фильтров.
+    """
+
+    def __init__(self, dtype: str = "float32", capacity: int = 64):
+        if dtype not in DTYPES:
+            raise ValueError(f"Неизвестный тип эмбеддингов: {dtype}")
+        self.dtype = dtype
+        self.index: Dict[str, int] = {}
+        # Ключи со строкой, но еще без вектора
+        self.pending: Set[str] = set()
+        self._initial_capacity = capacity
+        self._data: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        # Номер записи: меняется при каждом add_many
+        self.version = 0
+        # Число ссылок на ключ из rows; освобожденные строки переиспользуются
+        self._refs: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._row_count = 0
+        # release вызывается финализаторами фильтров из любого потока
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index and key not in self.pending
+
+    @property
+    def nbytes(self) -> int:
+        """Память под векторы (включая неиспользованную емкость)."""
+        if self._data is None:
+            return 0
+        return self._data.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+
+    def _reserve(self, dim: int):
+        """Емкость под все закрепленные строки."""
+        needed = self._row_count
+        if self._data is None:
+            capacity = max(self._initial_capacity, needed)
+            self._data = np.zeros((capacity, dim), dtype=np.int8 if self.dtype == "int8" else self.dtype)
+            if self.dtype == "int8":
+                self._scales = np.zeros(capacity, dtype=np.float32)
+            return
+        if dim != self._data.shape[1]:
+            raise ValueError(f"Размерность {dim} не совпадает с хранилищем ({self._data.shape[1]})")
+        current = self._data.shape[0]
+        if needed <= current:
+            return
+        capacity = max(needed, current * 2)
+        data = np.zeros((capacity, dim), dtype=self._data.dtype)
+        data[:current] = self._data
+        self._data = data
+        if self._scales is not None:
+            scales = np.zeros(capacity, dtype=np.float32)
+            scales[:current] = self._scales
+            self._scales = scales
+
+    def _position(self, key: str) -> int:
+        """Строка ключа; новому ключу закрепляется свободная строка без вектора."""
+        position = self.index.get(key)
+        if position is None:
+            if self._free:
+                position = self._free.pop()
+            else:
+                position = self._row_count
+                self._row_count += 1
+            self.index[key] = position
+            self.pending.add(key)
+        return position
+
+    def rows(self, keys: Sequence[str]) -> np.ndarray:
+        """Номера строк ключей со ссылкой на каждый ключ (освобождается через release)."""
+        positions = np.empty(len(keys), dtype=np.int64)
+        with self._lock:
+            for i, key in enumerate(keys):
+                positions[i] = self._position(key)
+                self._refs[key] = self._refs.get(key, 0) + 1
+        return positions
+
+    def release(self, keys: Sequence[str]):
+        """Снятие ссылок, взятых rows; строки ключей без ссылок освобождаются."""
+        with self._lock:
+            for key in keys:
+                refs = self._refs.get(key, 0) - 1
+                if refs > 0:
+                    self._refs[key] = refs
+                    continue
+                self._refs.pop(key, None)
+                position = self.index.pop(key, None)
+                if position is not None:
+                    self.pending.discard(key)
+                    self._free.append(position)
+
+    def add_many(self, keys: Sequence[str], vectors: np.ndarray):
+        """Добавление векторов (float32) по ключам; существующие ключи перезаписываются."""
+        vectors = compact(vectors, self.dtype)
+        with self._lock:
+            positions = np.fromiter((self._position(key) for key in keys), dtype=np.int64, count=len(keys))
+        self._reserve(vectors.data.shape[1])
+        self._data[positions] = vectors.data
+        if self._scales is not None:
+            self._scales[positions] = vectors.scales
+        self.pending.difference_update(keys)
+        self.version += 1
+
+    def missing(self, keys: Sequence[str]) -> List[str]:
+        """Ключи без вектора (без повторов, в исходном порядке)."""
+        return [key for key in dict.fromkeys(keys) if key not in self.index or key in self.pending]
+
+    def take(self, keys: Sequence[str]) -> CompactVectors:
+        """Векторы по ключам в компактной форме."""
+        return self.take_rows(np.fromiter((self.index[key] for key in keys), dtype=np.int64, count=len(keys)))
+
+    def take_rows(self, positions: np.ndarray) -> CompactVectors:
+        """Векторы по номерам строк в компактной форме."""
+        return CompactVectors(
+            self._data[positions],
+            self._scales[positions] if self._scales is not None else None
+        )
+
+
+class EmbeddingCache:
+    """Ограниченный LRU-кэш компактных эмбеддингов (например, фрагментов недавних сообщений)."""
+
+    def __init__(self, dtype: str = "float32", maxsize: int = 256):
+        self.dtype = dtype
+        self.maxsize = maxsize
+        self._items: "collections.OrderedDict[str, CompactVectors]" = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(item.nbytes for item in self._items.values())
+
+    def get(self, key: str) -> Optional[CompactVectors]:
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    def put(self, key: str, vectors: np.ndarray) -> CompactVectors:
+        item = compact(vectors, self.dtype)
+        if self.maxsize > 0:
+            self._items[key] = item
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return item
+
+
+def bytes_per_vector(dim: int, dtype: str) -> int:
+    """Байт на вектор с учетом множителя строки для int8."""
+    if dtype == "int8":
+        return dim + 4
+    return dim * np.dtype(dtype).itemsize
@@ -0,0 +1,237 @@
+"""Офлайн-оценка конфигураций FilterEngine на размеченном корпусе.
+
+Для каждой конфигурации (провайдер, модель, порог, правила, лемматизация,
+только ключевые слова) прогоняет FilterEngine по корпусу и выводит точность,
+полноту и F1 рядом с пропускной способностью и перцентилями задержки.
+С --min-f1/--min-precision/--min-recall выбирается самая быстрая
+конфигурация, проходящая планку качества.
+
+Корпус - JSONL, строка на пару "сообщение - фильтр":
+    {"text": "ЦБ сохранил ставку", "topics": "финансы", "relevant": true}
+    {"text": "Скидки на молоко", "keywords": "ставк AND ЦБ", "relevant": false}
+
+Конфигурации - JSON-список объектов с полями name, provider, fallback, model,
+threshold (null - эвристические пороги), rules, lemmatize, semantic.
+Без файлов используются встроенные пример корпуса и набор конфигураций.
+Семантика проверяется через провайдер (match_async), поэтому provider
+"mock" позволяет прогнать оценку без модели и сети.
+
+Пример:
+    python evaluate_filters.py --dataset labeled.jsonl --configs configs.json --min-f1 0.8
+    python evaluate_filters.py --output eval.json
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+from filter_engine import FilterEngine
+from filter_expr import compile_expression
+from text_normalizer import normalizer
+from config import SEMANTIC_MODEL, SEMANTIC_PROVIDER
+
+# Пользователь, от имени которого задается порог конфигурации с правилами (через calibrated_thresholds)
+EVAL_USER_ID = 0
+
+SAMPLE_DATASET = [
+    {"text": "Крайний срок сдачи отчета - пятница, не забудьте", "topics": "дедлайн", "relevant": True},
+    {"text": "Дедлайн по проекту перенесли на понедельник", "topics": "дедлайн", "relevant": True},
+    {"text": "Купить молоко и продукты на выходные", "topics": "дедлайн", "relevant": False},
+    {"text": "Привет, как дела? Погода сегодня отличная", "topics": "дедлайн", "relevant": False},
+    {"text": "Готово, спасибо", "topics": "дедлайн", "relevant": False},
+    {"text": "Команда выпустила новую версию приложения на Python", "topics": "программирование", "relevant": True},
+    {"text": "Как написать код, который легко поддерживать", "topics": "программирование", "relevant": True},
+    {"text": "Встреча по проекту завтра в десять", "topics": "программирование", "relevant": False},
+    {"text": "Совещание перенесли на четверг", "topics": "встреча", "relevant": True},
+    {"text": "Собрание акционеров пройдет в мае", "topics": "встреча", "relevant": True},
+    {"text": "Погода на неделю: снег и мороз", "topics": "встреча", "relevant": False},
+    {"text": "Центробанк сохранил ключевую ставку на прежнем уровне", "topics": "финансы, экономика", "relevant": True},
+    {"text": "Курс доллара на бирже снизился", "topics": "финансы, экономика", "relevant": True},
+    {"text": "Сборная сыграет товарищеский матч в следующем месяце", "topics": "финансы, экономика", "relevant": False},
+    {"text": "Сборная сыграет товарищеский матч в следующем месяце", "topics": "спорт", "relevant": True},
+    {"text": "В Москве ожидается сильный снегопад", "topics": "спорт", "relevant": False},
+    {"text": "В Москве ожидается сильный снегопад", "topics": "погода", "relevant": True},
+    {"text": "Стартап в области ИИ привлек инвестиции", "topics": "технологии", "relevant": True},
+    {"text": "The central bank kept its key interest rate unchanged", "topics": "финансы", "relevant": True},
+    {"text": "Heavy snowfall is expected in the capital", "topics": "финансы", "relevant": False},
+    {"text": "ЦБ поднял ключевую ставку до 16%", "keywords": "ставк AND ЦБ", "relevant": True},
+    {"text": "Ставку в букмекерской конторе сделал на ЦСКА", "keywords": "ставк AND ЦБ", "relevant": False},
+    {"text": "Вышел Python 3.13 с новым JIT", "keywords": "python, golang", "relevant": True},
+    {"text": "Питон в зоопарке съел кролика", "keywords": "python, golang", "relevant": False},
+    {"text": "Нефть и газ подорожали после заявления ОПЕК", "keywords": "(нефть OR газ) AND NOT спорт", "relevant": True},
+    {"text": "Газпром проиграл в матче чемпионата по футболу", "keywords": "(нефть OR газ) AND NOT спорт",
+     "relevant": False},
+]
+
+DEFAULT_CONFIGS = [
+    {"name": "keywords-only", "semantic": False},
+    {"name": "semantic-rules", "threshold": None, "rules": True},
+    {"name": "semantic-plain-0.40", "threshold": 0.40, "rules": False},
+    {"name": "semantic-plain-0.50", "threshold": 0.50, "rules": False},
+]
+
+
+def load_dataset(path: Optional[str]) -> List[dict]:
+    if not path:
+        return SAMPLE_DATASET
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_configs(path: Optional[str]) -> List[dict]:
+    if not path:
+        return DEFAULT_CONFIGS
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def build_engine(config: dict, models: Dict[str, object]) -> FilterEngine:
+    """Движок конфигурации; загруженные модели переиспользуются между конфигурациями."""
+    engine = FilterEngine(
+        semantic_provider=config.get("provider") or SEMANTIC_PROVIDER,
+        model_name=config.get("model") or SEMANTIC_MODEL,
+        use_rules=config.get("rules", True),
+        fallback=config.get("fallback", []),
+    )
+    if config.get("threshold") is not None:
+        if engine.use_rules:
+            # С правилами порог, как подобранный по оценкам, только ужесточает эвристики
+            engine.calibrated_thresholds = {(EVAL_USER_ID, None): float(config["threshold"])}
+        else:
+            engine.semantic_threshold = float(config["threshold"])
+    if config.get("semantic", True) and engine.uses_local_model:
+        if engine.model_name not in models:
+            # Неудачная загрузка запоминается движком и не повторяется на каждом сообщении
+            engine._warm_up()
+            models[engine.model_name] = engine.semantic_model
+        elif models[engine.model_name] is not None:
+            engine.semantic_model = models[engine.model_name]
+            engine.semantic_initialized = True
+    return engine
+
+
+async def evaluate(config: dict, dataset: List[dict], models: Dict[str, object]) -> dict:
+    """Качество и стоимость одной конфигурации."""
+    # Выражения компилируются в нормализованном виде, поэтому при смене лемматизации кэш сбрасывается
+    normalizer.lemmatize = bool(config.get("lemmatize", False))
+    compile_expression.cache_clear()
+
+    engine = build_engine(config, models)
+    allow_semantic = config.get("semantic", True)
+    compiled = [
+        engine.compile_filters([{
+            "id": index,
+            "keywords": item.get("keywords"),
+            "topics": item.get("topics"),
+            "use_semantic": bool(item.get("topics")),
+        }])
+        for index, item in enumerate(dataset)
+    ]
+
+    counts = dict.fromkeys(("tp", "fp", "fn", "tn"), 0)
+    latencies = []
+    errors = []
+    started = time.perf_counter()
+    for item, filters in zip(dataset, compiled):
+        message_started = time.perf_counter()
+        match = await engine.match_async(item["text"], filters, allow_semantic=allow_semantic, user_id=EVAL_USER_ID)
+        latencies.append((time.perf_counter() - message_started) * 1000)
+        predicted, relevant = match is not None, bool(item["relevant"])
+        key = ("t" if predicted == relevant else "f") + ("p" if predicted else "n")
+        counts[key] += 1
+        if predicted != relevant:
+            errors.append({"text": item["text"], "filter": item.get("keywords") or item.get("topics"),
+                           "relevant": relevant, "score": match.score if match else None})
+    elapsed = time.perf_counter() - started
+    await engine.close()
+    # Удаленные провайдеры и mock не загружают модель; их ошибки видны по качеству
+    model_loaded = engine.semantic_model is not None if engine.semantic_provider == "local" else True
+
+    precision = counts["tp"] / (counts["tp"] + counts["fp"]) if counts["tp"] + counts["fp"] else 0.0
+    recall = counts["tp"] / (counts["tp"] + counts["fn"]) if counts["tp"] + counts["fn"] else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "config": config,
+        "model_loaded": model_loaded if allow_semantic else None,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        **counts,
+        "throughput_msg_s": len(dataset) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        },
+        "errors": errors,
+    }
+
+
+async def evaluate_all(configs: List[dict], dataset: List[dict]) -> List[dict]:
+    models: Dict[str, object] = {}
+    return [await evaluate(config, dataset, models) for config in configs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", help="Размеченный корпус (JSONL)")
+    parser.add_argument("--configs", help="Конфигурации (JSON-список)")
+    parser.add_argument("--min-precision", type=float, default=0.0, help="Планка точности")
+    parser.add_argument("--min-recall", type=float, default=0.0, help="Планка полноты")
+    parser.add_argument("--min-f1", type=float, default=0.0, help="Планка F1")
+    parser.add_argument("--show-errors", action="store_true", help="Показать ошибки классификации")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.dataset)
+    configs = load_configs(args.configs)
+    results = asyncio.run(evaluate_all(configs, dataset))
+
+    print(f"Корпус: {len(dataset)} пар, релевантных {sum(1 for item in dataset if item['relevant'])}")
+    print(f"{'конфигурация':<24} {'точн.':>6} {'полн.':>6} {'F1':>6} {'сообщ/с':>9} {'p50 мс':>8} {'p95 мс':>8}")
+    for result in results:
+        print(
+            f"{result['config'].get('name', '?'):<24} {result['precision']:>6.3f} {result['recall']:>6.3f} "
+            f"{result['f1']:>6.3f} {result['throughput_msg_s']:>9.1f} "
+            f"{result['latency_ms']['p50']:>8.2f} {result['latency_ms']['p95']:>8.2f}"
+        )
+        if result["model_loaded"] is False:
+            print("    модель не загружена: семантические фильтры не срабатывали")
+        if args.show_errors:
+            for error in result["errors"]:
+                kind = "пропуск" if error["relevant"] else "лишнее"
+                print(f"    {kind}: [{error['filter']}] {error['text'][:80]}")
+
+    passing = [
+        result for result in results
+        if result["model_loaded"] is not False
+        and result["precision"] >= args.min_precision and result["recall"] >= args.min_recall
+        and result["f1"] >= args.min_f1
+    ]
+    best = max(passing, key=lambda result: result["throughput_msg_s"]) if passing else None
+    if best:
+        print(f"Самая быстрая конфигурация, проходящая планку: {best['config'].get('name')}")
+    else:
+        print("Ни одна конфигурация не проходит планку качества")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"dataset_size": len(dataset), "results": results,
+                       "selected": best["config"].get("name") if best else None}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+    return 0 if best else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""Оценки пересланных совпадений (👍/👎) и подбор порогов схожести по ним."""
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from pyrogram import Client
+from pyrogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import delete, select
+from database import get_session
+from models import MatchFeedback, SemanticThreshold
+from filter_engine import MatchResult
+from ingestion import MessageRecord
+from digest import message_link
+from config import FEEDBACK_PROMPT_INTERVAL, FEEDBACK_SAMPLE_RATE, FEEDBACK_MIN_VOTES_PER_CLASS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Префикс callback_data кнопок оценки: fb:<id записи>:<1 или -1>
+CALLBACK_PREFIX = "fb:"
+
+
+async def record_match(user_id: int, record: MessageRecord, match: MatchResult,
+                       sample_rate: float = FEEDBACK_SAMPLE_RATE):
+    """
+    Сохранение пересланного семантического совпадения для последующей оценки.
+
+    Оценка запрашивается отдельным сообщением, поэтому сохраняется только доля
+    sample_rate пересылок: иначе каждая пересылка удваивала бы число сообщений.
+    """
+    if random.random() >= sample_rate:
+        return
+    metrics.FEEDBACK_SAMPLED.inc()
+    async for session in get_session():
+        session.add(MatchFeedback(
+            user_id=user_id,
+            chat_id=record.chat_id,
+            message_id=record.message_id,
+            filter_id=match.filter_id,
+            topic=match.matched.lower().strip(),
+            score=match.score,
+            text_length=len(record.text.split()) or None,
+            created_at=time.time()
+        ))
+        await session.commit()
+
+
+async def load_thresholds() -> Dict[Tuple[int, Optional[str]], float]:
+    """Подобранные пороги из таблицы semantic_thresholds."""
+    async for session in get_session():
+        result = await session.execute(
+            select(SemanticThreshold.user_id, SemanticThreshold.topic, SemanticThreshold.threshold)
+        )
+        return {(user_id, topic): threshold for user_id, topic, threshold in result.all()}
+    return {}
+
+
+def fit_threshold(samples: Iterable[Tuple[float, int]],
+                  min_per_class: int = FEEDBACK_MIN_VOTES_PER_CLASS) -> Optional[float]:
+    """
+    Порог схожести, максимизирующий F1 для оценок 👍 на выборке (score, vote).
+
+    Пороги-кандидаты - сами значения схожести. При равном F1 выбирается больший
+    порог (меньше лишних пересылок). Если оценок 👍 или 👎 меньше min_per_class,
+    возвращается None: по одному классу порог не подобрать, а порог выше
+    максимальной схожести отключил бы все совпадения пользователя.
+    """
+    samples = sorted(samples)
+    positives = sum(1 for _, vote in samples if vote > 0)
+    if positives < max(1, min_per_class) or len(samples) - positives < max(1, min_per_class):
+        return None
+
+    best_threshold, best_f1 = samples[0][0], -1.0
+    true_positives, predicted = positives, len(samples)
+    for index, (score, vote) in enumerate(samples):
+        # Порог score: пересылаются samples[index:]
+        if index == 0 or score != samples[index - 1][0]:
+            precision = true_positives / predicted
+            recall = true_positives / positives
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            if f1 >= best_f1:
+                best_threshold, best_f1 = score, f1
+        if vote > 0:
+            true_positives -= 1
+        predicted -= 1
+    return round(best_threshold, 4)
+
+
+async def calibrate(min_samples: int = 10, dry_run: bool = False,
+                    min_per_class: int = FEEDBACK_MIN_VOTES_PER_CLASS) -> List[dict]:
+    """
+    Подбор порогов по накопленным оценкам: по теме пользователя, если оценок
+    хватает (всего min_samples и min_per_class каждого класса), и общий для
+    пользователя. Результат заменяет таблицу semantic_thresholds.
+    """
+    async for session in get_session():
+        result = await session.execute(
+            select(MatchFeedback.user_id, MatchFeedback.topic, MatchFeedback.score, MatchFeedback.vote)
+            .where(MatchFeedback.vote.is_not(None))
+        )
+        by_key: Dict[Tuple[int, Optional[str]], List[Tuple[float, int]]] = defaultdict(list)
+        for user_id, topic, score, vote in result.all():
+            by_key[(user_id, topic)].append((score, vote))
+            by_key[(user_id, None)].append((score, vote))
+
+        fitted = []
+        now = time.time()
+        for (user_id, topic), samples in sorted(by_key.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+            if len(samples) < min_samples:
+                continue
+            threshold = fit_threshold(samples, min_per_class)
+            if threshold is None:
+                continue
+            fitted.append({
+                "user_id": user_id,
+                "topic": topic,
+                "threshold": threshold,
+                "samples": len(samples),
+                "positive": sum(1 for _, vote in samples if vote > 0),
+            })
+
+        if not dry_run:
+            await session.execute(delete(SemanticThreshold))
+            for item in fitted:
+                session.add(SemanticThreshold(
+                    user_id=item["user_id"], topic=item["topic"], threshold=item["threshold"],
+                    samples=item["samples"], fitted_at=now
+                ))
+            await session.commit()
+        return fitted
+    return []
+
+
+class FeedbackPrompter:
+    """
+    Запросы оценок от имени classic bot.
+
+    User bot пересылает сообщения от аккаунта пользователя и не может прикрепить
+    кнопки, поэтому classic bot отправляет в свой чат с пользователем короткое
+    сообщение со ссылкой на пересланный пост и кнопками 👍/👎.
+    """
+
+    def __init__(self, client: Client, interval: int = FEEDBACK_PROMPT_INTERVAL):
+        self.client = client
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def send_pending(self):
+        """Отправка запросов оценки для новых записей."""
+        async for session in get_session():
+            result = await session.execute(
+                select(MatchFeedback).where(MatchFeedback.prompted.is_(False)).order_by(MatchFeedback.id).limit(50)
+            )
+            for item in result.scalars().all():
+                item.prompted = True
+                keyboard = InlineKeyboardMarkup([[
+                    InlineKeyboardButton("👍", callback_data=f"{CALLBACK_PREFIX}{item.id}:1"),
+                    InlineKeyboardButton("👎", callback_data=f"{CALLBACK_PREFIX}{item.id}:-1"),
+                ]])
+                try:
+                    await self.client.send_message(
+                        item.user_id,
+                        f"Тема «{item.topic}» (схожесть {item.score:.2f}): "
+                        f"{message_link(item.chat_id, item.message_id)}\nПолезно?",
+                        reply_markup=keyboard,
+                        disable_web_page_preview=True
+                    )
+                except Exception as e:
+                    logger.warning("Не удалось запросить оценку у пользователя %s: %s", item.user_id, e)
+            await session.commit()
+
+    async def handle_vote(self, callback_query: CallbackQuery):
+        """Сохранение оценки из нажатой кнопки."""
+        try:
+            feedback_id, vote = callback_query.data[len(CALLBACK_PREFIX):].split(":")
+            feedback_id, vote = int(feedback_id), int(vote)
+        except ValueError:
+            await callback_query.answer()
+            return
+
+        async for session in get_session():
+            result = await session.execute(
+                select(MatchFeedback).where(
+                    MatchFeedback.id == feedback_id,
+                    MatchFeedback.user_id == callback_query.from_user.id
+                )
+            )
+            item = result.scalar_one_or_none()
+            if not item:
+                await callback_query.answer("Запись не найдена")
+                return
+            item.vote = 1 if vote > 0 else -1
+            item.voted_at = time.time()
+            await session.commit()
+
+        metrics.FEEDBACK_VOTES.inc("up" if vote > 0 else "down")
+        await callback_query.answer("Спасибо за оценку")
+        try:
+            await callback_query.edit_message_reply_markup(None)
+        except Exception:
+            pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="feedback-prompts")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.send_pending()
+            except Exception:
+                logger.exception("Ошибка отправки запросов оценки")
@@ -0,0 +1,115 @@
+"""Кэш скомпилированных фильтров пользователей: фильтры разбираются один раз при изменении, а не на каждое сообщение."""
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+from sqlalchemy import select
+from database import get_session
+from models import Filter
+from filter_engine import CompiledFilter
+from embedding_store import EmbeddingStore
+from config import FILTER_REFRESH_INTERVAL
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FilterCache:
+    """
+    Скомпилированные фильтры по пользователям.
+
+    Фильтры загружаются из БД целиком и компилируются только при изменении
+    исходных полей. В одном процессе classic bot сообщает об изменениях
+    напрямую (invalidate); в режиме супервизора воркеры перечитывают
+    таблицу раз в FILTER_REFRESH_INTERVAL секунд, как реестр подписок.
+    """
+
+    def __init__(self):
+        self.users: Dict[int, Tuple[CompiledFilter, ...]] = {}
+        self.semantic_users: Set[int] = set()
+        self.loaded = False
+        self._by_id: Dict[int, CompiledFilter] = {}
+        self._topic_store: Optional[EmbeddingStore] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        metrics.COMPILED_FILTERS.set_function(lambda: len(self._by_id))
+
+    def bind(self, topic_store: EmbeddingStore):
+        """Привязка к хранилищу эмбеддингов движка: номера строк тем действуют только в нем."""
+        if topic_store is not self._topic_store:
+            self._topic_store = topic_store
+            self.users = {}
+            self.semantic_users = set()
+            self._by_id = {}
+            self.loaded = False
+
+    def get(self, user_id: int) -> Tuple[CompiledFilter, ...]:
+        return self.users.get(user_id, ())
+
+    def has_semantic(self, user_id: int) -> bool:
+        return user_id in self.semantic_users
+
+    def _compile(self, item: Filter, previous: Dict[int, CompiledFilter]) -> CompiledFilter:
+        compiled = previous.get(item.id)
+        if compiled is None or compiled.source != (item.keywords, item.topics, bool(item.use_semantic)):
+            compiled = CompiledFilter(item.id, item.keywords, item.topics, item.use_semantic, self._topic_store)
+        return compiled
+
+    async def load(self, user_id: Optional[int] = None):
+        """Перезагрузка фильтров всех пользователей или одного пользователя."""
+        async for session in get_session():
+            query = select(Filter).order_by(Filter.id)
+            if user_id is not None:
+                query = query.where(Filter.user_id == user_id)
+            result = await session.execute(query)
+            rows = result.scalars().all()
+
+        by_user = defaultdict(list)
+        by_id: Dict[int, CompiledFilter] = {}
+        for item in rows:
+            compiled = self._compile(item, self._by_id)
+            by_user[item.user_id].append(compiled)
+            by_id[item.id] = compiled
+
+        if user_id is None:
+            self.users = {uid: tuple(items) for uid, items in by_user.items()}
+            self._by_id = by_id
+            self.loaded = True
+        else:
+            for compiled in self.users.get(user_id, ()):
+                self._by_id.pop(compiled.filter_id, None)
+            self._by_id.update(by_id)
+            if by_user:
+                self.users[user_id] = tuple(by_user[user_id])
+            else:
+                self.users.pop(user_id, None)
+        self.semantic_users = {uid for uid, items in self.users.items() if any(f.topics for f in items)}
+        logger.debug("Скомпилированные фильтры: %d пользователь(ей), %d фильтр(ов)", len(self.users), len(self._by_id))
+
+    async def invalidate(self, user_id: int):
+        """Перекомпиляция фильтров пользователя после изменения (если кэш используется в процессе)."""
+        if self.loaded:
+            await self.load(user_id)
+
+    def start_refresh(self, interval: int = FILTER_REFRESH_INTERVAL):
+        """Запуск периодической перезагрузки из БД (0 - выключено)."""
+        if interval > 0 and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(interval), name="filter-refresh")
+
+    async def stop_refresh(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def _refresh_loop(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("Не удалось обновить фильтры")
+
+
+# Общий экземпляр процесса: classic bot и user bot в одном процессе видят одни фильтры
+filter_cache = FilterCache()
@@ -1,41 +1,266 @@
 """Движок фильтрации сообщений."""
+import asyncio
 import re
-import aiohttp
-import json
-from typing import List, Optional
-from sentence_transformers import SentenceTransformer
-from torch.nn.functional import cosine_similarity
+import threading
+import time
+import logging
+import weakref
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+import metrics
+import tracing
 from config import (
-    SEMANTIC_PROVIDER, SEMANTIC_MODEL, SEMANTIC_THRESHOLD,
-    OPENROUTER_API_KEY, OPENROUTER_MODEL,
-    YANDEX_API_KEY, YANDEX_FOLDER_ID,
-    OPENAI_API_KEY, OPENAI_MODEL
+    SEMANTIC_PROVIDER, SEMANTIC_MODEL, SEMANTIC_THRESHOLD, SEMANTIC_CHUNK_WORDS, SEMANTIC_MAX_CHUNKS,
+    SEMANTIC_FALLBACK, SEMANTIC_PROVIDER_TIMEOUT, PROVIDER_SLOW_CALL_MS,
+    EMBEDDING_DTYPE, EMBEDDING_TEXT_CACHE_SIZE, KEYWORD_MATCH_SCORE, MODEL_LOAD_RETRY_INTERVAL
 )
+from embedding_store import CompactVectors, EmbeddingCache, EmbeddingStore, cosine_matrix
+from filter_expr import KeywordExpression, PreparedText, compile_legacy
+from circuit_breaker import CircuitBreaker
+from semantic_providers import ProviderError, ProviderUnavailable, SemanticProvider, create_provider
+from text_normalizer import normalizer
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+def split_chunks(text: str, max_words: int = SEMANTIC_CHUNK_WORDS,
+                 max_chunks: int = SEMANTIC_MAX_CHUNKS) -> List[str]:
+    """
+    Разбиение длинного текста на окна из целых предложений не длиннее max_words слов.
+
+    Короткий текст возвращается как есть. Предложение длиннее окна режется по словам.
+    Возвращается не больше max_chunks первых окон: в новостях главное обычно в начале.
+    """
+    words = text.split()
+    if len(words) <= max_words:
+        return [text]
+
+    chunks: List[str] = []
+    window: List[str] = []
+    for sentence in _SENTENCE_BOUNDARY.split(text):
+        sentence_words = sentence.split()
+        if len(window) + len(sentence_words) > max_words and window:
+            chunks.append(" ".join(window))
+            window = []
+        while len(sentence_words) > max_words:
+            chunks.append(" ".join(sentence_words[:max_words]))
+            sentence_words = sentence_words[max_words:]
+        window.extend(sentence_words)
+        if len(chunks) >= max_chunks:
+            return chunks[:max_chunks]
+    if window:
+        chunks.append(" ".join(window))
+    return chunks[:max_chunks]
+
+
+class MatchResult(NamedTuple):
+    """Результат срабатывания фильтра."""
+    filter_id: Optional[int]
+    kind: str
+    score: float
+    matched: str
+
+
+class CompiledFilter:
+    """
+    Неизменяемое представление фильтра для проверки сообщений.
+
+    Выражение по ключевым словам уже скомпилировано (filter_expr), темы
+    разделены, а за каждой темой закреплена строка в хранилище эмбеддингов
+    движка (topic_rows), поэтому проверка не разбирает строки и не создает
+    объектов на каждое сообщение. Когда объект фильтра удаляется (фильтр
+    изменен или удален), его строки освобождаются в хранилище.
+    """
+
+    __slots__ = (
+        "filter_id", "keywords_text", "topics_text", "use_semantic", "keywords", "topics", "topic_rows", "__weakref__"
+    )
+
+    def __init__(self, filter_id: Optional[int], keywords_text: Optional[str], topics_text: Optional[str],
+                 use_semantic: bool, topic_store: Optional[EmbeddingStore] = None):
+        keywords = compile_legacy(keywords_text)
+        topics = tuple(t.strip() for t in (topics_text or "").split(",") if t.strip()) if use_semantic else ()
+        topic_rows = None
+        if topics and topic_store is not None:
+            topic_rows = topic_store.rows(topics)
+            topic_rows.flags.writeable = False
+            weakref.finalize(self, topic_store.release, topics)
+
+        set_slot = object.__setattr__
+        set_slot(self, "filter_id", filter_id)
+        set_slot(self, "keywords_text", keywords_text)
+        set_slot(self, "topics_text", topics_text)
+        set_slot(self, "use_semantic", bool(use_semantic))
+        set_slot(self, "keywords", keywords)
+        set_slot(self, "topics", topics)
+        set_slot(self, "topic_rows", topic_rows)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledFilter неизменяем: при изменении фильтра создается новый объект")
+
+    def __repr__(self) -> str:
+        return f"CompiledFilter(id={self.filter_id}, keywords={self.keywords}, topics={self.topics})"
+
+    @property
+    def source(self) -> Tuple[Optional[str], Optional[str], bool]:
+        """Исходные поля фильтра: по ним видно, нужна ли перекомпиляция."""
+        return self.keywords_text, self.topics_text, self.use_semantic
+
+    @classmethod
+    def from_dict(cls, item: dict, topic_store: Optional[EmbeddingStore] = None) -> "CompiledFilter":
+        return cls(item.get("id"), item.get("keywords"), item.get("topics"), item.get("use_semantic"), topic_store)
 
 
 class FilterEngine:
     """Движок для фильтрации сообщений по ключевым словам и семантике."""
 
-    def __init__(self):
-        """Инициализация движка фильтрации."""
+    def __init__(self, semantic_provider: Optional[str] = None, model_name: Optional[str] = None,
+                 use_rules: bool = True, fallback: Optional[Sequence[str]] = None):
+        """
+        Инициализация движка фильтрации.
+
+        Args:
+            semantic_provider: Провайдер семантики (по умолчанию SEMANTIC_PROVIDER)
+            model_name: Локальная модель (по умолчанию SEMANTIC_MODEL)
+            use_rules: False - без эвристик по длине текста и правил ложных срабатываний,
+                только сравнение схожести с порогом (для офлайн-оценки)
+            fallback: Запасные провайдеры по порядку (по умолчанию SEMANTIC_FALLBACK)
+        """
         self.semantic_model = None
         self.semantic_initialized = False
-        self.semantic_provider = SEMANTIC_PROVIDER
+        self.semantic_provider = semantic_provider or SEMANTIC_PROVIDER
+        self.model_name = model_name or SEMANTIC_MODEL
+        self.use_rules = use_rules
+        # Порог схожести без эвристик (use_rules=False)
+        self.semantic_threshold = SEMANTIC_THRESHOLD
+        # Оценка совпадения по ключевому слову, сравнимая со схожестью тем
+        self.keyword_score = KEYWORD_MATCH_SCORE
+        # Загрузка может идти одновременно из фонового прогрева и из цикла событий
+        self._init_lock = threading.Lock()
+        self._warm_up_task: Optional[asyncio.Task] = None
+        # Неудачная загрузка модели повторяется не чаще load_retry_interval секунд
+        self.load_retry_interval = MODEL_LOAD_RETRY_INTERVAL
+        self._load_failed_at: Optional[float] = None
+        # Эмбеддинги тем и недавних сообщений в компактной форме (EMBEDDING_DTYPE)
+        self.topic_store = EmbeddingStore(EMBEDDING_DTYPE)
+        self.text_cache = EmbeddingCache(EMBEDDING_DTYPE, EMBEDDING_TEXT_CACHE_SIZE)
+        metrics.EMBEDDING_BYTES.set_function(lambda: self.topic_store.nbytes, "topics")
+        metrics.EMBEDDING_BYTES.set_function(lambda: self.text_cache.nbytes, "texts")
+
+        # Цепочка провайдеров для асинхронной проверки (match_async): основной и запасные.
+        # У каждого свой предохранитель; если недоступны все, остаются только ключевые слова
+        names = (self.semantic_provider, *(SEMANTIC_FALLBACK if fallback is None else fallback))
+        self.providers: Tuple[SemanticProvider, ...] = tuple(
+            self._create_provider(name) for name in dict.fromkeys(names)
+        )
+        self.provider = self.providers[0]
+        self.uses_local_model = any(provider.name == "local" for provider in self.providers)
+        self.breakers: Dict[str, CircuitBreaker] = {
+            provider.name: CircuitBreaker(provider.name) for provider in self.providers
+        }
+        self.provider_timeout = SEMANTIC_PROVIDER_TIMEOUT
+        self.slow_call_ms = PROVIDER_SLOW_CALL_MS
+        # Запасные провайдеры эмбеддингов кодируют в своем пространстве, поэтому
+        # их векторы хранятся отдельно; строки тем фильтров относятся к основному
+        self.stores: Dict[str, Tuple[EmbeddingStore, EmbeddingCache]] = {
+            self.provider.name: (self.topic_store, self.text_cache)
+        }
+        for provider in self.providers[1:]:
+            if provider.kind == "embedding":
+                stores = self.stores[provider.name] = (
+                    EmbeddingStore(EMBEDDING_DTYPE), EmbeddingCache(EMBEDDING_DTYPE, EMBEDDING_TEXT_CACHE_SIZE)
+                )
+                metrics.EMBEDDING_BYTES.set_function(lambda store=stores[0]: store.nbytes, f"topics_{provider.name}")
+                metrics.EMBEDDING_BYTES.set_function(lambda cache=stores[1]: cache.nbytes, f"texts_{provider.name}")
+        # Нормализация текста для ключевых слов (общая с выражениями фильтров)
+        self.normalizer = normalizer
+        # Пороги, подобранные по оценкам пользователей: (user_id, тема или None) -> порог
+        self.calibrated_thresholds: Dict[Tuple[int, Optional[str]], float] = {}
+
+    def _create_provider(self, name: str) -> SemanticProvider:
+        if name == "local":
+            # Локальная модель кодирует тексты функцией движка и остается доступной синхронно
+            return create_provider(name, encoder=self._encode_local, ready=lambda: self.semantic_model is not None)
+        return create_provider(name)
+
+    def _load_due(self) -> bool:
+        """Нужна ли загрузка модели: она не загружена, а после неудачи прошло load_retry_interval."""
+        if self.semantic_initialized:
+            return False
+        return self._load_failed_at is None or time.monotonic() - self._load_failed_at >= self.load_retry_interval
 
     def _init_semantic(self):
-        """Ленивая инициализация модели для семантического поиска."""
-        if not self.semantic_initialized:
-            if self.semantic_provider == "local":
+        """Ленивая инициализация модели для семантического поиска (блокирует поток на время загрузки)."""
+        if not self._load_due():
+            return
+        with self._init_lock:
+            if not self._load_due():
+                return
+            if self.uses_local_model:
                 try:
-                    self.semantic_model = SentenceTransformer(SEMANTIC_MODEL)
+                    started = time.perf_counter()
+                    # Тяжелые импорты откладываются до первой необходимости: развертывания
+                    # только с ключевыми словами не платят за загрузку torch при старте
+                    from sentence_transformers import SentenceTransformer
+                    self.semantic_model = SentenceTransformer(self.model_name)
+                    metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - started)
                     self.semantic_initialized = True
-                    print(f"Локальная модель загружена: {SEMANTIC_MODEL}")
+                    self._load_failed_at = None
+                    logger.info("Локальная модель загружена: %s", self.model_name)
                 except Exception as e:
-                    print(f"Ошибка инициализации локальной модели: {e}")
+                    # До повтора локальная модель пропускается в цепочке провайдеров
+                    logger.error("Ошибка инициализации локальной модели: %s (повтор через %d сек)",
+                                 e, self.load_retry_interval)
                     self.semantic_initialized = False
+                    self._load_failed_at = time.monotonic()
             else:
                 self.semantic_initialized = True
-                print(f"Используется провайдер: {self.semantic_provider}")
+                logger.info("Используется провайдер: %s", self.semantic_provider)
+
+    def _warm_up(self):
+        """Загрузка модели и пробное кодирование (первый вызов encode заметно дольше следующих)."""
+        started = time.perf_counter()
+        self._init_semantic()
+        if self.semantic_model:
+            try:
+                self.semantic_model.encode(["прогрев модели"], convert_to_numpy=True, normalize_embeddings=True)
+            except Exception as e:
+                logger.warning("Не удалось прогреть модель: %s", e)
+                return
+            logger.info("Прогрев модели завершен за %.1f сек", time.perf_counter() - started)
+
+    def start_warm_up(self) -> Optional[asyncio.Task]:
+        """
+        Фоновая загрузка и прогрев модели в отдельном потоке, пока ключевые
+        слова уже обрабатываются. Возвращает идущую загрузку или запускает
+        новую, если модель не загружена и пауза после неудачи прошла.
+        """
+        if not self.uses_local_model:
+            return None
+        task = self._warm_up_task
+        if task is not None and not task.done():
+            return task
+        if not self._load_due():
+            return None
+        self._warm_up_task = asyncio.create_task(asyncio.to_thread(self._warm_up), name="model-warm-up")
+        return self._warm_up_task
+
+    async def wait_semantic_ready(self):
+        """
+        Ожидание загрузки модели без блокировки цикла событий. Если локальная
+        модель - только запасной провайдер, ждать не нужно: до загрузки она
+        пропускается в цепочке.
+        """
+        if self.semantic_provider != "local":
+            return
+        task = self.start_warm_up()
+        if task is not None:
+            await asyncio.shield(task)
+
+    def prepare(self, text: str) -> PreparedText:
+        """Подготовка текста сообщения для всех фильтров: нормализация выполняется один раз."""
+        return PreparedText(text, self.normalizer)
 
     def match_keywords(self, text: str, keywords: Optional[str]) -> bool:
         """
@@ -43,22 +268,24 @@ class FilterEngine:
 
         Args:
             text: Текст для проверки
-            keywords: Строка с ключевыми словами через запятую
+            keywords: Ключевые слова через запятую или выражение (см. filter_expr)
 
         Returns:
             True если найдено хотя бы одно ключевое слово
         """
-        if not keywords:
-            return False
-
-        text_lower = text.lower()
-        keyword_list = [kw.strip().lower() for kw in keywords.split(",") if kw.strip()]
+        return self.find_keyword(text, keywords) is not None
 
-        for keyword in keyword_list:
-            if keyword in text_lower:
-                return True
+    def find_keyword(self, text: str, keywords: Optional[str]) -> Optional[str]:
+        """Сработавшее ключевое слово (условие выражения) или None."""
+        expression = compile_legacy(keywords) if keywords else None
+        if expression is None:
+            return None
+        return self._evaluate_keywords(self.prepare(text), expression)
 
-        return False
+    @staticmethod
+    def _evaluate_keywords(prepared: PreparedText, expression: KeywordExpression) -> Optional[str]:
+        """Проверка скомпилированного выражения; результаты условий общие для всех фильтров сообщения."""
+        return expression.evaluate(prepared)
 
     def match_semantic(self, text: str, topics: Optional[str], threshold: float = SEMANTIC_THRESHOLD) -> bool:
         """
@@ -72,43 +299,133 @@ class FilterEngine:
         Returns:
             True если найдена схожесть выше порога
         """
+        return self.score_semantic(text, topics, threshold) is not None
+
+    def calibrated_threshold(self, user_id: Optional[int], topic: str) -> Optional[float]:
+        """Подобранный порог для темы пользователя, иначе общий порог пользователя."""
+        if user_id is None or not self.calibrated_thresholds:
+            return None
+        threshold = self.calibrated_thresholds.get((user_id, topic.lower().strip()))
+        if threshold is None:
+            threshold = self.calibrated_thresholds.get((user_id, None))
+        return threshold
+
+    def score_semantic(self, text: str, topics: Optional[str], threshold: float = SEMANTIC_THRESHOLD,
+                       user_id: Optional[int] = None) -> Optional[Tuple[float, str]]:
+        """
+        Схожесть и ближайшая тема, если текст прошел семантический фильтр, иначе None.
+
+        Если для пользователя есть порог, подобранный по оценкам, совпадение
+        по эвристикам дополнительно должно пройти и его.
+        """
         if not topics:
-            return False
+            return None
+        topic_list = tuple(t.strip() for t in topics.split(",") if t.strip())
+        if not topic_list:
+            return None
+        return self._score_topics(text, topic_list, None, user_id)
 
-        text_words = text.strip().split()
-        text_length = len(text_words)
-        
+    @staticmethod
+    def _length_threshold(text_length: int) -> float:
+        """Эвристический порог схожести по длине текста в словах."""
         if text_length == 1:
-            adjusted_threshold = 0.85
+            return 0.85
         elif text_length == 2:
-            adjusted_threshold = 0.35
+            return 0.35
         elif text_length == 3:
-            adjusted_threshold = 0.35
+            return 0.35
         else:
-            adjusted_threshold = 0.25
+            return 0.25
 
-        self._init_semantic()
+    def _finish_score(self, matched: bool, similarity: float, topic: str, text_length: int,
+                      user_id: Optional[int]) -> Optional[Tuple[float, str]]:
+        """
+        Итог семантической проверки с учетом подобранного порога пользователя.
 
-        topic_list = [t.strip() for t in topics.split(",") if t.strip()]
-        if not topic_list:
-            return False
+        Подобранный порог только ужесточает решение эвристик (matched - их
+        решение, уже с проверкой ложных срабатываний по ближайшему окну):
+        оценки есть лишь у пересланных сообщений, поэтому порог может
+        отсечь лишние пересылки, но не вернуть пропущенные.
+        """
+        calibrated = self.calibrated_threshold(user_id, topic) if topic else None
+        if calibrated is not None and matched:
+            matched = similarity >= calibrated
+            self._log_similarity(similarity, calibrated, text_length, "ПОДОБРАННЫЙ ПОРОГ")
+        return (similarity, topic) if matched else None
+
+    def _score_topics(self, text: str, topic_list: Tuple[str, ...], topic_rows,
+                      user_id: Optional[int] = None) -> Optional[Tuple[float, str]]:
+        """
+        Семантическая проверка по разобранным темам (topic_rows - их строки в topic_store).
+
+        Синхронный путь работает только с локальной моделью; остальные
+        провайдеры проверяются через _score_topics_async.
+        """
+        text_length = len(text.split())
+        adjusted_threshold = self._length_threshold(text_length)
+
+        self._init_semantic()
 
         try:
             if self.semantic_provider == "local":
-                return self._match_semantic_local(text, topic_list, adjusted_threshold, text_length)
+                matched, similarity, topic = self._match_semantic_local(
+                    text, topic_list, adjusted_threshold, text_length, topic_rows
+                )
+                return self._finish_score(matched, similarity, topic, text_length, user_id)
             else:
-                print(f"API провайдеры ({self.semantic_provider}) требуют async контекст")
-                print(f"Используйте SEMANTIC_PROVIDER=local")
-                return False
+                logger.warning(
+                    "Провайдер %s требует async контекст (match_async). Используйте SEMANTIC_PROVIDER=local",
+                    self.semantic_provider
+                )
+                return None
         except Exception as e:
-            print(f"Ошибка семантического поиска: {e}")
-            return False
+            logger.error("Ошибка семантического поиска: %s", e)
+            return None
 
-    def _match_semantic_local(self, text: str, topic_list: List[str], threshold: float, text_length: int) -> bool:
-        """Локальный семантический поиск через sentence-transformers с умной фильтрацией."""
-        if not self.semantic_model:
-            return False
+    async def _score_topics_async(self, text: str, topic_list: Tuple[str, ...], topic_rows,
+                                  user_id: Optional[int] = None) -> Optional[Tuple[float, str]]:
+        """
+        Семантическая проверка через цепочку провайдеров (semantic_providers).
+
+        Провайдеры опрашиваются по порядку: при ошибке, таймауте или
+        разомкнутом предохранителе проверка переходит к следующему. Если
+        недоступны все, семантический фильтр не срабатывает, а ключевые слова
+        проверяются как обычно.
+        """
+        text_length = len(text.split())
+        adjusted_threshold = self._length_threshold(text_length)
+
+        # Модель загружается в потоке; цикл событий не блокируется и при повторе после неудачи
+        await self.wait_semantic_ready()
 
+        for provider in self.providers:
+            if not provider.ready():
+                continue
+            try:
+                if provider.kind == "embedding":
+                    matched, similarity, topic = await self._match_semantic_embeddings(
+                        provider, text, topic_list, adjusted_threshold, text_length,
+                        topic_rows if provider is self.provider else None
+                    )
+                else:
+                    matched, similarity, topic = await self._match_semantic_scores(
+                        provider, text, topic_list, adjusted_threshold, text_length
+                    )
+            except ProviderUnavailable:
+                continue
+            except Exception as e:
+                logger.warning("Ошибка семантического поиска (%s): %s", provider.name, e)
+                continue
+            if provider is not self.provider:
+                metrics.SEMANTIC_FALLBACKS.inc(provider.name)
+            return self._finish_score(matched, similarity, topic, text_length, user_id)
+
+        metrics.SEMANTIC_FALLBACKS.inc("none")
+        return None
+
+    @staticmethod
+    def _single_word_threshold(text: str, topic_list: Sequence[str], threshold: float, text_length: int) -> float:
+        """Порог для одного слова, которое является переводом темы."""
         if text_length == 1:
             text_lower = text.lower().strip()
             topic_lower = topic_list[0].lower().strip() if topic_list else ""
@@ -121,89 +438,232 @@ class FilterEngine:
             for word1, word2 in synonym_pairs:
                 if (text_lower == word1 and topic_lower == word2) or \
                    (text_lower == word2 and topic_lower == word1):
-                    threshold = 0.55
-                    break
-
-        text_embedding = self.semantic_model.encode(text, convert_to_tensor=True)
-        topic_embeddings = self.semantic_model.encode(topic_list, convert_to_tensor=True)
-        similarities = cosine_similarity(text_embedding.unsqueeze(0), topic_embeddings)
-        max_similarity = similarities.max().item()
-        best_topic_idx = similarities.argmax().item()
-        best_topic = topic_list[best_topic_idx] if best_topic_idx < len(topic_list) else topic_list[0]
+                    return 0.55
+        return threshold
+
+    def _match_semantic_local(self, text: str, topic_list: Sequence[str], threshold: float,
+                              text_length: int, topic_rows=None) -> Tuple[bool, float, str]:
+        """
+        Локальный семантический поиск через sentence-transformers с умной фильтрацией.
+
+        Returns:
+            (совпало ли, максимальная схожесть, ближайшая тема)
+        """
+        if not self.semantic_model:
+            return False, 0.0, ""
+
+        threshold = self._single_word_threshold(text, topic_list, threshold, text_length)
+        # Длинный текст кодируется окнами предложений одним батчем: модель не обрезает
+        # его по максимальной длине последовательности, а тематическое предложение
+        # не растворяется в остальном тексте. Оценка - максимум по окнам.
+        chunks = split_chunks(text)
+        chunk_vectors = self._encode_text(text, chunks)
+        topic_vectors = self._encode_topics(topic_list, topic_rows)
+        return self._apply_rules(text, chunks, cosine_matrix(chunk_vectors, topic_vectors),
+                                 topic_list, threshold, text_length)
+
+    async def _match_semantic_embeddings(self, provider: SemanticProvider, text: str, topic_list: Sequence[str],
+                                         threshold: float, text_length: int,
+                                         topic_rows=None) -> Tuple[bool, float, str]:
+        """То же, что _match_semantic_local, но векторы кодирует провайдер."""
+        threshold = self._single_word_threshold(text, topic_list, threshold, text_length)
+        chunks = split_chunks(text)
+        chunk_vectors = await self._encode_text_async(provider, text, chunks)
+        topic_vectors = await self._encode_topics_async(provider, topic_list, topic_rows)
+        return self._apply_rules(text, chunks, cosine_matrix(chunk_vectors, topic_vectors),
+                                 topic_list, threshold, text_length)
+
+    async def _match_semantic_scores(self, provider: SemanticProvider, text: str, topic_list: Sequence[str],
+                                     threshold: float, text_length: int) -> Tuple[bool, float, str]:
+        """Оценки близости от LLM-провайдера: правила по полосам схожести к ним не применяются."""
+        scores = await self._call_provider(provider, "score", provider.score, text, topic_list)
+        best_topic_idx = max(range(len(topic_list)), key=scores.__getitem__)
+        similarity = float(scores[best_topic_idx])
+        self._log_similarity(similarity, threshold, text_length, provider.name)
+        return similarity >= threshold, similarity, topic_list[best_topic_idx]
+
+    def _apply_rules(self, text: str, chunks: List[str], similarities, topic_list: Sequence[str],
+                     threshold: float, text_length: int) -> Tuple[bool, float, str]:
+        """Решение по матрице схожести окон с темами: полосы схожести, общие слова, ложные срабатывания."""
+        max_similarity = float(similarities.max())
+        best_chunk_idx, best_topic_idx = divmod(int(similarities.argmax()), len(topic_list))
+        best_topic = topic_list[best_topic_idx]
+        if not self.use_rules:
+            return max_similarity >= self.semantic_threshold, max_similarity, best_topic
+        if len(chunks) > 1:
+            # Правила ниже применяются к самому близкому окну, а не ко всему посту
+            text = chunks[best_chunk_idx]
         
         if max_similarity >= 0.50:
             false_positive_patterns = self._check_false_positive(text, best_topic)
             
             if false_positive_patterns:
-                if text_length <= 3:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}, {text_length} слово(а)) - ЛОЖНОЕ СРАБАТЫВАНИЕ")
-                else:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}) - ЛОЖНОЕ СРАБАТЫВАНИЕ")
-                return False
+                self._log_similarity(max_similarity, threshold, text_length, "ЛОЖНОЕ СРАБАТЫВАНИЕ")
+                return False, max_similarity, best_topic
             
-            if text_length <= 3:
-                print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}, {text_length} слово(а)) - ВЫСОКАЯ")
-            else:
-                print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}) - ВЫСОКАЯ")
-            return max_similarity >= threshold
+            self._log_similarity(max_similarity, threshold, text_length, "ВЫСОКАЯ")
+            return max_similarity >= threshold, max_similarity, best_topic
         
         if 0.35 <= max_similarity < 0.50:
             false_positive_patterns = self._check_false_positive(text, best_topic)
             
             if false_positive_patterns:
-                if text_length <= 3:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}, {text_length} слово(а)) - ЛОЖНОЕ СРАБАТЫВАНИЕ")
-                else:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}) - ЛОЖНОЕ СРАБАТЫВАНИЕ")
-                return False
+                self._log_similarity(max_similarity, threshold, text_length, "ЛОЖНОЕ СРАБАТЫВАНИЕ")
+                return False, max_similarity, best_topic
             
             if text_length == 1:
-                return False
+                return False, max_similarity, best_topic
             
-            topic_words = set(best_topic.lower().split())
-            text_words = set(text.lower().split())
-            topic_synonyms = self._get_topic_synonyms(best_topic)
+            # Общие слова ищутся в нормализованном виде: "дедлайна" совпадает с "дедлайн"
+            topic_words = set(self.normalizer.tokens(best_topic))
+            text_words = set(self.normalizer.tokens(text))
+            topic_synonyms = set(self.normalizer.tokens(" ".join(self._get_topic_synonyms(best_topic))))
             all_topic_words = topic_words | topic_synonyms
             common_words = all_topic_words & text_words
             has_common_words = len(common_words) > 0
             
             if has_common_words and max_similarity >= threshold:
-                if text_length <= 3:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}, {text_length} слово(а)) - С ОБЩИМИ СЛОВАМИ")
-                else:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}) - С ОБЩИМИ СЛОВАМИ")
-                return True
+                self._log_similarity(max_similarity, threshold, text_length, "С ОБЩИМИ СЛОВАМИ")
+                return True, max_similarity, best_topic
             
             if max_similarity >= 0.45:
-                if text_length <= 3:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}, {text_length} слово(а)) - ВЫСОКАЯ СХОЖЕСТЬ")
-                else:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}) - ВЫСОКАЯ СХОЖЕСТЬ")
-                return True
+                self._log_similarity(max_similarity, threshold, text_length, "ВЫСОКАЯ СХОЖЕСТЬ")
+                return True, max_similarity, best_topic
         
         if max_similarity < 0.35:
             if text_length == 1:
-                return False
+                return False, max_similarity, best_topic
                 
-            topic_words = set(best_topic.lower().split())
-            text_words = set(text.lower().split())
+            topic_words = set(self.normalizer.tokens(best_topic))
+            text_words = set(self.normalizer.tokens(text))
             common_words = topic_words & text_words
             
             if common_words and max_similarity >= threshold:
-                if text_length <= 3:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}, {text_length} слово(а)) - С КЛЮЧЕВЫМИ СЛОВАМИ")
-                else:
-                    print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}) - С КЛЮЧЕВЫМИ СЛОВАМИ")
-                return True
+                self._log_similarity(max_similarity, threshold, text_length, "С КЛЮЧЕВЫМИ СЛОВАМИ")
+                return True, max_similarity, best_topic
         
+        self._log_similarity(max_similarity, threshold, text_length, "")
+        return False, max_similarity, best_topic
+    
+    def _encode(self, texts: List[str], **span_attrs):
+        """Кодирование батча текстов моделью в нормированные векторы float32."""
+        started = time.perf_counter()
+        with tracing.span("encode", **span_attrs):
+            vectors = self.semantic_model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+        metrics.MODEL_ENCODE_SECONDS.observe(time.perf_counter() - started)
+        return vectors
+
+    def _encode_local(self, texts: List[str]):
+        """Кодирование для провайдера local: без загруженной модели - ошибка провайдера."""
+        if not self.semantic_model:
+            raise ProviderError("локальная модель не загружена")
+        return self._encode(texts, count=len(texts))
+
+    def _encode_text(self, text: str, chunks: List[str]) -> CompactVectors:
+        """
+        Эмбеддинги окон сообщения. Одно сообщение проверяется фильтрами каждого
+        подписчика, поэтому результат кэшируется по тексту.
+        """
+        cached = self.text_cache.get(text)
+        if cached is not None:
+            return cached
+        metrics.SEMANTIC_CHUNKS.observe(len(chunks))
+        return self.text_cache.put(text, self._encode(chunks, chunks=len(chunks)))
+
+    def _encode_topics(self, topic_list: Sequence[str], topic_rows=None) -> CompactVectors:
+        """
+        Эмбеддинги тем из хранилища; отсутствующие кодируются одним батчем.
+        topic_rows - строки, закрепленные за темами при компиляции фильтра.
+        """
+        if topic_rows is None or self.topic_store.pending:
+            missing = self.topic_store.missing(topic_list)
+            if missing:
+                self.topic_store.add_many(missing, self._encode(missing, topics=len(missing)))
+        if topic_rows is None:
+            return self.topic_store.take(topic_list)
+        return self.topic_store.take_rows(topic_rows)
+
+    async def _call_provider(self, provider: SemanticProvider, operation: str, call, *args):
+        """
+        Вызов провайдера через его предохранитель: при разомкнутой цепи сразу
+        ProviderUnavailable, иначе вызов с таймаутом, учетом результата и
+        времени ответа в метриках.
+        """
+        name = provider.name
+        breaker = self.breakers[name]
+        if not breaker.allow():
+            metrics.PROVIDER_REQUESTS.inc(name, operation, "rejected")
+            raise ProviderUnavailable(f"{name}: предохранитель разомкнут")
+
+        # Кодирование локальной моделью в потоке не прервать: таймаут оставил бы поток занятым
+        timeout = None if name == "local" else self.provider_timeout
+        started = time.perf_counter()
+        try:
+            with tracing.span("provider", provider=name, operation=operation):
+                try:
+                    result = await asyncio.wait_for(call(*args), timeout)
+                except asyncio.TimeoutError:
+                    raise ProviderError(f"{name}: нет ответа за {timeout} сек") from None
+        except asyncio.CancelledError:
+            # Отмена - решение вызывающего, а не отказ провайдера: только освобождаем пробный вызов
+            metrics.PROVIDER_REQUESTS.inc(name, operation, "cancelled")
+            breaker.release()
+            raise
+        except BaseException:
+            metrics.PROVIDER_REQUESTS.inc(name, operation, "error")
+            breaker.record_failure()
+            raise
+        finally:
+            metrics.PROVIDER_SECONDS.observe(time.perf_counter() - started, name, operation)
+
+        if self.slow_call_ms and (time.perf_counter() - started) * 1000 > self.slow_call_ms:
+            # Ответ используется, но медленный провайдер размыкается так же, как отказавший
+            metrics.PROVIDER_REQUESTS.inc(name, operation, "slow")
+            breaker.record_failure()
+        else:
+            metrics.PROVIDER_REQUESTS.inc(name, operation, "ok")
+            breaker.record_success()
+        return result
+
+    async def _encode_text_async(self, provider: SemanticProvider, text: str, chunks: List[str]) -> CompactVectors:
+        """Эмбеддинги окон сообщения от провайдера (кэш основного провайдера общий с _encode_text)."""
+        text_cache = self.stores[provider.name][1]
+        cached = text_cache.get(text)
+        if cached is not None:
+            return cached
+        metrics.SEMANTIC_CHUNKS.observe(len(chunks))
+        return text_cache.put(text, await self._call_provider(provider, "encode", provider.encode, chunks))
+
+    async def _encode_topics_async(self, provider: SemanticProvider, topic_list: Sequence[str],
+                                   topic_rows=None) -> CompactVectors:
+        """Эмбеддинги тем от провайдера; отсутствующие в хранилище кодируются одним запросом."""
+        topic_store = self.stores[provider.name][0]
+        if topic_rows is None or topic_store.pending:
+            missing = topic_store.missing(topic_list)
+            if missing:
+                topic_store.add_many(missing, await self._call_provider(provider, "encode", provider.encode, missing))
+        if topic_rows is None:
+            return topic_store.take(topic_list)
+        return topic_store.take_rows(topic_rows)
+
+    @staticmethod
+    def _log_similarity(similarity: float, threshold: float, text_length: int, label: str):
+        """Отладочный вывод схожести (форматируется только при уровне DEBUG)."""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        suffix = f" - {label}" if label else ""
         if text_length <= 3:
-            print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f}, {text_length} слово(а))")
+            logger.debug("Схожесть: %.3f (порог: %.3f, %d слово(а))%s", similarity, threshold, text_length, suffix)
         else:
-            print(f"Схожесть: {max_similarity:.3f} (порог: {threshold:.3f})")
-        return False
-    
+            logger.debug("Схожесть: %.3f (порог: %.3f)%s", similarity, threshold, suffix)
+
     def _check_false_positive(self, text: str, topic: str) -> bool:
         """Проверка на ложные срабатывания по известным паттернам."""
+        with tracing.span("false_positive", topic=topic):
+            return self._match_false_positive_rules(text, topic)
+
+    def _match_false_positive_rules(self, text: str, topic: str) -> bool:
+        """Применение правил ложных срабатываний к тексту."""
         text_lower = text.lower()
         topic_lower = topic.lower()
         
@@ -259,146 +719,147 @@ class FilterEngine:
         
         return synonyms_dict.get(topic_lower, set())
 
-    async def _match_semantic_openrouter(self, text: str, topic_list: List[str], threshold: float, text_length: int) -> bool:
-        """Семантический поиск через OpenRouter API (Qwen и др.)."""
-        if not OPENROUTER_API_KEY:
-            print("OPENROUTER_API_KEY не установлен")
-            return False
-
-        async with aiohttp.ClientSession() as session:
-            prompt = f"""Определи, насколько текст "{text}" семантически близок к теме "{topic_list[0]}". 
-Ответь только числом от 0.0 до 1.0, где 1.0 - полное совпадение, 0.0 - нет связи."""
-            
-            headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": OPENROUTER_MODEL,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.1
-            }
-            
-            try:
-                async with session.post("https://openrouter.ai/api/v1/chat/completions", 
-                                      headers=headers, json=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        similarity_text = result.get("choices", [{}])[0].get("message", {}).get("content", "0.0")
-                        try:
-                            similarity = float(similarity_text.strip())
-                            print(f"         Схожесть (OpenRouter): {similarity:.3f} (порог: {threshold:.3f})")
-                            return similarity >= threshold
-                        except ValueError:
-                            print(f"Не удалось распарсить ответ: {similarity_text}")
-                            return False
-                    else:
-                        print(f"Ошибка OpenRouter API: {response.status}")
-                        return False
-            except Exception as e:
-                print(f"Ошибка запроса к OpenRouter: {e}")
-                return False
-
-    async def _match_semantic_yandex(self, text: str, topic_list: List[str], threshold: float, text_length: int) -> bool:
-        """Семантический поиск через YandexGPT API."""
-        if not YANDEX_API_KEY or not YANDEX_FOLDER_ID:
-            print("YANDEX_API_KEY или YANDEX_FOLDER_ID не установлены")
-            return False
-
-        async with aiohttp.ClientSession() as session:
-            prompt = f"""Оцени семантическую близость текста "{text}" к теме "{topic_list[0]}". 
-Ответь только числом от 0.0 до 1.0."""
-            
-            headers = {
-                "Authorization": f"Api-Key {YANDEX_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "modelUri": f"gpt://{YANDEX_FOLDER_ID}/yandexgpt/latest",
-                "completionOptions": {
-                    "stream": False,
-                    "temperature": 0.1
-                },
-                "messages": [{"role": "user", "text": prompt}]
-            }
-            
-            try:
-                async with session.post("https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-                                      headers=headers, json=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        similarity_text = result.get("result", {}).get("alternatives", [{}])[0].get("message", {}).get("text", "0.0")
-                        try:
-                            similarity = float(similarity_text.strip())
-                            print(f"         Схожесть (YandexGPT): {similarity:.3f} (порог: {threshold:.3f})")
-                            return similarity >= threshold
-                        except ValueError:
-                            return False
-                    else:
-                        return False
-            except Exception as e:
-                print(f"Ошибка YandexGPT: {e}")
-                return False
-
-    async def _match_semantic_openai(self, text: str, topic_list: List[str], threshold: float, text_length: int) -> bool:
-        """Семантический поиск через OpenAI embeddings."""
-        if not OPENAI_API_KEY:
-            print("OPENAI_API_KEY не установлен")
-            return False
-
-        from openai import AsyncOpenAI
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        
-        try:
-            text_emb = await client.embeddings.create(model=OPENAI_MODEL, input=text)
-            topic_emb = await client.embeddings.create(model=OPENAI_MODEL, input=topic_list[0])
-            
-            import numpy as np
-            text_vec = np.array(text_emb.data[0].embedding)
-            topic_vec = np.array(topic_emb.data[0].embedding)
-            
-            similarity = np.dot(text_vec, topic_vec) / (np.linalg.norm(text_vec) * np.linalg.norm(topic_vec))
-            
-            print(f"         Схожесть (OpenAI): {similarity:.3f} (порог: {threshold:.3f})")
-            return similarity >= threshold
-        except Exception as e:
-            print(f"Ошибка OpenAI: {e}")
-            return False
-
-    def should_forward(self, message_text: str, filters: List[dict]) -> bool:
+    def should_forward(self, message_text: Union[str, PreparedText], filters: Sequence,
+                       allow_semantic: bool = True) -> bool:
         """
         Проверка, нужно ли пересылать сообщение на основе фильтров.
 
         Args:
             message_text: Текст сообщения
-            filters: Список словарей с фильтрами (ключи: keywords, topics, use_semantic)
+            filters: Скомпилированные фильтры или словари (ключи: id, keywords, topics, use_semantic)
+            allow_semantic: False - семантические фильтры пропускаются (режим деградации)
 
         Returns:
             True если сообщение соответствует хотя бы одному фильтру
         """
-        if not message_text or not filters:
-            return False
+        return self.match(message_text, filters, allow_semantic) is not None
 
-        for idx, filter_item in enumerate(filters):
-            if filter_item.get("keywords"):
-                keywords = filter_item["keywords"]
-                if keywords and keywords.strip():
-                    if self.match_keywords(message_text, keywords):
-                        print(f"Сработал фильтр #{idx+1} (ключевые слова: '{keywords}')")
-                        return True
-                    else:
-                        print(f"Фильтр #{idx+1} не сработал (ключевые слова: '{keywords}')")
-
-            if filter_item.get("use_semantic") and filter_item.get("topics"):
-                topics = filter_item["topics"]
-                if topics and topics.strip():
-                    if self.match_semantic(message_text, topics):
-                        print(f"Сработал фильтр #{idx+1} (семантика: '{topics}')")
-                        return True
-                    else:
-                        print(f"Фильтр #{idx+1} не сработал (семантика: '{topics}')")
+    def compile_filters(self, filters: Sequence[dict]) -> Tuple[CompiledFilter, ...]:
+        """Компиляция фильтров-словарей с закреплением тем в topic_store движка."""
+        return tuple(CompiledFilter.from_dict(item, self.topic_store) for item in filters)
 
-        return False
+    def match(self, message_text: Union[str, PreparedText], filters: Sequence, allow_semantic: bool = True,
+              user_id: Optional[int] = None, best: bool = False) -> Optional[MatchResult]:
+        """
+        Первый сработавший фильтр с оценкой (best=True - фильтр с наибольшей оценкой).
+
+        Семантическое совпадение оценивается схожестью с ближайшей темой, совпадение
+        по ключевому слову - KEYWORD_MATCH_SCORE на той же шкале. С best проверяются
+        все фильтры, а у фильтра с ключевыми словами и темами - и то и другое: так
+        ранжирует top-K. user_id включает пороги, подобранные по оценкам пользователя.
+        Фильтры-словари компилируются на лету; на горячем пути передаются уже
+        скомпилированные (FilterCache), и проверка не разбирает строк. Текст можно
+        передать как PreparedText, подготовленный один раз для всех подписчиков.
+        Семантика проверяется синхронно, только локальной моделью; для любого
+        провайдера используется match_async.
 
+        Returns:
+            MatchResult или None, если ни один фильтр не сработал
+        """
+        prepared = self._prepare_match(message_text, filters)
+        if prepared is None:
+            return None
+
+        best_result = None
+        for idx, filter_item in enumerate(filters):
+            if isinstance(filter_item, dict):
+                filter_item = CompiledFilter.from_dict(filter_item, self.topic_store)
+
+            result = self._match_filter_keywords(idx, filter_item, prepared)
+            if result is not None and not best:
+                return result
+            best_result = self._better(best_result, result)
+
+            if filter_item.topics and self._semantic_allowed(allow_semantic):
+                with tracing.span("filter.semantic", index=idx):
+                    scored = self._score_topics(prepared.text, filter_item.topics, filter_item.topic_rows, user_id)
+                result = self._semantic_result(idx, filter_item, scored)
+                if result is not None and not best:
+                    return result
+                best_result = self._better(best_result, result)
+
+        return best_result
+
+    async def match_async(self, message_text: Union[str, PreparedText], filters: Sequence,
+                          allow_semantic: bool = True, user_id: Optional[int] = None,
+                          best: bool = False) -> Optional[MatchResult]:
+        """
+        То же, что match, но семантика запрашивается у цепочки провайдеров
+        (self.providers): удаленные провайдеры и mock не блокируют цикл событий
+        на время запроса, а отказавший провайдер заменяется запасным.
+        """
+        prepared = self._prepare_match(message_text, filters)
+        if prepared is None:
+            return None
+
+        best_result = None
+        for idx, filter_item in enumerate(filters):
+            if isinstance(filter_item, dict):
+                filter_item = CompiledFilter.from_dict(filter_item, self.topic_store)
+
+            result = self._match_filter_keywords(idx, filter_item, prepared)
+            if result is not None and not best:
+                return result
+            best_result = self._better(best_result, result)
+
+            if filter_item.topics and self._semantic_allowed(allow_semantic):
+                with tracing.span("filter.semantic", index=idx):
+                    scored = await self._score_topics_async(
+                        prepared.text, filter_item.topics, filter_item.topic_rows, user_id
+                    )
+                result = self._semantic_result(idx, filter_item, scored)
+                if result is not None and not best:
+                    return result
+                best_result = self._better(best_result, result)
+
+        return best_result
+
+    def _prepare_match(self, message_text: Union[str, PreparedText], filters: Sequence) -> Optional[PreparedText]:
+        if not message_text or not filters:
+            return None
+        prepared = message_text if isinstance(message_text, PreparedText) else self.prepare(message_text)
+        return prepared if prepared.text else None
+
+    def _match_filter_keywords(self, idx: int, filter_item: CompiledFilter,
+                               prepared: PreparedText) -> Optional[MatchResult]:
+        if not filter_item.keywords:
+            return None
+        with tracing.span("filter.keywords", index=idx):
+            keyword = self._evaluate_keywords(prepared, filter_item.keywords)
+        if keyword is not None:
+            metrics.FILTER_EVALUATIONS.inc("keyword", "match")
+            logger.debug("Сработал фильтр #%d (ключевые слова: '%s')", idx + 1, filter_item.keywords_text)
+            return MatchResult(filter_item.filter_id, "keyword", self.keyword_score, keyword)
+        metrics.FILTER_EVALUATIONS.inc("keyword", "miss")
+        logger.debug("Фильтр #%d не сработал (ключевые слова: '%s')", idx + 1, filter_item.keywords_text)
+        return None
+
+    @staticmethod
+    def _better(current: Optional[MatchResult], candidate: Optional[MatchResult]) -> Optional[MatchResult]:
+        """Результат с большей оценкой (при равной - найденный раньше)."""
+        if candidate is None or (current is not None and current.score >= candidate.score):
+            return current
+        return candidate
+
+    @staticmethod
+    def _semantic_allowed(allow_semantic: bool) -> bool:
+        if not allow_semantic:
+            metrics.FILTER_EVALUATIONS.inc("semantic", "skipped")
+        return allow_semantic
+
+    @staticmethod
+    def _semantic_result(idx: int, filter_item: CompiledFilter,
+                         scored: Optional[Tuple[float, str]]) -> Optional[MatchResult]:
+        if scored is not None:
+            metrics.FILTER_EVALUATIONS.inc("semantic", "match")
+            logger.debug("Сработал фильтр #%d (семантика: '%s')", idx + 1, filter_item.topics_text)
+            similarity, topic = scored
+            return MatchResult(filter_item.filter_id, "semantic", float(similarity), topic)
+        metrics.FILTER_EVALUATIONS.inc("semantic", "miss")
+        logger.debug("Фильтр #%d не сработал (семантика: '%s')", idx + 1, filter_item.topics_text)
+        return None
+
+    async def close(self):
+        """Закрытие соединений провайдеров семантики."""
+        for provider in self.providers:
+            await provider.close()
@@ -0,0 +1,495 @@
+"""Язык выражений для фильтров по ключевым словам.
+
+Синтаксис:
+    python, дедлайн             - любое из слов (запятая работает как OR, как раньше)
+    ставк AND ЦБ                - оба условия (также И)
+    python OR golang            - любое из условий (также ИЛИ)
+    NOT реклама                 - условие не выполняется (также НЕ)
+    (нефть OR газ) AND NOT спорт - скобки группируют условия
+    "ключевая ставка"           - фраза целыми словами, а не подстрока
+    /ставк[аиу]\\s+цб/           - регулярное выражение (без учета регистра)
+
+Регулярные выражения проверяются при создании фильтра: обратные ссылки и
+повторы, внутри которых есть другой повтор переменной длины или
+альтернатива ((a+)+, (a|ab)*), отклоняются - такие шаблоны на
+неудачном тексте перебирают экспоненциальное число вариантов. Если
+установлен модуль regex, поиск к тому же прерывается через REGEX_TIMEOUT_MS.
+
+Слово без кавычек ищется как подстрока, несколько слов подряд - как одна
+подстрока. Без лемматизации (TEXT_LEMMATIZE) разные формы слова находит
+основа: ставк - ставка, ставку, ставки. Операторы пишутся заглавными буквами. Подстроки и фразы
+сравниваются в нормализованном виде (text_normalizer): без учета регистра,
+ё = е, без пунктуации, с леммами при TEXT_LEMMATIZE. Условия со знаками
+(c++, 3.11) ищутся в тексте с сохраненной пунктуацией.
+
+Выражение компилируется в дерево один раз при создании фильтра. Одинаковые
+условия разных фильтров и пользователей - один и тот же объект Term. Фразы и
+регулярные выражения ищутся в сообщении не больше одного раза, результат
+общий для всех фильтров (PreparedText); подстроки проверяются напрямую, это
+не дороже обращения к кэшу. Поэтому составные фильтры не дороже списка
+ключевых слов.
+"""
+import functools
+import itertools
+import logging
+import re
+import weakref
+from typing import Dict, List, Optional, Tuple
+from text_normalizer import TextNormalizer, fold, has_punctuation, normalizer
+from config import REGEX_TIMEOUT_MS
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # До Python 3.11 парсер шаблонов - отдельный модуль sre_parse
+    import sre_parse
+
+try:
+    # Модуль regex умеет прерывать поиск по таймауту
+    import regex as regex_engine
+except ImportError:
+    regex_engine = None
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {"AND": "AND", "И": "AND", "OR": "OR", "ИЛИ": "OR", "NOT": "NOT", "НЕ": "NOT"}
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<paren>[()])
+      | (?P<comma>,)
+      | "(?P<phrase>[^"]*)"
+      | /(?P<regex>(?:\\.|[^/\\])+)/
+      | (?P<word>[^\s(),"]+)
+    )''', re.VERBOSE)
+
+# Длина регулярного выражения ограничивает только размер шаблона; от катастрофического
+# перебора защищает проверка структуры (_check_regex) и таймаут поиска
+MAX_REGEX_LENGTH = 200
+
+# Глубина вложенности скобок и NOT: разбор и проверка рекурсивны, без предела
+# "(((...)))" из тысяч скобок исчерпал бы стек интерпретатора
+MAX_NESTING = 32
+
+_REPEATS = ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+
+# Условие еще не проверялось (None в кэше результатов означает "не найдено")
+_NOT_SEARCHED = object()
+
+
+class FilterSyntaxError(ValueError):
+    """Ошибка в выражении фильтра; сообщение показывается пользователю."""
+
+
+def _regex_children(op: str, av) -> List:
+    """Вложенные последовательности узла дерева sre_parse."""
+    if op in _REPEATS:
+        return [av[2]]
+    if op == "SUBPATTERN":
+        return [av[3]]
+    if op == "BRANCH":
+        return list(av[1])
+    if op in ("ASSERT", "ASSERT_NOT"):
+        return [av[1]]
+    if op == "ATOMIC_GROUP":
+        return [av]
+    return []
+
+
+def _check_regex(items, repeated: bool = False):
+    """
+    Отклонение шаблонов с экспоненциальным перебором.
+
+    repeated - узел находится внутри повтора, который может выполниться
+    больше одного раза. Там запрещены повторы переменной длины ((a+)+,
+    (a?){20}) и альтернативы ((a|ab)*): один и тот же текст делится между
+    итерациями многими способами, и неудачный поиск перебирает их все.
+    Обратные ссылки запрещены везде.
+
+    Raises:
+        FilterSyntaxError: если шаблон опасен
+    """
+    for op, av in items:
+        op = str(op)
+        if op in ("GROUPREF", "GROUPREF_EXISTS"):
+            raise FilterSyntaxError("Обратные ссылки в регулярных выражениях не поддерживаются")
+        if op in _REPEATS:
+            low, high = av[0], av[1]
+            if repeated and low != high:
+                raise FilterSyntaxError(
+                    "Вложенные повторы в регулярном выражении (например, (a+)+) не поддерживаются"
+                )
+            _check_regex(av[2], repeated or high > 1)
+            continue
+        if op == "BRANCH" and repeated:
+            raise FilterSyntaxError(
+                "Альтернатива внутри повтора в регулярном выражении (например, (a|ab)+) не поддерживается"
+            )
+        for child in _regex_children(op, av):
+            _check_regex(child, repeated)
+
+
+def compile_regex(pattern: str):
+    """
+    Компиляция регулярного выражения пользователя (без учета регистра).
+
+    Raises:
+        re.error: если шаблон записан с ошибкой
+        FilterSyntaxError: если шаблон опасен (см. _check_regex) или слишком велик
+    """
+    try:
+        _check_regex(sre_parse.parse(pattern, re.IGNORECASE))
+    except OverflowError:
+        # a{99999999999}: число повторов не помещается в машинное слово
+        raise FilterSyntaxError("Слишком большое число повторов") from None
+    except RecursionError:
+        raise FilterSyntaxError("Слишком глубокая вложенность групп") from None
+    if regex_engine is not None:
+        try:
+            return regex_engine.compile(pattern, regex_engine.IGNORECASE | regex_engine.VERSION0)
+        except regex_engine.error as e:
+            raise re.error(str(e)) from None
+    return re.compile(pattern, re.IGNORECASE)
+
+
+class PreparedText:
+    """
+    Текст сообщения, подготовленный для проверки фильтров.
+
+    Создается один раз на сообщение и передается всем фильтрам всех
+    подписчиков: нормализация выполняется один раз, а результаты условий
+    запоминаются по Term.id. lower - текст без регистра и ё, normalized -
+    нормализованные слова, окруженные пробелами (для поиска целых слов).
+    """
+
+    __slots__ = ("text", "lower", "normalized", "_hits")
+
+    def __init__(self, text: str, text_normalizer: TextNormalizer = normalizer):
+        self.text = text
+        self.lower = fold(text)
+        self.normalized = " " + text_normalizer.normalize(self.lower, folded=True) + " "
+        self._hits: Dict[int, Optional[str]] = {}
+
+    def hit(self, term: "Term") -> Optional[str]:
+        """Найденный текст условия или None; каждое условие ищется не больше раза."""
+        found = self._hits.get(term.id, _NOT_SEARCHED)
+        if found is _NOT_SEARCHED:
+            found = self._hits[term.id] = term.search(self)
+        return found
+
+
+class Term:
+    """
+    Элементарное условие.
+
+    Виды: substring - подстрока нормализованного текста, literal - подстрока
+    текста с пунктуацией (для условий со знаками), phrase - целые слова
+    нормализованного текста, literal_phrase - целые слова текста с
+    пунктуацией, regex - регулярное выражение по исходному тексту.
+    """
+
+    __slots__ = ("id", "kind", "pattern", "_needle", "_regex", "__weakref__")
+
+    def __init__(self, term_id: int, kind: str, pattern: str):
+        self.id = term_id
+        self.kind = kind
+        self.pattern = pattern
+        self._needle = f" {pattern} " if kind == "phrase" else pattern
+        if kind == "literal_phrase":
+            self._regex = re.compile(r"(?<!\w)" + re.escape(pattern) + r"(?!\w)")
+        elif kind == "regex":
+            self._regex = compile_regex(pattern)
+        else:
+            self._regex = None
+
+    def __repr__(self) -> str:
+        return f"Term({self.kind}, {self.pattern!r})"
+
+    def search(self, prepared: PreparedText) -> Optional[str]:
+        if self.kind == "literal_phrase":
+            return self.pattern if self._regex.search(prepared.lower) else None
+        if regex_engine is None or REGEX_TIMEOUT_MS <= 0:
+            found = self._regex.search(prepared.text)
+        else:
+            try:
+                found = self._regex.search(prepared.text, timeout=REGEX_TIMEOUT_MS / 1000)
+            except TimeoutError:
+                logger.warning("Регулярное выражение /%s/ не уложилось в %d мс", self.pattern, REGEX_TIMEOUT_MS)
+                return None
+        return found.group(0) if found else None
+
+    def evaluate(self, prepared: PreparedText) -> Optional[str]:
+        if self._regex is None:
+            # Поиск подстроки в C не дороже обращения к кэшу результатов
+            haystack = prepared.lower if self.kind == "literal" else prepared.normalized
+            return self.pattern if self._needle in haystack else None
+        return prepared.hit(self)
+
+
+# Общий реестр условий процесса: одинаковые условия разных фильтров делят результат.
+# Условие живет, пока на него ссылается хотя бы одно выражение (кэш compile_expression
+# или фильтр в FilterCache), поэтому условия удаленных и измененных фильтров не копятся
+_terms: "weakref.WeakValueDictionary[Tuple[str, str], Term]" = weakref.WeakValueDictionary()
+# Номера условий не переиспользуются: по ним PreparedText запоминает результаты
+_term_ids = itertools.count()
+
+
+def _term(kind: str, pattern: str) -> Term:
+    if kind in ("substring", "phrase"):
+        # Нормализация удалила бы значимые знаки (c++, 3.11) - такие условия ищутся как есть
+        normalized = normalizer.normalize(pattern)
+        if has_punctuation(pattern) or not normalized:
+            kind, pattern = ("literal" if kind == "substring" else "literal_phrase"), fold(" ".join(pattern.split()))
+        else:
+            pattern = normalized
+    key = (kind, pattern)
+    term = _terms.get(key)
+    if term is None:
+        term = _terms[key] = Term(next(_term_ids), kind, pattern)
+    return term
+
+
+class Not:
+    __slots__ = ("child",)
+
+    def __init__(self, child):
+        self.child = child
+
+    def evaluate(self, prepared: PreparedText) -> Optional[str]:
+        return "" if self.child.evaluate(prepared) is None else None
+
+
+class And:
+    __slots__ = ("children",)
+
+    def __init__(self, children: Tuple):
+        self.children = children
+
+    def evaluate(self, prepared: PreparedText) -> Optional[str]:
+        witness = ""
+        for child in self.children:
+            found = child.evaluate(prepared)
+            if found is None:
+                return None
+            witness = witness or found
+        return witness
+
+
+class Or:
+    __slots__ = ("children",)
+
+    def __init__(self, children: Tuple):
+        self.children = children
+
+    def evaluate(self, prepared: PreparedText) -> Optional[str]:
+        for child in self.children:
+            found = child.evaluate(prepared)
+            if found is not None:
+                return found
+        return None
+
+
+class AnySubstring:
+    """OR из одних подстрок (обычный список ключевых слов): проверка без обхода дерева."""
+    __slots__ = ("patterns",)
+
+    def __init__(self, patterns: Tuple[str, ...]):
+        self.patterns = patterns
+
+    def evaluate(self, prepared: PreparedText) -> Optional[str]:
+        normalized = prepared.normalized
+        for pattern in self.patterns:
+            if pattern in normalized:
+                return pattern
+        return None
+
+
+def _or(children: Tuple):
+    if all(isinstance(child, Term) and child.kind == "substring" for child in children):
+        return AnySubstring(tuple(child.pattern for child in children))
+    return Or(children)
+
+
+class KeywordExpression:
+    """
+    Скомпилированное выражение фильтра.
+
+    evaluate возвращает None, если выражение не выполнено, иначе первое
+    сработавшее условие (для отрицаний без положительных условий - исходное
+    выражение).
+    """
+
+    __slots__ = ("source", "root", "terms")
+
+    def __init__(self, source: str, root, terms: Tuple[Term, ...]):
+        self.source = source
+        self.root = root
+        self.terms = terms
+
+    def __repr__(self) -> str:
+        return f"KeywordExpression({self.source!r})"
+
+    def evaluate(self, prepared: PreparedText) -> Optional[str]:
+        found = self.root.evaluate(prepared)
+        if found is None:
+            return None
+        return found or self.source
+
+
+def _tokenize(source: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    source = source.rstrip()
+    while position < len(source):
+        token = _TOKEN.match(source, position)
+        if token is None:
+            raise FilterSyntaxError(f"Не удалось разобрать выражение с позиции {position + 1}: {source[position:]}")
+        position = token.end()
+        kind = token.lastgroup
+        value = token.group(kind)
+        if kind == "word" and value in OPERATORS:
+            kind, value = "op", OPERATORS[value]
+        elif kind == "comma":
+            kind, value = "op", ","
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    """Рекурсивный спуск: OR (или запятая) < AND < NOT < скобки и условия."""
+
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+        self.depth = 0
+        self.terms: List[Term] = []
+
+    def peek(self) -> Tuple[Optional[str], Optional[str]]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def take(self) -> Tuple[str, str]:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        kind, value = self.peek()
+        if kind is not None:
+            raise FilterSyntaxError(f"Лишний элемент в выражении: {value}")
+        return node
+
+    def _enter(self):
+        self.depth += 1
+        if self.depth > MAX_NESTING:
+            raise FilterSyntaxError(f"Слишком глубокая вложенность выражения (больше {MAX_NESTING} уровней)")
+
+    def _skip_commas(self):
+        while self.peek() == ("op", ","):
+            self.take()
+
+    def parse_or(self):
+        # Пустые элементы между запятыми пропускаются, как в прежнем списке ключевых слов
+        self._skip_commas()
+        children = [self.parse_and()]
+        while self.peek() in (("op", "OR"), ("op", ",")):
+            operator = self.take()[1]
+            if operator == ",":
+                self._skip_commas()
+                if self.peek()[0] is None or self.peek() == ("paren", ")"):
+                    break
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else _or(tuple(children))
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() == ("op", "AND"):
+            self.take()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def parse_not(self):
+        if self.peek() == ("op", "NOT"):
+            self.take()
+            self._enter()
+            node = Not(self.parse_not())
+            self.depth -= 1
+            return node
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.peek()
+        if kind is None:
+            raise FilterSyntaxError("Выражение обрывается: ожидается условие")
+        if kind == "paren" and value == "(":
+            self.take()
+            self._enter()
+            node = self.parse_or()
+            if self.peek() != ("paren", ")"):
+                raise FilterSyntaxError("Не закрыта скобка")
+            self.take()
+            self.depth -= 1
+            return node
+        if kind in ("paren", "op"):
+            raise FilterSyntaxError(f"Ожидается условие, а не {value}")
+
+        self.take()
+        if kind == "word":
+            # Несколько слов подряд - одна подстрока, как "interest rate" в прежнем формате
+            words = [value]
+            while self.peek()[0] == "word":
+                words.append(self.take()[1])
+            return self._add(_term("substring", " ".join(words)))
+        if kind == "phrase":
+            if not value.strip():
+                raise FilterSyntaxError("Пустая фраза в кавычках")
+            return self._add(_term("phrase", value))
+        if len(value) > MAX_REGEX_LENGTH:
+            raise FilterSyntaxError(f"Регулярное выражение длиннее {MAX_REGEX_LENGTH} символов")
+        pattern = value.replace("\\/", "/")
+        try:
+            return self._add(_term("regex", pattern))
+        except re.error as e:
+            raise FilterSyntaxError(f"Ошибка в регулярном выражении /{value}/: {e}") from None
+        except FilterSyntaxError as e:
+            raise FilterSyntaxError(f"/{value}/: {e}") from None
+
+    def _add(self, term: Term) -> Term:
+        self.terms.append(term)
+        return term
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_expression(source: Optional[str]) -> Optional[KeywordExpression]:
+    """
+    Компиляция выражения фильтра; None для пустой строки.
+
+    Raises:
+        FilterSyntaxError: если выражение записано с ошибкой
+    """
+    if not source or not source.strip(" ,\t\n"):
+        return None
+    parser = _Parser(_tokenize(source))
+    try:
+        root = parser.parse()
+    except RecursionError:
+        # Глубину ограничивает MAX_NESTING; это запасная защита для регулярных выражений и фраз
+        raise FilterSyntaxError("Выражение слишком сложное") from None
+    return KeywordExpression(source, root, tuple(dict.fromkeys(parser.terms)))
+
+
+def compile_legacy(source: Optional[str]) -> Optional[KeywordExpression]:
+    """
+    Компиляция строки из БД: выражение, а если оно не разбирается (фильтр
+    создан до появления языка выражений) - список подстрок через запятую.
+    """
+    try:
+        return compile_expression(source)
+    except FilterSyntaxError:
+        keywords = [kw.strip() for kw in source.split(",") if kw.strip()]
+        if not keywords:
+            return None
+        terms = tuple(dict.fromkeys(_term("substring", keyword) for keyword in keywords))
+        return KeywordExpression(source, terms[0] if len(terms) == 1 else _or(terms), terms)
@@ -0,0 +1,84 @@
+"""Отложенные пересылки: ожидание квоты аккаунтов вне потребителей очереди приема."""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+from models import User
+from ingestion import MessageRecord
+from config import FORWARD_RETRY_QUEUE_SIZE, FORWARD_RETRY_ATTEMPTS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ForwardRetryQueue:
+    """
+    Пересылки, для которых не нашлось аккаунта с квотой.
+
+    Потребитель очереди приема не ждет квоту: сообщение откладывается до
+    момента, когда у какого-нибудь аккаунта появится квота, и переслается
+    фоновой задачей, а потребитель сразу берет следующую запись. Очередь
+    ограничена max_size записями, одно сообщение пробуется не больше
+    max_attempts раз.
+    """
+
+    def __init__(self, forward: Callable[[User, MessageRecord, int], Awaitable[bool]],
+                 max_size: int = FORWARD_RETRY_QUEUE_SIZE, max_attempts: int = FORWARD_RETRY_ATTEMPTS):
+        """
+        Args:
+            forward: Корутина пересылки (user, record, attempt)
+        """
+        self.forward = forward
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        # (время повтора, порядковый номер, пользователь, запись, попытка)
+        self._heap: List[Tuple[float, int, User, MessageRecord, int]] = []
+        self._counter = itertools.count()
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        metrics.FORWARD_RETRY_QUEUE.set_function(lambda: len(self._heap))
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, user: User, record: MessageRecord, delay: float, attempt: int) -> bool:
+        """Отложить пересылку на delay секунд; False, если попытки кончились или очередь полна."""
+        if attempt > self.max_attempts or len(self._heap) >= self.max_size:
+            return False
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), user, record, attempt))
+        self._changed.set()
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="forward-retry")
+
+    async def stop(self):
+        """Остановка (отложенные пересылки теряются)."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            self._changed.clear()
+            if not self._heap:
+                await self._changed.wait()
+                continue
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                # Новая запись может оказаться раньше текущей первой
+                try:
+                    await asyncio.wait_for(self._changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, user, record, attempt = heapq.heappop(self._heap)
+            try:
+                await self.forward(user, record, attempt)
+            except Exception:
+                logger.exception("Ошибка отложенной пересылки сообщения %s", record.message_id)
@@ -0,0 +1,114 @@
+"""Очередь приема сообщений между обработчиком Pyrogram и конвейером фильтрации."""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+from pyrogram.types import Message
+from config import INGEST_QUEUE_SIZE, INGEST_CONSUMERS, INGEST_SHED_RATIO, INGEST_DEGRADE_RATIO
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MessageRecord:
+    """Компактная запись о сообщении: все, что нужно конвейеру, без объекта Pyrogram."""
+    __slots__ = ("chat_id", "message_id", "text", "chat_title", "chat_type", "chat_username",
+                 "from_bot", "received_at")
+
+    def __init__(self, chat_id: int, message_id: int, text: str, chat_title: Optional[str] = None,
+                 chat_type: Optional[str] = None, chat_username: Optional[str] = None,
+                 from_bot: bool = False, received_at: Optional[float] = None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.chat_title = chat_title
+        self.chat_type = chat_type
+        self.chat_username = chat_username
+        self.from_bot = from_bot
+        self.received_at = time.monotonic() if received_at is None else received_at
+
+    @classmethod
+    def from_message(cls, message: Message) -> "MessageRecord":
+        """Нормализация апдейта Pyrogram."""
+        chat = message.chat
+        chat_type = getattr(chat, "type", None) if chat else None
+        return cls(
+            chat_id=chat.id if chat else 0,
+            message_id=message.id,
+            text=message.text or message.caption or "",
+            chat_title=chat.title if chat else None,
+            chat_type=getattr(chat_type, "value", chat_type),
+            chat_username=getattr(chat, "username", None) if chat else None,
+            from_bot=bool(message.from_user and message.from_user.is_bot)
+        )
+
+
+class IngestionQueue:
+    """
+    Ограниченная очередь записей с пулом задач-потребителей.
+
+    Политика перегрузки по заполненности очереди:
+    - выше shed_ratio записи из чатов без подписчиков отбрасываются при приеме;
+    - выше degrade_ratio потребители проверяют только ключевые слова без семантики;
+    - при полной очереди новые записи отбрасываются.
+    """
+
+    def __init__(self, handler: Callable[[MessageRecord, bool], Awaitable[None]],
+                 is_subscribed: Callable[[int], bool],
+                 maxsize: int = INGEST_QUEUE_SIZE, consumers: int = INGEST_CONSUMERS,
+                 shed_ratio: float = INGEST_SHED_RATIO, degrade_ratio: float = INGEST_DEGRADE_RATIO):
+        """
+        Args:
+            handler: Корутина обработки записи (record, allow_semantic)
+            is_subscribed: Быстрая проверка наличия подписчиков у чата
+        """
+        self.handler = handler
+        self.is_subscribed = is_subscribed
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.consumer_count = consumers
+        self.shed_threshold = int(maxsize * shed_ratio)
+        self.degrade_threshold = int(maxsize * degrade_ratio)
+        self._tasks: List[asyncio.Task] = []
+
+        metrics.INGEST_QUEUE_DEPTH.set_function(self.queue.qsize)
+
+    def submit(self, record: MessageRecord) -> bool:
+        """Постановка записи в очередь без ожидания; False, если запись отброшена."""
+        depth = self.queue.qsize()
+        if depth >= self.shed_threshold and not self.is_subscribed(record.chat_id):
+            metrics.INGEST_DROPPED.inc("shed_unsubscribed")
+            return False
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            metrics.INGEST_DROPPED.inc("queue_full")
+            logger.warning("Очередь сообщений переполнена, сообщение %s из чата %s отброшено",
+                           record.message_id, record.chat_id)
+            return False
+        return True
+
+    def start(self):
+        """Запуск задач-потребителей."""
+        for index in range(self.consumer_count):
+            self._tasks.append(asyncio.create_task(self._consume(), name=f"ingestion-consumer-{index}"))
+
+    async def stop(self):
+        """Остановка потребителей (необработанные записи теряются)."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _consume(self):
+        while True:
+            record = await self.queue.get()
+            try:
+                allow_semantic = self.queue.qsize() < self.degrade_threshold
+                if not allow_semantic:
+                    metrics.INGEST_DEGRADED.inc()
+                metrics.INGEST_WAIT_SECONDS.observe(time.monotonic() - record.received_at)
+                await self.handler(record, allow_semantic)
+            except Exception:
+                logger.exception("Ошибка обработки сообщения %s из чата %s", record.message_id, record.chat_id)
+            finally:
+                self.queue.task_done()
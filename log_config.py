@@ -0,0 +1,99 @@
+"""Настройка структурированного логирования с неблокирующей очередью."""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Optional
+from config import LOG_LEVEL, LOG_FORMAT
+
+# Стандартные атрибуты LogRecord; все остальные считаются структурированными полями из extra
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    """Поля, переданные через extra=..."""
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED_ATTRS}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Форматтер вида 'время уровень логгер: сообщение key=value ...'."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = (
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))} "
+            f"{record.levelname:<7} {record.name}: {record.getMessage()}"
+        )
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматтер, выводящий одну JSON-запись на строку."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data.update(_extra_fields(record))
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, откладывающий форматирование до потока слушателя.
+
+    Стандартный prepare() форматирует сообщение в вызывающем потоке, т.е. в цикле
+    событий. Здесь запись кладется в очередь как есть; аргументы логов в проекте -
+    неизменяемые значения, поэтому форматировать их позже безопасно.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT,
+                  force: bool = False) -> logging.handlers.QueueListener:
+    """
+    Настройка корневого логгера.
+
+    Обработчики вывода работают в отдельном потоке QueueListener, а в цикле событий
+    выполняется только постановка записи в очередь.
+
+    Args:
+        level: Уровень логирования (DEBUG, INFO, WARNING, ...)
+        fmt: Формат вывода: text или json
+        force: Пересоздать обработчики (нужно в дочернем процессе после fork,
+            где поток слушателя родителя не существует)
+    """
+    global _listener
+    if _listener and not force:
+        return _listener
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else StructuredFormatter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [_DeferredQueueHandler(log_queue)]
+    root.setLevel(level.upper())
+
+    # Pyrogram пишет много служебных сообщений на INFO
+    logging.getLogger("pyrogram").setLevel(max(root.level, logging.WARNING))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -4,7 +4,10 @@ import sys
 from pyrogram import idle
 from user_bot import UserBot
 from classic_bot import ClassicBot
-from config import validate_config
+from config import validate_config, USER_BOT_WORKERS
+from log_config import setup_logging
+from metrics import start_metrics_server
+import tracing
 
 
 async def main():
@@ -12,25 +15,45 @@ async def main():
     if not validate_config():
         print("\nИсправьте ошибки в .env файле и попробуйте снова.")
         sys.exit(1)
-    
+
+    setup_logging()
+
     user_bot = UserBot()
     classic_bot = ClassicBot()
+    # Бот не видит закрытые группы, поэтому при промахе резолвер спрашивает аккаунт user bot
+    classic_bot.chat_resolver.add_client(user_bot.client)
+
+    metrics_runner = await start_metrics_server()
+    trace_exporter = tracing.start_exporter()
 
     try:
         await user_bot.start()
         await classic_bot.start()
 
         print("Оба бота запущены. Нажмите Ctrl+C для остановки.")
-        
-        await idle()
 
+        # idle() возвращается после SIGINT/SIGTERM, остановка выполняется в finally
+        await idle()
     except KeyboardInterrupt:
+        pass
+    finally:
         print("\nОстановка ботов...")
         await user_bot.stop()
         await classic_bot.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if trace_exporter:
+            trace_exporter.cancel()
+            await asyncio.gather(trace_exporter, return_exceptions=True)
         print("Боты остановлены.")
 
-
 if __name__ == "__main__":
-    asyncio.run(main())
+    if USER_BOT_WORKERS > 0:
+        if not validate_config():
+            print("\nИсправьте ошибки в .env файле и попробуйте снова.")
+            sys.exit(1)
+        from supervisor import run_supervisor
+        run_supervisor(USER_BOT_WORKERS)
+    else:
+        asyncio.run(main())
 
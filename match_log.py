@@ -0,0 +1,181 @@
+"""Журнал совпадений и пересылок с пакетной асинхронной записью в БД."""
+import asyncio
+import collections
+import logging
+import time
+from typing import Deque, Dict, Optional
+from sqlalchemy import delete, insert
+from database import get_session
+from models import MatchEntry, ForwardEntry
+from ingestion import MessageRecord
+from config import (
+    MATCH_LOG_ENABLED, MATCH_LOG_BATCH_SIZE, MATCH_LOG_FLUSH_MS, MATCH_LOG_MAX_BUFFER, MATCH_LOG_RETENTION_DAYS
+)
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Как часто удаляются записи старше срока хранения (секунды)
+RETENTION_CHECK_INTERVAL = 3600
+
+
+class MatchLog:
+    """
+    Журнал совпадений (таблица matches) и пересылок (таблица forwards).
+
+    Путь обработки сообщения только добавляет строку в буфер и не ждет БД.
+    Фоновая задача сохраняет буфер пакетными INSERT: как только набралось
+    batch_size строк или через flush_ms после первой строки пакета. Если
+    запись не удалась, строки возвращаются в буфер; сверх max_buffer самые
+    старые строки отбрасываются. Записи старше retention_days удаляются
+    раз в час.
+    """
+
+    TABLES = {"matches": MatchEntry, "forwards": ForwardEntry}
+
+    def __init__(self, enabled: bool = MATCH_LOG_ENABLED, batch_size: int = MATCH_LOG_BATCH_SIZE,
+                 flush_ms: int = MATCH_LOG_FLUSH_MS, max_buffer: int = MATCH_LOG_MAX_BUFFER,
+                 retention_days: int = MATCH_LOG_RETENTION_DAYS):
+        self.enabled = enabled
+        self.batch_size = max(1, batch_size)
+        self.flush_ms = flush_ms
+        self.max_buffer = max(self.batch_size, max_buffer)
+        self.retention_days = retention_days
+        self._buffers: Dict[str, Deque[dict]] = {table: collections.deque() for table in self.TABLES}
+        self._has_rows = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._tasks = []
+
+        for table in self.TABLES:
+            metrics.MATCH_LOG_BUFFER.set_function(lambda table=table: len(self._buffers[table]), table)
+
+    def pending(self) -> int:
+        """Строки, ожидающие записи."""
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def record_match(self, user_id: int, record: MessageRecord, match, delivery: str):
+        """Совпадение сообщения с фильтром пользователя (match - MatchResult движка)."""
+        self._add("matches", {
+            "user_id": user_id,
+            "chat_id": record.chat_id,
+            "message_id": record.message_id,
+            "filter_id": match.filter_id,
+            "kind": match.kind,
+            "matched": match.matched,
+            "score": float(match.score),
+            "delivery": delivery,
+            "created_at": time.time(),
+        })
+
+    def record_forward(self, user_id: int, target_chat_id: int, record: MessageRecord,
+                       account: Optional[str] = None):
+        """Пересылка сообщения в чат доставки пользователя."""
+        self._add("forwards", {
+            "user_id": user_id,
+            "target_chat_id": target_chat_id,
+            "chat_id": record.chat_id,
+            "message_id": record.message_id,
+            "account": account,
+            "created_at": time.time(),
+        })
+
+    def _add(self, table: str, row: dict):
+        if not self.enabled:
+            return
+        buffer = self._buffers[table]
+        if len(buffer) >= self.max_buffer:
+            buffer.popleft()
+            metrics.MATCH_LOG_DROPPED.inc(table)
+        buffer.append(row)
+        self._has_rows.set()
+        if len(buffer) >= self.batch_size:
+            self._batch_full.set()
+
+    async def flush(self):
+        """Запись всех накопленных строк пакетными INSERT одной транзакцией."""
+        batches = {table: buffer for table, buffer in self._buffers.items() if buffer}
+        if not batches:
+            return
+        for table in batches:
+            self._buffers[table] = collections.deque()
+
+        started = time.perf_counter()
+        try:
+            async for session in get_session():
+                for table, rows in batches.items():
+                    await session.execute(insert(self.TABLES[table]), list(rows))
+                await session.commit()
+        except Exception:
+            # Строки возвращаются в начало буфера, чтобы записаться следующим пакетом
+            for table, rows in batches.items():
+                rows.extend(self._buffers[table])
+                overflow = len(rows) - self.max_buffer
+                for _ in range(max(0, overflow)):
+                    rows.popleft()
+                if overflow > 0:
+                    metrics.MATCH_LOG_DROPPED.inc(table, amount=overflow)
+                self._buffers[table] = rows
+            raise
+        metrics.MATCH_LOG_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        for table, rows in batches.items():
+            metrics.MATCH_LOG_ROWS.inc(table, amount=len(rows))
+
+    async def cleanup(self) -> int:
+        """Удаление записей старше срока хранения; число удаленных строк."""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = time.time() - self.retention_days * 86400
+        removed = 0
+        async for session in get_session():
+            for model in self.TABLES.values():
+                result = await session.execute(delete(model).where(model.created_at < cutoff))
+                removed += result.rowcount or 0
+            await session.commit()
+        if removed:
+            logger.info("Удалено записей журнала старше %d дн.: %d", self.retention_days, removed)
+        return removed
+
+    def start(self):
+        if not self.enabled or self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._flush_loop(), name="match-log-flush")]
+        if self.retention_days > 0:
+            self._tasks.append(asyncio.create_task(self._cleanup_loop(), name="match-log-cleanup"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Не удалось сохранить журнал совпадений при остановке")
+
+    async def _flush_loop(self):
+        while True:
+            await self._has_rows.wait()
+            if self.pending() < self.batch_size and self.flush_ms > 0:
+                # Пакет добирается до batch_size строк, но ждет не дольше flush_ms
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_ms / 1000)
+                except asyncio.TimeoutError:
+                    pass
+            # События сбрасываются до того, как flush заберет буферы: строки,
+            # добавленные во время записи, снова взведут их
+            self._has_rows.clear()
+            self._batch_full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось записать журнал совпадений")
+                self._has_rows.set()
+                await asyncio.sleep(max(1.0, self.flush_ms / 1000))
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                await self.cleanup()
+            except Exception:
+                logger.exception("Не удалось удалить старые записи журнала")
+            await asyncio.sleep(RETENTION_CHECK_INTERVAL)
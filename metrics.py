@@ -0,0 +1,248 @@
+"""Метрики конвейера в текстовом формате Prometheus.
+
+Счетчики и гистограммы хранятся в обычных словарях и обновляются из цикла
+событий без блокировок, поэтому инструментирование можно держать включенным
+в продакшене. Эндпоинт /metrics отдается через aiohttp на локальном порту.
+"""
+import bisect
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from aiohttp import web
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Границы по умолчанию, секунды: от миллисекунд до десятков секунд
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Форматирование набора меток {a="x",b="y"}."""
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Базовый класс метрики."""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        """Увеличение счетчика для набора значений меток."""
+        self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0.0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Значение, которое может расти и убывать, либо вычисляться при сборе."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, *labelvalues: str):
+        self._values[labelvalues] = value
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def dec(self, *labelvalues: str, amount: float = 1.0):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set_function(self, func: Callable[[], float], *labelvalues: str):
+        """Значение будет вычисляться вызовом func при каждом сборе метрик."""
+        self._functions[labelvalues] = func
+
+    def samples(self) -> List[str]:
+        values = dict(self._values)
+        for labels, func in self._functions.items():
+            try:
+                values[labels] = float(func())
+            except Exception:
+                continue
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels → [счетчики корзин..., +Inf], сумма
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        counts = self._counts.get(labelvalues)
+        if counts is None:
+            counts = self._counts[labelvalues] = [0] * (len(self.buckets) + 1)
+            self._sums[labelvalues] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[labelvalues] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {self._sums[labels]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """Все зарегистрированные метрики в текстовом формате Prometheus."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """
+    Запуск HTTP-эндпоинта /metrics.
+
+    Returns:
+        AppRunner для остановки или None, если порт не задан (метрики выключены)
+    """
+    if not port:
+        return None
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
+
+
+# Конвейер user bot
+MESSAGES_SEEN = Counter("newsbot_messages_seen_total", "Сообщения, полученные обработчиком user bot")
+MESSAGES_SKIPPED = Counter(
+    "newsbot_messages_skipped_total", "Сообщения, отброшенные до применения фильтров", ("reason",)
+)
+MESSAGES_MATCHED = Counter("newsbot_messages_matched_total", "Совпадения сообщения с фильтрами пользователя")
+MESSAGES_FORWARDED = Counter("newsbot_messages_forwarded_total", "Успешно пересланные сообщения")
+FORWARD_ERRORS = Counter("newsbot_forward_errors_total", "Ошибки пересылки", ("error",))
+FLOOD_WAIT_SECONDS = Counter("newsbot_flood_wait_seconds_total", "Суммарное время ожидания FloodWait")
+PROCESS_SECONDS = Histogram("newsbot_process_seconds", "Время обработки одного сообщения")
+UPDATES_QUEUE_DEPTH = Gauge("newsbot_updates_queue_depth", "Необработанные обновления в очереди Pyrogram")
+
+# Очередь приема сообщений
+INGEST_QUEUE_DEPTH = Gauge("newsbot_ingest_queue_depth", "Записи в очереди приема сообщений")
+INGEST_DROPPED = Counter("newsbot_ingest_dropped_total", "Записи, отброшенные при перегрузке", ("reason",))
+INGEST_DEGRADED = Counter(
+    "newsbot_ingest_degraded_total", "Записи, обработанные без семантики из-за перегрузки"
+)
+INGEST_WAIT_SECONDS = Histogram("newsbot_ingest_wait_seconds", "Время ожидания записи в очереди")
+SUBSCRIBED_CHATS = Gauge("newsbot_subscribed_chats", "Чаты с подписками в реестре user bot")
+BACKFILL_MESSAGES = Counter("newsbot_backfill_messages_total", "Сообщения, догруженные из истории чатов")
+DIGEST_ITEMS = Counter("newsbot_digest_items_total", "Совпадения, добавленные в буфер дайджестов")
+DIGESTS_SENT = Counter("newsbot_digests_sent_total", "Отправленные дайджесты")
+RANKED_CANDIDATES = Counter("newsbot_ranked_candidates_total", "Совпадения-кандидаты в режиме top-K")
+RANKED_DELIVERED = Counter("newsbot_ranked_delivered_total", "Кандидаты top-K, доставленные пользователям")
+RANKED_DROPPED = Counter("newsbot_ranked_dropped_total", "Кандидаты top-K, не вошедшие в бюджет окна")
+MATCH_LOG_ROWS = Counter("newsbot_match_log_rows_total", "Строки, записанные в журнал", ("table",))
+MATCH_LOG_DROPPED = Counter(
+    "newsbot_match_log_dropped_total", "Строки журнала, отброшенные при переполнении буфера", ("table",)
+)
+MATCH_LOG_BUFFER = Gauge("newsbot_match_log_buffer", "Строки журнала, ожидающие записи", ("table",))
+MATCH_LOG_FLUSH_SECONDS = Histogram("newsbot_match_log_flush_seconds", "Время пакетной записи журнала")
+FORWARDS_DEDUPLICATED = Counter(
+    "newsbot_forwards_deduplicated_total", "Пересылки, пропущенные: сообщение уже доставлено в этот чат"
+)
+DELIVERY_LEDGER_SIZE = Gauge("newsbot_delivery_ledger_size", "Ключи доставок в памяти")
+FEEDBACK_VOTES = Counter("newsbot_feedback_votes_total", "Оценки пересланных совпадений", ("vote",))
+FEEDBACK_SAMPLED = Counter("newsbot_feedback_sampled_total", "Пересылки, отобранные для запроса оценки")
+
+# Пул аккаунтов
+ACCOUNT_FORWARDS = Counter("newsbot_account_forwards_total", "Пересылки по аккаунтам пула", ("account",))
+ACCOUNT_FLOODED = Gauge("newsbot_account_flooded", "Аккаунт ограничен FloodWait/PEER_FLOOD (1/0)", ("account",))
+FORWARD_RETRY_QUEUE = Gauge("newsbot_forward_retry_queue", "Пересылки, отложенные до появления квоты")
+ACCOUNT_ASSIGNED_CHATS = Gauge("newsbot_account_assigned_chats", "Чаты, закрепленные за аккаунтом", ("account",))
+
+# Движок фильтрации
+FILTER_EVALUATIONS = Counter(
+    "newsbot_filter_evaluations_total", "Проверки фильтров", ("kind", "result")
+)
+MODEL_ENCODE_SECONDS = Histogram("newsbot_model_encode_seconds", "Время вызова encode модели")
+PROVIDER_REQUESTS = Counter(
+    "newsbot_provider_requests_total", "Запросы к провайдеру семантики", ("provider", "operation", "result")
+)
+PROVIDER_SECONDS = Histogram(
+    "newsbot_provider_seconds", "Время ответа провайдера семантики", ("provider", "operation")
+)
+PROVIDER_STATE = Gauge(
+    "newsbot_provider_state", "Состояние предохранителя провайдера: 0 - closed, 1 - half_open, 2 - open",
+    ("provider",)
+)
+PROVIDER_TRIPS = Counter("newsbot_provider_trips_total", "Размыкания предохранителя провайдера", ("provider",))
+SEMANTIC_FALLBACKS = Counter(
+    "newsbot_semantic_fallbacks_total",
+    "Семантические проверки, выполненные запасным провайдером (none - только ключевые слова)", ("provider",)
+)
+MODEL_LOAD_SECONDS = Gauge("newsbot_model_load_seconds", "Время загрузки семантической модели")
+SEMANTIC_CHUNKS = Histogram(
+    "newsbot_semantic_chunks", "Окон предложений на сообщение при семантическом поиске",
+    buckets=(1, 2, 4, 8, 16, 32)
+)
+LEMMA_CACHE = Gauge("newsbot_lemma_cache", "Кэш лемм: размер, попадания и промахи", ("stat",))
+COMPILED_FILTERS = Gauge("newsbot_compiled_filters", "Скомпилированные фильтры в памяти")
+EMBEDDING_BYTES = Gauge("newsbot_embedding_bytes", "Память под эмбеддинги", ("store",))
+FIRST_MESSAGE_SECONDS = Gauge(
+    "newsbot_first_message_seconds", "Время от запуска user bot до первого обработанного сообщения"
+)
+
+# Classic bot и общие компоненты
+COMMANDS = Counter("newsbot_commands_total", "Команды classic bot", ("command",))
+CHAT_RESOLVER_LOOKUPS = Counter(
+    "newsbot_chat_resolver_lookups_total", "Разрешения чатов по источнику ответа", ("source",)
+)
@@ -1,5 +1,5 @@
 """Модели базы данных."""
-from sqlalchemy import Column, Integer, String, Boolean, Text, BigInteger, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Text, BigInteger, ForeignKey, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -43,4 +43,143 @@ class Subscription(Base):
     user = relationship("User", back_populates="subscriptions")
 
 
+class ChatCache(Base):
+    """Модель кэша разрешения чатов (username/ID → чат)."""
+    __tablename__ = "chat_cache"
 
+    id = Column(Integer, primary_key=True, index=True)
+    lookup_key = Column(String, unique=True, index=True, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    chat_title = Column(String, nullable=True)
+    chat_type = Column(String, nullable=True)
+    username = Column(String, nullable=True)
+    resolved_at = Column(Float, nullable=False)
+
+
+class ChatProgress(Base):
+    """Модель последнего обработанного сообщения чата (для догрузки после простоя)."""
+    __tablename__ = "chat_progress"
+
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(BigInteger, unique=True, index=True, nullable=False)
+    last_message_id = Column(BigInteger, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+
+class DeliverySettings(Base):
+    """Модель настроек доставки пользователя (мгновенно, дайджестом или top-K за окно)."""
+    __tablename__ = "delivery_settings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, ForeignKey("users.user_id"), unique=True, index=True, nullable=False)
+    mode = Column(String, nullable=False, default="instant")
+    # Для режима top: длина окна в минутах и число сообщений за окно
+    digest_interval = Column(Integer, nullable=True)
+    digest_size = Column(Integer, nullable=True)
+    digest_format = Column(String, nullable=True)
+
+
+class DigestItem(Base):
+    """Модель совпадения, ожидающего отправки в дайджесте."""
+    __tablename__ = "digest_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, ForeignKey("users.user_id"), index=True, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=False)
+    chat_title = Column(String, nullable=True)
+    chat_username = Column(String, nullable=True)
+    excerpt = Column(Text, nullable=True)
+    created_at = Column(Float, nullable=False)
+
+
+class RankedMatch(Base):
+    """Модель совпадения-кандидата для доставки top-K за окно."""
+    __tablename__ = "ranked_matches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, ForeignKey("users.user_id"), index=True, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=False)
+    filter_id = Column(Integer, nullable=True)
+    kind = Column(String, nullable=False)
+    matched = Column(String, nullable=True)
+    score = Column(Float, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+
+class MatchFeedback(Base):
+    """Модель оценки пользователем пересланного семантического совпадения."""
+    __tablename__ = "match_feedback"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, ForeignKey("users.user_id"), index=True, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=False)
+    filter_id = Column(Integer, nullable=True)
+    topic = Column(String, nullable=True)
+    score = Column(Float, nullable=False)
+    text_length = Column(Integer, nullable=True)
+    created_at = Column(Float, nullable=False)
+    prompted = Column(Boolean, default=False, index=True)
+    vote = Column(Integer, nullable=True)
+    voted_at = Column(Float, nullable=True)
+
+
+class SemanticThreshold(Base):
+    """Модель подобранного по оценкам порога схожести (topic NULL - общий порог пользователя)."""
+    __tablename__ = "semantic_thresholds"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, ForeignKey("users.user_id"), index=True, nullable=False)
+    topic = Column(String, nullable=True)
+    threshold = Column(Float, nullable=False)
+    samples = Column(Integer, nullable=False)
+    fitted_at = Column(Float, nullable=False)
+
+
+class MatchEntry(Base):
+    """Модель записи журнала совпадений сообщения с фильтром пользователя."""
+    __tablename__ = "matches"
+    __table_args__ = (Index("ix_matches_user_chat_message", "user_id", "chat_id", "message_id"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=False)
+    filter_id = Column(Integer, nullable=True)
+    kind = Column(String, nullable=False)
+    matched = Column(String, nullable=True)
+    score = Column(Float, nullable=False)
+    delivery = Column(String, nullable=False)
+    created_at = Column(Float, index=True, nullable=False)
+
+
+class ForwardEntry(Base):
+    """Модель записи журнала пересланных сообщений."""
+    __tablename__ = "forwards"
+    # Проверка "доставлено ли уже (пользователь, чат, сообщение)" - поиск по этому индексу
+    __table_args__ = (Index("ix_forwards_user_chat_message", "user_id", "chat_id", "message_id"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    target_chat_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=False)
+    account = Column(String, nullable=True)
+    created_at = Column(Float, index=True, nullable=False)
+
+
+class Delivery(Base):
+    """Модель доставленного сообщения: каждое сообщение пересылается в чат не больше одного раза."""
+    __tablename__ = "deliveries"
+    __table_args__ = (
+        UniqueConstraint("target_chat_id", "chat_id", "message_id", name="uq_deliveries_target_chat_message"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    target_chat_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    created_at = Column(Float, index=True, nullable=False)
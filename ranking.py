@@ -0,0 +1,154 @@
+"""Доставка top-K: за окно времени пересылаются только самые релевантные совпадения."""
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+from sqlalchemy import delete, func, select
+from database import get_session
+from models import DeliverySettings, RankedMatch, User
+from filter_engine import MatchResult
+import feedback
+from ingestion import MessageRecord
+from config import TOP_K_DEFAULT_WINDOW, TOP_K_DEFAULT_SIZE, DIGEST_CHECK_INTERVAL, FEEDBACK_ENABLED
+import metrics
+
+if TYPE_CHECKING:
+    from user_bot import UserBot
+
+logger = logging.getLogger(__name__)
+
+
+class TopKSelector:
+    """
+    Кандидаты на пересылку для пользователей в режиме top.
+
+    Совпадения копятся в таблице ranked_matches. Когда самому старому
+    кандидату исполняется длина окна, пересылаются K кандидатов с наибольшей
+    оценкой (семантика - схожесть с темой, ключевое слово - KEYWORD_MATCH_SCORE
+    на той же шкале; из нескольких сработавших фильтров берется лучший), остальные
+    отбрасываются. В режиме шардирования кандидаты из чатов всех шардов
+    ранжирует один воркер, за которым закреплен пользователь
+    (ShardFilter.owns_user), поэтому за окно пользователь получает K
+    пересылок, а не K от каждого воркера; остальные воркеры только добавляют
+    кандидатов.
+    """
+
+    def __init__(self, bot: "UserBot", check_interval: int = DIGEST_CHECK_INTERVAL):
+        self.bot = bot
+        self.check_interval = check_interval
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _owns_user(self, user_id: int) -> bool:
+        return not self.bot.shard or self.bot.shard.owns_user(user_id)
+
+    async def add(self, user: User, record: MessageRecord, match: MatchResult):
+        """Добавление совпадения в кандидаты текущего окна."""
+        async for session in get_session():
+            session.add(RankedMatch(
+                user_id=user.user_id,
+                chat_id=record.chat_id,
+                message_id=record.message_id,
+                filter_id=match.filter_id,
+                kind=match.kind,
+                matched=match.matched,
+                score=match.score,
+                created_at=time.time()
+            ))
+            await session.commit()
+        metrics.RANKED_CANDIDATES.inc()
+
+    async def deliver_user(self, user_id: int):
+        """
+        Пересылка top-K кандидатов пользователя и очистка окна.
+
+        Не вошедшие в K кандидаты удаляются сразу, выбранные - каждый после
+        своей пересылки: кандидат, который не удалось переслать, остается в
+        таблице и доставляется при следующей проверке.
+        """
+        if not self._owns_user(user_id):
+            return
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            async for session in get_session():
+                user = (await session.execute(select(User).where(User.user_id == user_id))).scalar_one_or_none()
+                settings = (await session.execute(
+                    select(DeliverySettings).where(DeliverySettings.user_id == user_id)
+                )).scalar_one_or_none()
+                result = await session.execute(
+                    select(RankedMatch).where(RankedMatch.user_id == user_id)
+                    .order_by(RankedMatch.score.desc(), RankedMatch.id)
+                )
+                candidates = result.scalars().all()
+                if not candidates:
+                    return
+
+                # Режим мог смениться, пока кандидаты ждали окна: тогда они доставляются все
+                k = len(candidates)
+                if settings and settings.mode == "top":
+                    k = settings.digest_size or TOP_K_DEFAULT_SIZE
+                selected = sorted(candidates[:k], key=lambda item: item.id)
+                # Пользователь удален - доставлять некому
+                dropped = candidates[k:] if user else candidates
+
+                if dropped:
+                    await session.execute(delete(RankedMatch).where(RankedMatch.id.in_([item.id for item in dropped])))
+                    await session.commit()
+
+            delivered = 0
+            if user:
+                target_chat_id = self.bot.target_chat_id(user)
+                for item in selected:
+                    logger.debug(
+                        "Top-K: пользователь %s, сообщение %s из %s (%s '%s', оценка %.3f)",
+                        user_id, item.message_id, item.chat_id, item.kind, item.matched, item.score
+                    )
+                    record = MessageRecord(item.chat_id, item.message_id, "")
+                    forwarded = await self.bot.forward_message(user, record)
+                    # Сообщение, уже доставленное в этот чат, повторно не пересылается
+                    if not forwarded and (target_chat_id, item.chat_id, item.message_id) not in self.bot.ledger:
+                        continue
+                    async for session in get_session():
+                        await session.execute(delete(RankedMatch).where(RankedMatch.id == item.id))
+                        await session.commit()
+                    delivered += 1
+                    if forwarded and FEEDBACK_ENABLED and item.kind == "semantic":
+                        match = MatchResult(item.filter_id, item.kind, item.score, item.matched or "")
+                        await feedback.record_match(user_id, record, match)
+            metrics.RANKED_DELIVERED.inc(amount=delivered)
+            metrics.RANKED_DROPPED.inc(amount=len(dropped))
+            logger.info("Top-K для пользователя %s: доставлено %d из %d", user_id, delivered, len(candidates))
+
+    async def deliver_due(self):
+        """Доставка для пользователей, у которых закончилось окно."""
+        now = time.time()
+        async for session in get_session():
+            result = await session.execute(
+                select(RankedMatch.user_id, func.min(RankedMatch.created_at), DeliverySettings.digest_interval)
+                .outerjoin(DeliverySettings, DeliverySettings.user_id == RankedMatch.user_id)
+                .group_by(RankedMatch.user_id, DeliverySettings.digest_interval)
+            )
+            due = [
+                user_id for user_id, oldest, window in result.all()
+                if self._owns_user(user_id) and now - oldest >= (window or TOP_K_DEFAULT_WINDOW) * 60
+            ]
+        for user_id in due:
+            await self.deliver_user(user_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="top-k-delivery")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.deliver_due()
+            except Exception:
+                logger.exception("Ошибка доставки top-K")
@@ -0,0 +1,328 @@
+"""Провайдеры семантики: общий асинхронный интерфейс и реестр реализаций.
+
+Провайдер либо кодирует тексты в векторы (kind="embedding": local, openai,
+mock) - тогда окна, схожесть и правила считает FilterEngine, - либо сам
+оценивает близость текста к темам (kind="scoring": openrouter, yandex).
+Реализация выбирается по имени (SEMANTIC_PROVIDER) через create_provider;
+новые регистрируются декоратором register_provider.
+"""
+import abc
+import asyncio
+import contextvars
+import functools
+import hashlib
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+import aiohttp
+import numpy as np
+
+from config import (
+    OPENROUTER_API_KEY, OPENROUTER_MODEL,
+    YANDEX_API_KEY, YANDEX_FOLDER_ID,
+    OPENAI_API_KEY, OPENAI_MODEL, SEMANTIC_PROVIDER_TIMEOUT,
+    MOCK_PROVIDER_LATENCY_MS, MOCK_PROVIDER_JITTER_MS, MOCK_PROVIDER_ERROR_RATE,
+    MOCK_PROVIDER_SEED, MOCK_PROVIDER_DIM
+)
+from text_normalizer import normalizer
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """Провайдер не ответил: нет ключа, ошибка сети или HTTP, неразборчивый ответ."""
+
+
+class ProviderUnavailable(ProviderError):
+    """Вызов отклонен без обращения к провайдеру: предохранитель разомкнут."""
+
+
+class SemanticProvider(abc.ABC):
+    """
+    Интерфейс провайдера семантики.
+
+    encode(texts) - матрица float32, строка на текст (kind="embedding");
+    score(text, topics) - оценка близости 0..1 на каждую тему (kind="scoring").
+    По умолчанию score считается косинусом векторов encode, поэтому
+    провайдер эмбеддингов можно использовать и как оценщик. Ошибки
+    сообщаются исключением ProviderError.
+    """
+
+    name = ""
+    kind = "embedding"
+
+    @abc.abstractmethod
+    async def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """Матрица эмбеддингов float32, строка на текст."""
+
+    async def score(self, text: str, topics: Sequence[str]) -> List[float]:
+        vectors = np.asarray(await self.encode([text, *topics]), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return (vectors[1:] @ vectors[0]).tolist()
+
+    def ready(self) -> bool:
+        """Готов ли провайдер к вызовам (неготовый пропускается в цепочке без учета как ошибки)."""
+        return True
+
+    async def close(self):
+        """Освобождение соединений (вызывается при остановке)."""
+
+
+PROVIDERS: Dict[str, Type[SemanticProvider]] = {}
+
+
+def register_provider(name: str) -> Callable[[Type[SemanticProvider]], Type[SemanticProvider]]:
+    """Регистрация реализации под именем, которое указывается в SEMANTIC_PROVIDER."""
+    def decorator(cls: Type[SemanticProvider]) -> Type[SemanticProvider]:
+        cls.name = name
+        PROVIDERS[name] = cls
+        return cls
+    return decorator
+
+
+def create_provider(name: str, **options) -> SemanticProvider:
+    """
+    Экземпляр зарегистрированного провайдера.
+
+    Raises:
+        ValueError: если провайдер с таким именем не зарегистрирован
+    """
+    try:
+        cls = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(
+            f"Неизвестный провайдер семантики: {name} (доступны: {', '.join(sorted(PROVIDERS))})"
+        ) from None
+    return cls(**options)
+
+
+@register_provider("local")
+class LocalProvider(SemanticProvider):
+    """
+    Локальная модель sentence-transformers.
+
+    Модель загружает и прогревает FilterEngine (фоновый прогрев, fork после
+    загрузки в супервизоре), провайдер получает его функцию кодирования и
+    проверку, что модель загружена.
+    Кодирование выполняется в отдельном потоке: пока модель считает окна
+    сообщения, цикл событий продолжает принимать апдейты Pyrogram и
+    пересылать. Поток один - модель и так занимает все ядра, а параллельные
+    вызовы только мешали бы друг другу.
+    """
+
+    def __init__(self, encoder: Callable[[List[str]], np.ndarray], ready: Callable[[], bool] = lambda: True):
+        self.encoder = encoder
+        self._ready = ready
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def ready(self) -> bool:
+        return self._ready()
+
+    async def encode(self, texts: Sequence[str]) -> np.ndarray:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-encode")
+        # Контекст копируется, чтобы span кодирования попал в трассировку сообщения
+        call = functools.partial(contextvars.copy_context().run, self.encoder, list(texts))
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+@register_provider("openai")
+class OpenAIProvider(SemanticProvider):
+    """OpenAI embeddings: все тексты кодируются одним запросом, клиент переиспользуется."""
+
+    def __init__(self, api_key: str = OPENAI_API_KEY, model: str = OPENAI_MODEL,
+                 timeout: float = SEMANTIC_PROVIDER_TIMEOUT):
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+        self._client = None
+
+    async def encode(self, texts: Sequence[str]) -> np.ndarray:
+        if not self.api_key:
+            raise ProviderError("OPENAI_API_KEY не установлен")
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=self.api_key, timeout=self.timeout)
+        try:
+            response = await self._client.embeddings.create(model=self.model, input=list(texts))
+        except Exception as e:
+            raise ProviderError(f"OpenAI: {e}") from e
+        return np.asarray([item.embedding for item in response.data], dtype=np.float32)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class ChatScoringProvider(SemanticProvider):
+    """
+    Оценка близости LLM-моделью через HTTP API чата.
+
+    На каждую тему отправляется отдельный запрос (параллельно), ответ -
+    число от 0.0 до 1.0. Сессия aiohttp общая для всех запросов провайдера.
+    Наследники задают url, prompt, заголовки и тело запроса и разбор ответа.
+    """
+
+    kind = "scoring"
+    url = ""
+    prompt = ""
+
+    def __init__(self, timeout: float = SEMANTIC_PROVIDER_TIMEOUT):
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def check_credentials(self):
+        """Raises ProviderError, если не заданы ключи API."""
+
+    @abc.abstractmethod
+    def build_request(self, prompt: str) -> Tuple[dict, dict]:
+        """Заголовки и тело запроса."""
+
+    @abc.abstractmethod
+    def parse_answer(self, result: dict) -> str:
+        """Текст ответа модели из JSON ответа API."""
+
+    async def encode(self, texts: Sequence[str]) -> np.ndarray:
+        # Движок не кодирует тексты провайдером kind="scoring", он вызывает только score
+        raise ProviderError(f"{self.name}: провайдер оценивает близость и не возвращает эмбеддинги")
+
+    async def score(self, text: str, topics: Sequence[str]) -> List[float]:
+        self.check_credentials()
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return list(await asyncio.gather(*(self._score_topic(text, topic) for topic in topics)))
+
+    async def _score_topic(self, text: str, topic: str) -> float:
+        headers, payload = self.build_request(self.prompt.format(text=text, topic=topic))
+        try:
+            async with self._session.post(self.url, headers=headers, json=payload) as response:
+                if response.status != 200:
+                    raise ProviderError(f"{self.name}: HTTP {response.status}")
+                result = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ProviderError(f"{self.name}: {e!r}") from e
+
+        answer = self.parse_answer(result)
+        try:
+            return float(answer.strip())
+        except ValueError:
+            raise ProviderError(f"{self.name}: не удалось разобрать ответ {answer!r}") from None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+@register_provider("openrouter")
+class OpenRouterProvider(ChatScoringProvider):
+    """OpenRouter API (Qwen и др.)."""
+
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    prompt = """Определи, насколько текст "{text}" семантически близок к теме "{topic}".
+Ответь только числом от 0.0 до 1.0, где 1.0 - полное совпадение, 0.0 - нет связи."""
+
+    def check_credentials(self):
+        if not OPENROUTER_API_KEY:
+            raise ProviderError("OPENROUTER_API_KEY не установлен")
+
+    def build_request(self, prompt: str) -> Tuple[dict, dict]:
+        headers = {
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        data = {
+            "model": OPENROUTER_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.1
+        }
+        return headers, data
+
+    def parse_answer(self, result: dict) -> str:
+        return result.get("choices", [{}])[0].get("message", {}).get("content", "0.0")
+
+
+@register_provider("yandex")
+class YandexProvider(ChatScoringProvider):
+    """YandexGPT API."""
+
+    url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+    prompt = """Оцени семантическую близость текста "{text}" к теме "{topic}".
+Ответь только числом от 0.0 до 1.0."""
+
+    def check_credentials(self):
+        if not YANDEX_API_KEY or not YANDEX_FOLDER_ID:
+            raise ProviderError("YANDEX_API_KEY или YANDEX_FOLDER_ID не установлены")
+
+    def build_request(self, prompt: str) -> Tuple[dict, dict]:
+        headers = {
+            "Authorization": f"Api-Key {YANDEX_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        data = {
+            "modelUri": f"gpt://{YANDEX_FOLDER_ID}/yandexgpt/latest",
+            "completionOptions": {
+                "stream": False,
+                "temperature": 0.1
+            },
+            "messages": [{"role": "user", "text": prompt}]
+        }
+        return headers, data
+
+    def parse_answer(self, result: dict) -> str:
+        return result.get("result", {}).get("alternatives", [{}])[0].get("message", {}).get("text", "0.0")
+
+
+@register_provider("mock")
+class MockProvider(SemanticProvider):
+    """
+    Детерминированный провайдер для нагрузочных тестов и оценки без сети и модели.
+
+    Вектор текста - сумма псевдослучайных векторов его нормализованных слов
+    (зерно - хэш слова), поэтому тексты с общими словами близки, а векторы
+    одинаковы между запусками и процессами. Каждый вызов ждет latency_ms
+    плюс случайные 0..jitter_ms и с вероятностью error_rate завершается
+    ProviderError; последовательность задержек и ошибок воспроизводима при
+    одном seed.
+    """
+
+    def __init__(self, latency_ms: float = MOCK_PROVIDER_LATENCY_MS, jitter_ms: float = MOCK_PROVIDER_JITTER_MS,
+                 error_rate: float = MOCK_PROVIDER_ERROR_RATE, seed: int = MOCK_PROVIDER_SEED,
+                 dim: int = MOCK_PROVIDER_DIM):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.seed = seed
+        self.dim = dim
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._word_vector = functools.lru_cache(maxsize=100_000)(self._make_word_vector)
+
+    def _make_word_vector(self, word: str) -> np.ndarray:
+        digest = hashlib.blake2b(f"{self.seed}:{word}".encode("utf-8"), digest_size=8).digest()
+        return np.random.default_rng(int.from_bytes(digest, "little")).standard_normal(self.dim).astype(np.float32)
+
+    def _embed(self, text: str) -> np.ndarray:
+        words = normalizer.tokens(text) or [text]
+        return np.sum([self._word_vector(word) for word in words], axis=0)
+
+    async def _respond(self):
+        self.calls += 1
+        delay = self.latency_ms + (self._rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        failed = self.error_rate > 0 and self._rng.random() < self.error_rate
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if failed:
+            raise ProviderError("mock: имитация ошибки провайдера")
+
+    async def encode(self, texts: Sequence[str]) -> np.ndarray:
+        await self._respond()
+        return np.stack([self._embed(text) for text in texts])
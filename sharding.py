@@ -0,0 +1,70 @@
+"""Консистентное хеширование chat_id по процессам-воркерам user bot."""
+import bisect
+import hashlib
+from typing import Dict, List
+from pyrogram import filters
+
+
+def _hash(value: str) -> int:
+    """Стабильный между процессами хеш (встроенный hash() рандомизирован)."""
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Кольцо консистентного хеширования с виртуальными узлами."""
+
+    def __init__(self, shard_count: int, vnodes: int = 128):
+        """
+        Args:
+            shard_count: Число шардов (воркеров)
+            vnodes: Число виртуальных узлов на шард для равномерности
+        """
+        self.shard_count = shard_count
+        points = sorted(
+            (_hash(f"shard-{shard}-{vnode}"), shard)
+            for shard in range(shard_count)
+            for vnode in range(vnodes)
+        )
+        self._keys: List[int] = [point for point, _ in points]
+        self._shards: List[int] = [shard for _, shard in points]
+
+    def shard_for(self, chat_id: int) -> int:
+        """Номер шарда, владеющего чатом."""
+        index = bisect.bisect(self._keys, _hash(str(chat_id))) % len(self._keys)
+        return self._shards[index]
+
+
+async def _shard_chat(flt, client, message) -> bool:
+    """Фильтр Pyrogram: апдейты чатов других шардов отбрасываются до обработчика."""
+    chat = message.chat
+    return chat is not None and flt.shard.owns(chat.id)
+
+
+class ShardFilter:
+    """Проверка принадлежности чата шарду текущего воркера."""
+
+    def __init__(self, shard_index: int, shard_count: int):
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.ring = HashRing(shard_count)
+        self._owned: Dict[int, bool] = {}
+        # Фильтр диспетчера: все воркеры получают апдейты одной авторизации
+        self.filter = filters.create(_shard_chat, "ShardChatFilter", shard=self)
+
+    def owns(self, chat_id: int) -> bool:
+        """True, если чат обрабатывается этим воркером (результат кэшируется)."""
+        owned = self._owned.get(chat_id)
+        if owned is None:
+            owned = self._owned[chat_id] = self.ring.shard_for(chat_id) == self.shard_index
+        return owned
+
+    def owns_user(self, user_id: int) -> bool:
+        """True, если этот воркер отвечает за доставку пользователю (дайджесты).
+
+        Пользователь закрепляется за шардом по тому же кольцу, что и чаты;
+        ключи не пересекаются: ID пользователей положительные, групп и каналов - отрицательные.
+        """
+        return self.owns(user_id)
+
+    def __repr__(self) -> str:
+        return f"ShardFilter({self.shard_index}/{self.shard_count})"
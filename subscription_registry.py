@@ -0,0 +1,103 @@
+"""Реестр чатов, на которые есть подписки, для отсева апдейтов до обработчика."""
+import asyncio
+import logging
+from typing import Callable, List, Optional, Set
+from pyrogram import filters
+from sqlalchemy import select
+from database import get_session
+from models import Subscription
+from config import SUBSCRIPTION_REFRESH_INTERVAL
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+async def _subscribed_chat(flt, client, message) -> bool:
+    """Фильтр Pyrogram: апдейты из чатов без подписок не доходят до обработчика.
+
+    Корутина, а не обычная функция: синхронные фильтры Pyrogram выполняет в пуле потоков.
+    """
+    chat = message.chat
+    return chat is not None and chat.id in flt.registry.chat_ids
+
+
+class SubscriptionRegistry:
+    """
+    Множество chat_id с хотя бы одной подпиской.
+
+    В одном процессе classic bot сообщает об изменениях подписок напрямую;
+    в режиме супервизора classic bot работает в другом процессе, поэтому
+    воркеры периодически перечитывают подписки из БД.
+
+    Слушатели on_removed вызываются с chat_id, на который не осталось подписок
+    (например, пул аккаунтов снимает закрепление чата).
+    """
+
+    def __init__(self):
+        self.chat_ids: Set[int] = set()
+        self.on_removed: List[Callable[[int], None]] = []
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.filter = filters.create(_subscribed_chat, "SubscribedChatFilter", registry=self)
+
+        metrics.SUBSCRIBED_CHATS.set_function(lambda: len(self.chat_ids))
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self.chat_ids
+
+    def add(self, chat_id: int):
+        self.chat_ids.add(chat_id)
+
+    def discard(self, chat_id: int):
+        if chat_id in self.chat_ids:
+            self.chat_ids.discard(chat_id)
+            self._notify_removed(chat_id)
+
+    def _notify_removed(self, chat_id: int):
+        for listener in list(self.on_removed):
+            try:
+                listener(chat_id)
+            except Exception:
+                logger.exception("Ошибка обработчика удаления чата %s из реестра", chat_id)
+
+    async def load(self):
+        """Загрузка множества из таблицы подписок."""
+        async for session in get_session():
+            result = await session.execute(select(Subscription.chat_id).distinct())
+            chat_ids = set(result.scalars().all())
+        removed = self.chat_ids - chat_ids
+        self.chat_ids = chat_ids
+        for chat_id in removed:
+            self._notify_removed(chat_id)
+        logger.debug("Реестр подписок: %d чат(ов)", len(self.chat_ids))
+
+    async def refresh_on_subscription_removed(self, chat_id: int):
+        """Удаление чата из реестра, если на него не осталось подписок."""
+        async for session in get_session():
+            result = await session.execute(
+                select(Subscription.id).where(Subscription.chat_id == chat_id).limit(1)
+            )
+            if result.scalar_one_or_none() is None:
+                self.discard(chat_id)
+
+    def start_refresh(self, interval: int = SUBSCRIPTION_REFRESH_INTERVAL):
+        """Запуск периодической перезагрузки из БД (0 - выключено)."""
+        if interval > 0 and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(interval), name="subscription-refresh")
+
+    async def stop_refresh(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def _refresh_loop(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("Не удалось обновить реестр подписок")
+
+
+# Общий экземпляр процесса: classic bot и user bot в одном процессе видят одно множество
+registry = SubscriptionRegistry()
@@ -0,0 +1,220 @@
+"""Режим супервизора: несколько процессов user bot с шардированием чатов.
+
+Супервизор авторизует аккаунт отдельной сессией для каждого процесса и
+экспортирует их строки, загружает семантическую модель, после чего через fork запускает N воркеров
+user bot (веса модели разделяются copy-on-write) и один управляющий процесс
+с classic bot. Каждый воркер обрабатывает только чаты своего шарда
+консистентного хеширования. Упавшие процессы перезапускаются.
+
+Два подключения с одним ключом авторизации Telegram разрывает
+(AUTH_KEY_DUPLICATED), поэтому у каждого процесса своя сессия того же
+аккаунта: управляющий процесс использует первую сессию USER_BOT_SESSIONS,
+воркер N - сессию с суффиксом _worker_N (авторизуется при первом запуске).
+
+Шардирование делит только работу CPU (фильтрация, инференс модели): все
+сессии принадлежат одному аккаунту. Каждый воркер получает весь поток апдейтов
+аккаунта и отбрасывает апдейты чужих шардов фильтром диспетчера, а
+лимиты Telegram (квота пересылок, FloodWait) общие, поэтому квота
+ACCOUNT_FORWARDS_PER_MINUTE делится между воркерами. Для нескольких
+аккаунтов используется пул USER_BOT_SESSIONS в одном процессе.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional
+from pyrogram import Client, idle
+from config import API_ID, API_HASH, METRICS_PORT, USER_BOT_SESSIONS
+from database import engine, init_db
+from filter_engine import FilterEngine
+from log_config import setup_logging
+from sharding import ShardFilter
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Минимальная пауза перед перезапуском упавшего процесса
+RESTART_DELAY = 5
+
+_context = multiprocessing.get_context("fork")
+
+
+def _session_names(worker_count: int) -> Dict[str, str]:
+    """Имя файла сессии для каждого процесса: у каждого свой ключ авторизации."""
+    base = USER_BOT_SESSIONS[0]
+    names = {"control": base}
+    for index in range(worker_count):
+        names[f"worker-{index}"] = f"{base}_worker_{index}"
+    return names
+
+
+async def _prepare(worker_count: int) -> Dict[str, str]:
+    """Создание таблиц и экспорт строк сессий user bot в родительском процессе."""
+    await init_db()
+    # Соединения пула не должны переходить в дочерние процессы
+    await engine.dispose()
+
+    session_strings: Dict[str, str] = {}
+    user_ids: List[int] = []
+    for process_name, session_name in _session_names(worker_count).items():
+        # Новая сессия запросит вход в аккаунт (код подтверждения) один раз
+        client = Client(session_name, api_id=API_ID, api_hash=API_HASH)
+        await client.start()
+        me = await client.get_me()
+        session_strings[process_name] = await client.export_session_string()
+        await client.stop()
+        if user_ids and me.id != user_ids[0]:
+            raise RuntimeError(
+                f"Сессия {session_name} принадлежит другому аккаунту (ID {me.id}), ожидался ID {user_ids[0]}"
+            )
+        user_ids.append(me.id)
+    return session_strings
+
+
+def _session_client(name: str, session_string: str, no_updates: bool = False) -> Client:
+    """Клиент user bot в памяти на основе экспортированной сессии."""
+    return Client(
+        name,
+        api_id=API_ID,
+        api_hash=API_HASH,
+        session_string=session_string,
+        in_memory=True,
+        no_updates=no_updates
+    )
+
+
+async def _run_worker(shard_index: int, shard_count: int, session_string: str, filter_engine: FilterEngine):
+    """Воркер user bot, обрабатывающий один шард чатов."""
+    from user_bot import UserBot
+
+    client = _session_client(f"user_bot_worker_{shard_index}", session_string)
+    user_bot = UserBot(client=client, shard=ShardFilter(shard_index, shard_count), filter_engine=filter_engine)
+    # Все воркеры пересылают от одного аккаунта: квота в минуту делится между ними
+    if user_bot.pool.forward_quota:
+        user_bot.pool.forward_quota = max(1, user_bot.pool.forward_quota // shard_count)
+
+    metrics_runner = await metrics.start_metrics_server(port=METRICS_PORT + 1 + shard_index if METRICS_PORT else 0)
+    trace_exporter = tracing.start_exporter()
+    try:
+        await user_bot.start()
+        await idle()
+    finally:
+        await user_bot.stop()
+        if trace_exporter:
+            trace_exporter.cancel()
+            await asyncio.gather(trace_exporter, return_exceptions=True)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+
+
+async def _run_control(session_string: str):
+    """Управляющий процесс: classic bot и клиент user bot без обновлений для резолвера чатов."""
+    from classic_bot import ClassicBot
+
+    classic_bot = ClassicBot()
+    resolver_client = _session_client("user_bot_control", session_string, no_updates=True)
+    classic_bot.chat_resolver.add_client(resolver_client)
+
+    metrics_runner = await metrics.start_metrics_server()
+    try:
+        await resolver_client.start()
+        await classic_bot.start()
+        await idle()
+    finally:
+        await classic_bot.stop()
+        if resolver_client.is_connected:
+            await resolver_client.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+
+
+def _worker_entry(shard_index: int, shard_count: int, session_string: str, filter_engine: FilterEngine):
+    setup_logging(force=True)
+    asyncio.run(_run_worker(shard_index, shard_count, session_string, filter_engine))
+
+
+def _control_entry(session_string: str):
+    setup_logging(force=True)
+    asyncio.run(_run_control(session_string))
+
+
+class Supervisor:
+    """Запуск и перезапуск процессов воркеров и управляющего процесса."""
+
+    def __init__(self, worker_count: int):
+        self.worker_count = worker_count
+        self.session_strings: Dict[str, str] = {}
+        self.filter_engine: Optional[FilterEngine] = None
+        self.processes: Dict[str, multiprocessing.Process] = {}
+        self.started_at: Dict[str, float] = {}
+        self.stopping = False
+
+    def _spawn(self, name: str):
+        """Запуск процесса по имени (control или worker-N)."""
+        if name == "control":
+            process = _context.Process(target=_control_entry, args=(self.session_strings[name],), name=name)
+        else:
+            index = int(name.split("-")[1])
+            process = _context.Process(
+                target=_worker_entry,
+                args=(index, self.worker_count, self.session_strings[name], self.filter_engine),
+                name=name
+            )
+        process.start()
+        self.processes[name] = process
+        self.started_at[name] = time.monotonic()
+        logger.info("Запущен процесс %s (pid %s)", name, process.pid)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    def run(self):
+        """Подготовка, запуск процессов и наблюдение за ними до остановки."""
+        self.session_strings = asyncio.run(_prepare(self.worker_count))
+
+        self.filter_engine = FilterEngine()
+        if self.filter_engine.uses_local_model:
+            # Fork-after-load: дочерние процессы разделяют страницы с весами модели
+            self.filter_engine._init_semantic()
+
+        self._spawn("control")
+        for index in range(self.worker_count):
+            self._spawn(f"worker-{index}")
+
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        logger.info("Супервизор запущен: %d воркер(ов) user bot. Нажмите Ctrl+C для остановки.", self.worker_count)
+        if len(USER_BOT_SESSIONS) > 1:
+            logger.warning(
+                "Воркеры используют сессии аккаунта %s: остальные аккаунты USER_BOT_SESSIONS работают лишь без супервизора",
+                USER_BOT_SESSIONS[0]
+            )
+
+        while self.processes:
+            wait([process.sentinel for process in self.processes.values()])
+            for name, process in list(self.processes.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del self.processes[name]
+                if self.stopping:
+                    continue
+                logger.warning("Процесс %s завершился с кодом %s, перезапуск", name, process.exitcode)
+                delay = RESTART_DELAY - (time.monotonic() - self.started_at[name])
+                if delay > 0:
+                    time.sleep(delay)
+                self._spawn(name)
+
+        logger.info("Все процессы остановлены")
+
+
+def run_supervisor(worker_count: int):
+    """Точка входа режима супервизора."""
+    setup_logging()
+    Supervisor(worker_count).run()
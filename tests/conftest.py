@@ -0,0 +1,8 @@
+"""Общие настройки тестов: модули проекта лежат в корне репозитория."""
+import os
+import sys
+
+# config читает переменные окружения при импорте: тесты не обращаются к сети и основной БД
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
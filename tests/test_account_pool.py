@@ -0,0 +1,131 @@
+"""Тесты пула аккаунтов на поддельных клиентах: квота, флуд, выбор аккаунта."""
+import time
+
+import pytest
+
+import account_pool
+from account_pool import AccountPool
+from subscription_registry import SubscriptionRegistry
+
+
+class FakeClient:
+    def __init__(self, name: str):
+        self.name = name
+        self.is_connected = False
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
+
+
+def make_pool(*names, quota=2) -> AccountPool:
+    return AccountPool([FakeClient(name) for name in names], forward_quota=quota)
+
+
+def test_quota_per_minute(clock):
+    pool = make_pool("a", quota=2)
+    account = pool.primary
+    for _ in range(2):
+        assert pool.pick_forwarder(1) is account
+        account.record_forward()
+    assert pool.pick_forwarder(1) is None
+    assert pool.seconds_until_available() == pytest.approx(60)
+
+    clock.now += 61
+    assert pool.pick_forwarder(1) is account
+
+
+def test_flood_wait_excludes_account(clock):
+    pool = make_pool("a", "b")
+    a, b = pool.accounts
+    pool.mark_flood_wait(a, 30)
+    assert pool.pick_forwarder(1) is b
+
+    pool.mark_flood_wait(b, 10)
+    assert pool.pick_forwarder(1) is None
+    assert pool.seconds_until_available() == pytest.approx(10)
+
+    clock.now += 31
+    assert pool.pick_forwarder(1) is not None
+
+
+def test_peer_flood_uses_cooldown(clock):
+    pool = make_pool("a", "b")
+    a, b = pool.accounts
+    pool.mark_peer_flood(a)
+    assert pool.pick_forwarder(1) is b
+    assert a.available_at(clock.now, pool.forward_quota) == clock.now + account_pool.PEER_FLOOD_COOLDOWN
+
+
+def test_owner_preferred_then_least_loaded(clock):
+    pool = make_pool("a", "b", "c")
+    a, b, c = pool.accounts
+    for account in pool.accounts:
+        account.member_chats.add(1)
+    a.assigned_chats.update({10, 11})
+    b.assigned_chats.add(12)
+
+    owner = pool.assign(1)
+    assert owner is c
+    assert pool.pick_forwarder(1) is c
+
+    c.record_forward()
+    c.record_forward()
+    # У владельца кончилась квота: наименее загруженный из остальных участников
+    a.record_forward()
+    assert pool.pick_forwarder(1) is b
+    assert pool.pick_forwarder(1, exclude={"b"}) is a
+
+
+def test_only_members_forward(clock):
+    pool = make_pool("a", "b")
+    a, b = pool.accounts
+    b.member_chats.add(1)
+    assert pool.forwarders(1) == [b]
+    assert pool.pick_forwarder(1) is b
+    assert pool.pick_forwarder(1, exclude={"b"}) is None
+
+    # Участник потерял доступ: остается весь пул
+    pool.mark_no_access(b, 1)
+    assert pool.forwarders(1) == pool.accounts
+
+
+def test_assign_prefers_members(clock):
+    pool = make_pool("a", "b")
+    a, b = pool.accounts
+    b.member_chats.add(1)
+    assert pool.assign(1) is b
+    assert pool.assign(1) is b
+    assert pool.assign(2) is a
+
+
+def test_is_owner_single_account(clock):
+    pool = make_pool("a")
+    assert pool.is_owner(pool.primary.client, 1)
+
+
+def test_unassign_on_subscription_removed(clock):
+    pool = make_pool("a", "b")
+    registry = SubscriptionRegistry()
+    registry.on_removed.append(pool.unassign)
+
+    registry.add(1)
+    owner = pool.assign(1)
+    assert 1 in owner.assigned_chats
+
+    registry.discard(1)
+    assert 1 not in owner.assigned_chats
+    assert 1 not in pool._owners
+    # Повторное удаление не вызывает слушателей
+    registry.discard(1)
@@ -0,0 +1,136 @@
+"""Тесты состояний предохранителя провайдеров семантики."""
+import asyncio
+
+import pytest
+
+from circuit_breaker import CircuitBreaker
+from filter_engine import FilterEngine
+from semantic_providers import ProviderError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", failure_threshold=3, reset_timeout=30, clock=clock)
+
+
+def trip(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+def test_opens_after_threshold(breaker):
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_success_resets_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_after_timeout_allows_single_probe(breaker, clock):
+    trip(breaker)
+    clock.now = 29.9
+    assert not breaker.allow()
+    clock.now = 30.0
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Пока пробный вызов не завершен, остальные отклоняются
+    assert not breaker.allow()
+
+
+def test_probe_success_closes(breaker, clock):
+    trip(breaker)
+    clock.now = 30.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_probe_failure_reopens(breaker, clock):
+    trip(breaker)
+    clock.now = 30.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now = 59.0
+    assert not breaker.allow()
+    clock.now = 60.0
+    assert breaker.allow()
+
+
+class SlowProvider:
+    name = "mock"
+
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def encode(self, texts):
+        self.started.set()
+        await asyncio.sleep(60)
+
+
+def make_engine(clock) -> FilterEngine:
+    engine = FilterEngine(semantic_provider="mock", fallback=[])
+    engine.breakers["mock"] = CircuitBreaker("mock", failure_threshold=3, reset_timeout=30, clock=clock)
+    engine.slow_call_ms = 0
+    return engine
+
+
+def test_cancelled_probe_is_released(clock):
+    engine = make_engine(clock)
+    breaker = engine.breakers["mock"]
+    trip(breaker)
+    clock.now = 30.0
+    provider = SlowProvider()
+
+    async def cancel_probe():
+        task = asyncio.create_task(engine._call_provider(provider, "encode", provider.encode, ["текст"]))
+        await provider.started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    # Отмена не считается ошибкой: пробный вызов освобожден, цепь ждет следующей пробы
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.failures == 3
+    assert breaker.allow()
+
+
+def test_provider_error_counts_as_failure(clock):
+    engine = make_engine(clock)
+    breaker = engine.breakers["mock"]
+
+    async def failing(texts):
+        raise ProviderError("mock: ошибка")
+
+    provider = SlowProvider()
+    for _ in range(3):
+        with pytest.raises(ProviderError):
+            asyncio.run(engine._call_provider(provider, "encode", failing, ["текст"]))
+    assert breaker.state == CircuitBreaker.OPEN
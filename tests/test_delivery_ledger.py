@@ -0,0 +1,27 @@
+"""Тесты журнала доставок: ключ, вытесненный из памяти, проверяется в таблице deliveries."""
+import asyncio
+
+import models  # noqa: F401 - таблицы регистрируются в Base.metadata
+from database import init_db
+from delivery_ledger import DeliveryLedger
+
+
+def test_memory_miss_checks_deliveries_table():
+    async def scenario():
+        await init_db()
+        ledger = DeliveryLedger(size=1, window_hours=0, retention_days=0)
+        old, new = (100, 1, 10), (100, 1, 11)
+
+        assert await ledger.claim_async(old)
+        await ledger.record(old, user_id=5)
+        assert await ledger.claim_async(new)
+        # Старый ключ вытеснен из памяти, но доставка есть в БД
+        assert old not in ledger
+        assert not await ledger.claim_async(old)
+        assert old in ledger
+
+        ledger.release(new)
+        assert await ledger.claim_async(new)
+        assert not await ledger.claim_async(new)
+
+    asyncio.run(scenario())
@@ -0,0 +1,43 @@
+"""Тесты компактного хранилища эмбеддингов: схожесть int8 и освобождение строк тем."""
+import gc
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, compact, cosine_matrix
+from filter_engine import CompiledFilter
+
+
+def test_int8_cosine_matches_float32():
+    rng = np.random.default_rng(0)
+    left, right = rng.normal(size=(3, 64)), rng.normal(size=(5, 64))
+    reference = cosine_matrix(compact(left, "float32"), compact(right, "float32"))
+    similarities = cosine_matrix(compact(left, "int8"), compact(right, "int8"))
+    assert similarities.dtype == np.float32
+    assert np.abs(similarities - reference).max() < 0.02
+
+
+def test_released_rows_are_reused():
+    store = EmbeddingStore("int8", capacity=2)
+    first = store.rows(["a", "b"])
+    store.add_many(["a", "b"], np.eye(2, 8))
+    shared = store.rows(["b"])
+    assert shared[0] == first[1]
+
+    store.release(["a", "b"])
+    assert "a" not in store.index
+    assert "b" in store
+    reused = store.rows(["c"])
+    assert reused[0] == first[0]
+    assert store.missing(["b", "c"]) == ["c"]
+
+
+def test_deleted_filter_releases_topic_rows():
+    store = EmbeddingStore("float32")
+    compiled = CompiledFilter(1, None, "ставки, нефть", True, store)
+    assert set(store.index) == {"ставки", "нефть"}
+    kept = CompiledFilter(2, None, "нефть", True, store)
+
+    del compiled
+    gc.collect()
+    assert set(store.index) == {"нефть"}
+    assert kept.topic_rows is not None
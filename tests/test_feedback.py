@@ -0,0 +1,16 @@
+"""Тесты подбора порога схожести по оценкам."""
+from feedback import fit_threshold
+
+
+def test_fit_threshold_separates_classes():
+    samples = [(0.3, -1), (0.35, -1), (0.4, -1), (0.6, 1), (0.65, 1), (0.7, 1)]
+    assert fit_threshold(samples, min_per_class=3) == 0.6
+
+
+def test_fit_threshold_requires_both_classes():
+    only_negative = [(0.5, -1), (0.6, -1), (0.7, -1), (0.8, -1)]
+    assert fit_threshold(only_negative, min_per_class=3) is None
+    few_negative = [(0.3, -1), (0.5, 1), (0.6, 1), (0.7, 1)]
+    assert fit_threshold(few_negative, min_per_class=3) is None
+    assert fit_threshold(few_negative, min_per_class=1) == 0.5
+    assert fit_threshold([], min_per_class=0) is None
@@ -0,0 +1,80 @@
+"""Тесты выбора совпадения FilterEngine."""
+import asyncio
+
+import pytest
+
+from filter_engine import FilterEngine
+
+
+@pytest.fixture
+def engine():
+    engine = FilterEngine(semantic_provider="mock", use_rules=False, fallback=[])
+    engine.provider.latency_ms = 0
+    engine.provider.jitter_ms = 0
+    engine.semantic_threshold = 0.3
+    return engine
+
+
+FILTERS = [
+    {"id": 1, "keywords": "нефть", "topics": None, "use_semantic": False},
+    {"id": 2, "keywords": None, "topics": "нефть дорожает", "use_semantic": True},
+]
+
+
+def test_first_match_by_default(engine):
+    match = asyncio.run(engine.match_async("нефть дорожает", engine.compile_filters(FILTERS)))
+    assert match.filter_id == 1
+    assert match.kind == "keyword"
+    assert match.score == engine.keyword_score
+
+
+def test_best_match_compares_keyword_and_semantic_scores(engine):
+    filters = engine.compile_filters(FILTERS)
+    # Текст совпадает с темой дословно: схожесть выше оценки ключевого слова
+    match = asyncio.run(engine.match_async("нефть дорожает", filters, best=True))
+    assert match.filter_id == 2
+    assert match.score > engine.keyword_score
+
+
+def test_best_match_keeps_keyword_over_weak_semantic(engine):
+    engine.semantic_threshold = 0.1
+    filters = engine.compile_filters(FILTERS)
+    text = "нефть, газ и уголь в сводке рынка"
+    semantic = asyncio.run(engine.match_async(text, filters[1:]))
+    assert semantic is not None and semantic.score < engine.keyword_score
+    match = asyncio.run(engine.match_async(text, filters, best=True))
+    assert match.filter_id == 1
+
+
+def test_sync_match_supports_best(engine):
+    filters = engine.compile_filters(FILTERS[:1] + [{"id": 3, "keywords": "дорожает", "use_semantic": False}])
+    assert engine.match("нефть дорожает", filters, allow_semantic=False, best=True).filter_id == 1
+
+
+def test_failed_model_load_is_not_retried_on_every_message(monkeypatch):
+    import sys
+    import threading
+    import types
+
+    loads = []
+
+    class BrokenModel:
+        def __init__(self, name):
+            loads.append(threading.current_thread() is threading.main_thread())
+            raise OSError("модель недоступна")
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(SentenceTransformer=BrokenModel))
+    engine = FilterEngine(semantic_provider="local", fallback=[])
+    filters = engine.compile_filters([{"id": 1, "topics": "нефть", "use_semantic": True}])
+
+    async def run():
+        for _ in range(3):
+            assert await engine.match_async("нефть дорожает", filters) is None
+
+    asyncio.run(run())
+    # Одна попытка, и не в потоке цикла событий
+    assert loads == [False]
+
+    engine.load_retry_interval = 0
+    asyncio.run(run())
+    assert len(loads) > 1
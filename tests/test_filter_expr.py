@@ -0,0 +1,125 @@
+"""Тесты языка выражений фильтров по ключевым словам."""
+import pytest
+
+from filter_expr import MAX_NESTING, FilterSyntaxError, PreparedText, compile_expression, compile_legacy
+
+
+def matches(source: str, text: str) -> bool:
+    return compile_expression(source).evaluate(PreparedText(text)) is not None
+
+
+def test_and_binds_tighter_than_or():
+    # a OR b AND c = a OR (b AND c)
+    assert matches("нефть OR газ AND цены", "нефть подешевела")
+    assert not matches("нефть OR газ AND цены", "газ подешевел")
+    assert matches("нефть OR газ AND цены", "газ: цены растут")
+
+
+def test_parentheses_override_precedence():
+    assert not matches("(нефть OR газ) AND цены", "нефть подешевела")
+    assert matches("(нефть OR газ) AND цены", "цены на нефть")
+
+
+def test_not_and_russian_operators():
+    assert matches("ставк AND NOT спорт", "ЦБ сохранил ключевую ставку")
+    assert not matches("ставк AND NOT спорт", "ставка на спорт")
+    assert matches("нефть ИЛИ газ И НЕ спорт", "нефть дорожает")
+
+
+def test_comma_works_as_or():
+    assert matches("python, golang", "Вакансия golang-разработчика")
+    assert not matches("python, golang", "Вакансия java-разработчика")
+
+
+def test_phrase_matches_whole_words():
+    assert matches('"ключевая ставка"', "Ключевая ставка сохранена")
+    assert not matches('"ключевая ставка"', "ключевая ставкам")
+    assert not matches('"ставка"', "ставками")
+    # Без кавычек - подстрока
+    assert matches("ставка", "ставками")
+
+
+def test_regex_is_case_insensitive():
+    assert matches(r"/ставк[аиу]\s+цб/", "Ставка ЦБ выросла")
+    assert not matches(r"/ставк[аиу]\s+цб/", "ставка банка")
+
+
+@pytest.mark.parametrize("source", ["нефть AND", "(нефть OR газ", "AND газ", "нефть OR OR газ"])
+def test_syntax_errors(source):
+    with pytest.raises(FilterSyntaxError):
+        compile_expression(source)
+
+
+@pytest.mark.parametrize("pattern", [r"(a+)+", r"(a|aa)*", r"(a|ab)*x", r"(a)\1", r"(a*)*b"])
+def test_rejects_backtracking_regexes(pattern):
+    with pytest.raises(FilterSyntaxError):
+        compile_expression(f"/{pattern}/")
+
+
+@pytest.mark.parametrize("pattern", [r"a+b", r"\d{2,4}", r"(ab)+", r"(?:цб|фрс)\s+ставк", r"(\w|\d)*x"])
+def test_accepts_safe_regexes(pattern):
+    # Альтернатива из одиночных символов, например (\w|\d)*, парсер сворачивает в класс символов
+    assert compile_expression(f"/{pattern}/") is not None
+
+
+@pytest.mark.parametrize("source", [
+    "/a{99999999999}/",
+    "(" * 3000 + "x" + ")" * 3000,
+    "NOT " * 3000 + "x",
+    "(" * (MAX_NESTING + 1) + "x" + ")" * (MAX_NESTING + 1),
+])
+def test_oversized_expressions_are_syntax_errors(source):
+    with pytest.raises(FilterSyntaxError):
+        compile_expression(source)
+
+
+def test_nesting_up_to_limit_is_allowed():
+    source = "(" * MAX_NESTING + "нефть" + ")" * MAX_NESTING
+    assert matches(source, "нефть дорожает")
+
+
+def test_legacy_falls_back_to_comma_list():
+    # Старый фильтр со скобкой не разбирается как выражение, но работает как список подстрок
+    with pytest.raises(FilterSyntaxError):
+        compile_expression("курс (доллара, евро")
+    expression = compile_legacy("курс (доллара, евро")
+    assert expression.evaluate(PreparedText("Курс евро вырос")) is not None
+    assert expression.evaluate(PreparedText("Курс рубля вырос")) is None
+
+
+def test_legacy_keeps_valid_expressions():
+    expression = compile_legacy("нефть AND NOT спорт")
+    assert expression.evaluate(PreparedText("нефть дорожает")) is not None
+    assert expression.evaluate(PreparedText("нефть и спорт")) is None
+
+
+def test_empty_expression():
+    assert compile_expression("") is None
+    assert compile_expression(" , ") is None
+    assert compile_legacy(None) is None
+
+
+def test_terms_of_dropped_expressions_are_released():
+    import gc
+    import filter_expr
+
+    compile_expression.cache_clear()
+    expression = compile_legacy("уникальноеусловие1, уникальноеусловие2")
+    terms = {term.pattern for term in expression.terms}
+    assert terms <= {pattern for _, pattern in filter_expr._terms.keys()}
+    # Выражение держат только вызывающий и ограниченный кэш compile_expression
+    del expression
+    compile_expression.cache_clear()
+    gc.collect()
+    assert not terms & {pattern for _, pattern in filter_expr._terms.keys()}
+
+
+def test_shared_terms_are_one_object():
+    first = compile_expression("нефть AND газ")
+    second = compile_expression("газ OR уголь")
+    assert {id(t) for t in first.terms} & {id(t) for t in second.terms}
+
+
+def test_documented_example_matches_without_lemmatizer():
+    assert matches("ставк AND ЦБ", "ЦБ поднял ключевую ставку до 16%")
+    assert not matches("ставк AND ЦБ", "Ставку в букмекерской конторе сделал на ЦСКА")
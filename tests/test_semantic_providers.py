@@ -0,0 +1,55 @@
+"""Тесты провайдеров семантики."""
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from semantic_providers import LocalProvider
+
+
+def test_local_encode_does_not_block_event_loop():
+    threads = []
+
+    def encoder(texts):
+        threads.append(threading.current_thread())
+        time.sleep(0.2)
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+    provider = LocalProvider(encoder)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        vectors = await provider.encode(["а", "б"])
+        task.cancel()
+        await provider.close()
+        return vectors, ticks
+
+    vectors, ticks = asyncio.run(run())
+    assert vectors.shape == (2, 4)
+    assert threads and threads[0] is not threading.main_thread()
+    # Пока модель считала, цикл событий продолжал работать
+    assert ticks >= 5
+
+
+def test_provider_interfaces_are_abstract():
+    import pytest
+
+    from semantic_providers import PROVIDERS, ChatScoringProvider, SemanticProvider, create_provider
+
+    with pytest.raises(TypeError):
+        SemanticProvider()
+    with pytest.raises(TypeError):
+        ChatScoringProvider()
+    # Все зарегистрированные реализации создаются (local требует функцию кодирования)
+    for name in PROVIDERS:
+        options = {"encoder": lambda texts: None} if name == "local" else {}
+        assert create_provider(name, **options).name == name
@@ -0,0 +1,39 @@
+"""Тесты консистентного хеширования чатов по воркерам."""
+import collections
+
+from sharding import HashRing, ShardFilter
+
+CHAT_IDS = [-(1_000_000_000_000 + i) for i in range(5000)]
+
+
+def test_mapping_is_stable_across_instances():
+    # Воркеры строят кольцо независимо и должны прийти к одному разбиению
+    first, second = HashRing(4), HashRing(4)
+    assert [first.shard_for(c) for c in CHAT_IDS] == [second.shard_for(c) for c in CHAT_IDS]
+
+
+def test_every_chat_has_exactly_one_owner():
+    shards = [ShardFilter(index, 3) for index in range(3)]
+    for chat_id in CHAT_IDS[:500]:
+        assert sum(shard.owns(chat_id) for shard in shards) == 1
+
+
+def test_load_is_roughly_even():
+    ring = HashRing(4)
+    counts = collections.Counter(ring.shard_for(c) for c in CHAT_IDS)
+    assert set(counts) == {0, 1, 2, 3}
+    assert max(counts.values()) < 2 * min(counts.values())
+
+
+def test_adding_shard_moves_few_chats():
+    before, after = HashRing(4), HashRing(5)
+    moved = [c for c in CHAT_IDS if before.shard_for(c) != after.shard_for(c)]
+    # В идеале переезжает 1/5 чатов, и только на новый шард
+    assert len(moved) < 0.3 * len(CHAT_IDS)
+    assert all(after.shard_for(c) == 4 for c in moved)
+
+
+def test_single_shard_owns_everything():
+    shard = ShardFilter(0, 1)
+    assert all(shard.owns(c) for c in CHAT_IDS[:100])
+    assert shard.owns_user(123456789)
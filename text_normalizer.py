@@ -0,0 +1,82 @@
+"""Нормализация текста для сопоставления ключевых слов: регистр, ё, пунктуация, леммы."""
+import functools
+import logging
+import re
+import threading
+from typing import List
+import metrics
+from config import TEXT_LEMMATIZE, LEMMA_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"[^\W_]+")
+_NON_WORD = re.compile(r"[^\w\s]|_")
+
+
+def fold(text: str) -> str:
+    """Регистр и ё: casefold и замена ё на е (пунктуация сохраняется)."""
+    return text.casefold().replace("ё", "е")
+
+
+def has_punctuation(text: str) -> bool:
+    """Есть ли в строке знаки, которые нормализация удалила бы (например, c++, 3.11)."""
+    return _NON_WORD.search(text) is not None
+
+
+class TextNormalizer:
+    """
+    Приведение текста к виду, в котором сравниваются сообщения и ключевые слова.
+
+    normalize: casefold, ё -> е, пунктуация заменяется пробелами, пробелы
+    схлопываются, при lemmatize каждое слово заменяется начальной формой
+    (pymorphy3 или pymorphy2). Леммы кэшируются в LRU на cache_size слов:
+    словарь новостей повторяется, поэтому разбор pymorphy почти не нужен.
+    """
+
+    def __init__(self, lemmatize: bool = TEXT_LEMMATIZE, cache_size: int = LEMMA_CACHE_SIZE):
+        self.lemmatize = lemmatize
+        self._morph = None
+        self._init_lock = threading.Lock()
+        self._lemma = functools.lru_cache(maxsize=cache_size)(self._parse_lemma)
+
+        metrics.LEMMA_CACHE.set_function(lambda: self._lemma.cache_info().currsize, "size")
+        metrics.LEMMA_CACHE.set_function(lambda: self._lemma.cache_info().hits, "hits")
+        metrics.LEMMA_CACHE.set_function(lambda: self._lemma.cache_info().misses, "misses")
+
+    def _init_morph(self):
+        """Ленивая загрузка морфологического анализатора (необязательная зависимость)."""
+        with self._init_lock:
+            if self._morph is not None or not self.lemmatize:
+                return
+            try:
+                try:
+                    import pymorphy3 as pymorphy
+                except ImportError:
+                    import pymorphy2 as pymorphy
+                self._morph = pymorphy.MorphAnalyzer()
+                logger.info("Лемматизация включена: %s", pymorphy.__name__)
+            except Exception as e:
+                logger.warning("Лемматизация недоступна (pip install pymorphy3): %s", e)
+                self.lemmatize = False
+
+    def _parse_lemma(self, word: str) -> str:
+        return fold(self._morph.parse(word)[0].normal_form)
+
+    def tokens(self, text: str, folded: bool = False) -> List[str]:
+        """Нормализованные слова текста (folded - регистр и ё уже приведены функцией fold)."""
+        words = _WORD.findall(text if folded else fold(text))
+        if self.lemmatize:
+            if self._morph is None:
+                self._init_morph()
+            if self._morph is not None:
+                lemma = self._lemma
+                words = [lemma(word) for word in words]
+        return words
+
+    def normalize(self, text: str, folded: bool = False) -> str:
+        """Нормализованный текст: слова через один пробел."""
+        return " ".join(self.tokens(text, folded))
+
+
+# Общий экземпляр процесса: выражения фильтров и сообщения нормализуются одинаково
+normalizer = TextNormalizer()
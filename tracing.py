@@ -0,0 +1,226 @@
+"""Легковесная трассировка задержек по этапам конвейера.
+
+Трасса открывается на входе handle_message и идентифицируется парой
+(chat_id, message_id); вложенные спаны (маршрутизация, фильтры, encode,
+пересылка) привязываются к ней через contextvars. Для несэмплированных
+сообщений все вызовы span() возвращают общий пустой объект, поэтому
+трассировку можно держать включенной под полной нагрузкой.
+
+Готовые трассы копятся в ограниченном буфере и выгружаются фоновой задачей
+в JSONL-файл или в OTLP/HTTP-совместимый коллектор.
+"""
+import asyncio
+import collections
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import Deque, List, Optional
+import aiohttp
+from config import TRACE_SAMPLE_RATE, TRACE_EXPORT, TRACE_FILE, TRACE_OTLP_ENDPOINT
+
+logger = logging.getLogger(__name__)
+
+# Трассы, ожидающие выгрузки; при переполнении старые отбрасываются
+_pending: Deque[List["Span"]] = collections.deque(maxlen=10000)
+
+_current_trace: contextvars.ContextVar[Optional["_Trace"]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """Один этап обработки сообщения."""
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "_token")
+
+    def __init__(self, name: str, trace: "_Trace", parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start_ns = 0
+        self.end_ns = 0
+        self._token = None
+
+    def set(self, key: str, value):
+        """Добавление атрибута к спану."""
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        _current_span.reset(self._token)
+        self.trace.spans.append(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Пустой спан для несэмплированных сообщений."""
+    __slots__ = ()
+
+    def set(self, key: str, value):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Trace:
+    """Трасса обработки одного сообщения."""
+    __slots__ = ("trace_id", "chat_id", "message_id", "spans")
+
+    def __init__(self, chat_id: int, message_id: int):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        # Детерминированный ID: все спаны сообщения склеиваются по (chat_id, message_id)
+        self.trace_id = hashlib.md5(f"{chat_id}:{message_id}".encode()).hexdigest()
+        self.spans: List[Span] = []
+
+
+class _RootSpan(Span):
+    """Корневой спан: при завершении отправляет трассу в буфер выгрузки."""
+    __slots__ = ("_trace_token",)
+
+    def __enter__(self) -> "Span":
+        self._trace_token = _current_trace.set(self.trace)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        _current_trace.reset(self._trace_token)
+        _pending.append(self.trace.spans)
+        return False
+
+
+def start_trace(chat_id: int, message_id: int, name: str = "handle_message", sample_rate: float = None):
+    """
+    Открытие трассы для сообщения с учетом сэмплирования.
+
+    Returns:
+        Контекстный менеджер корневого спана (или пустой спан, если сообщение не попало в выборку)
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return _NOOP_SPAN
+    trace = _Trace(chat_id, message_id)
+    return _RootSpan(name, trace, None, {"chat_id": chat_id, "message_id": message_id})
+
+
+def span(name: str, **attributes):
+    """Вложенный спан в текущей трассе; без активной трассы ничего не делает."""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return Span(name, trace, _current_span.get(), attributes)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(traces: List[List[Span]]) -> dict:
+    """Преобразование трасс в OTLP/HTTP JSON."""
+    spans = []
+    for trace_spans in traces:
+        for item in trace_spans:
+            otlp_span = {
+                "traceId": item.trace.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": 1,
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in item.attributes.items()],
+            }
+            if item.parent_id:
+                otlp_span["parentSpanId"] = item.parent_id
+            spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "news-bot"}}]},
+            "scopeSpans": [{"scope": {"name": "news_bot.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+def _write_file(path: str, traces: List[List[Span]]):
+    with open(path, "a", encoding="utf-8") as f:
+        for trace_spans in traces:
+            for item in trace_spans:
+                f.write(json.dumps(item.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+async def _export(traces: List[List[Span]], session: Optional[aiohttp.ClientSession]):
+    if TRACE_EXPORT == "otlp" and session:
+        async with session.post(TRACE_OTLP_ENDPOINT, json=_to_otlp(traces)) as response:
+            if response.status >= 300:
+                logger.warning("Коллектор трасс ответил %s", response.status)
+    else:
+        await asyncio.to_thread(_write_file, TRACE_FILE, traces)
+
+
+async def run_exporter(interval: float = 1.0):
+    """Фоновая задача, периодически выгружающая накопленные трассы."""
+    session = aiohttp.ClientSession() if TRACE_EXPORT == "otlp" else None
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await flush(session)
+    finally:
+        await flush(session)
+        if session:
+            await session.close()
+
+
+async def flush(session: Optional[aiohttp.ClientSession] = None):
+    """Выгрузка всех накопленных трасс."""
+    if not _pending:
+        return
+    traces = []
+    while _pending:
+        traces.append(_pending.popleft())
+    try:
+        await _export(traces, session)
+    except Exception as e:
+        logger.warning("Не удалось выгрузить трассы: %s", e)
+
+
+def start_exporter() -> Optional[asyncio.Task]:
+    """Запуск фоновой выгрузки, если трассировка включена."""
+    if TRACE_SAMPLE_RATE <= 0:
+        return None
+    logger.info("Трассировка включена: доля %.3f, выгрузка %s", TRACE_SAMPLE_RATE,
+                TRACE_OTLP_ENDPOINT if TRACE_EXPORT == "otlp" else TRACE_FILE)
+    return asyncio.create_task(run_exporter())
@@ -1,196 +1,498 @@
 """User Bot для мониторинга сообщений и пересылки."""
 import asyncio
+import logging
 import time
-from pyrogram import Client
+from typing import Dict, List, Optional
+from pyrogram import Client, filters
+from pyrogram.handlers import MessageHandler
 from pyrogram.types import Message
-from pyrogram.errors import PeerFlood, FloodWait
+from pyrogram.errors import (
+    PeerFlood, FloodWait, ChannelPrivate, ChannelInvalid, ChannelBanned, ChatForbidden, PeerIdInvalid,
+    UserBannedInChannel
+)
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_session, init_db
-from models import User, Filter, Subscription
+from models import User, Subscription, DeliverySettings
 from filter_engine import FilterEngine
-from config import API_ID, API_HASH
+from chat_resolver import ChatResolver
+from sharding import ShardFilter
+from account_pool import AccountPool, MAX_FLOOD_SLEEP
+from ingestion import IngestionQueue, MessageRecord
+from subscription_registry import registry
+from filter_cache import filter_cache
+from backfill import Backfiller, ProgressTracker
+from digest import DigestBuffer
+from ranking import TopKSelector
+from match_log import MatchLog
+from delivery_ledger import DeliveryLedger
+from forward_retry import ForwardRetryQueue
+import feedback
+import metrics
+import tracing
+from config import (
+    API_ID, API_HASH, USER_BOT_SESSIONS, SEMANTIC_WARMUP, BACKFILL_ENABLED,
+    FEEDBACK_ENABLED, THRESHOLD_RELOAD_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых аккаунт не может читать исходный чат
+ACCESS_ERRORS = (
+    ChannelPrivate, ChannelInvalid, ChannelBanned, ChatForbidden, PeerIdInvalid, UserBannedInChannel
+)
 
 
 class UserBot:
     """User Bot для мониторинга сообщений из подписок."""
 
-    def __init__(self):
-        """Инициализация User Bot."""
-        self.client = Client(
-            "user_bot_session",
-            api_id=API_ID,
-            api_hash=API_HASH
-        )
-        self.filter_engine = FilterEngine()
+    def __init__(self, client: Optional[Client] = None, shard: Optional[ShardFilter] = None,
+                 filter_engine: Optional[FilterEngine] = None, clients: Optional[List[Client]] = None):
+        """
+        Инициализация User Bot.
+
+        Args:
+            client: Готовый клиент Pyrogram (по умолчанию сессии из USER_BOT_SESSIONS)
+            shard: Шард чатов, которые обрабатывает этот экземпляр (по умолчанию все чаты)
+            filter_engine: Готовый движок фильтрации (например, с моделью, загруженной до fork)
+            clients: Несколько клиентов для пула аккаунтов
+        """
+        if clients is None:
+            clients = [client] if client else [
+                Client(session_name, api_id=API_ID, api_hash=API_HASH)
+                for session_name in USER_BOT_SESSIONS
+            ]
+        self.pool = AccountPool(clients)
+        self.client = self.pool.primary.client
+        self.filter_engine = filter_engine or FilterEngine()
+        self.shard = shard
+        self.chat_resolver = ChatResolver(self.client)
         self.last_forward_time = {}
         self.min_forward_interval = 2
+        self.subscriptions = registry
+        # Фильтры компилируются при изменении, а не на каждое сообщение
+        self.filter_cache = filter_cache
+        self.filter_cache.bind(self.filter_engine.topic_store)
+        self.ingestion = IngestionQueue(self._consume_record, self._is_subscribed)
+        self.progress = ProgressTracker()
+        self.backfiller = Backfiller(self)
+        self.digest = DigestBuffer(self)
+        self.top_k = TopKSelector(self)
+        # Журнал совпадений и пересылок пишется пакетами в фоне
+        self.match_log = MatchLog()
+        # Доставленные сообщения по (целевой чат, чат, сообщение): пересылка ровно один раз
+        self.ledger = DeliveryLedger()
+        # Пересылки, ожидающие квоты аккаунтов
+        self.forward_retry = ForwardRetryQueue(self.forward_message)
+        # Первый message_id, полученный обработчиком, по чатам: граница догрузки
+        self.live_first_ids: Dict[int, int] = {}
+        self._threshold_task: Optional[asyncio.Task] = None
+        self.started_at: Optional[float] = None
+        self.first_message_processed = False
 
     async def start(self):
         """Запуск user bot."""
+        self.started_at = time.perf_counter()
         await init_db()
-        await self.client.start()
-        
+        await self.pool.start()
+        await self.progress.load()
+        await self.ledger.load()
+        await self._load_thresholds()
+        await self.filter_cache.load()
+
         me = await self.client.get_me()
-        print(f"User Bot запущен как: {me.first_name} (@{me.username or 'без username'})")
-        print(f"User Bot ID: {me.id}")
-        print("User Bot будет мониторить только группы и каналы (не личные чаты)")
+        logger.info("User Bot запущен как: %s (@%s)", me.first_name, me.username or "без username")
+        logger.info("User Bot ID: %s", me.id)
+        if self.shard:
+            logger.info("Обрабатываются только чаты шарда %s", self.shard)
+        logger.info("User Bot будет мониторить только группы и каналы (не личные чаты)")
         
+        owned_chats: List[int] = []
         async for session in get_session():
             try:
                 subscriptions_query = select(Subscription)
                 result = await session.execute(subscriptions_query)
                 subscriptions = result.scalars().all()
                 if subscriptions:
-                    print(f"\nАктивные подписки ({len(subscriptions)}):")
+                    logger.info("Активные подписки (%d):", len(subscriptions))
                     for sub in subscriptions:
-                        print(f"   - {sub.chat_title} (ID: {sub.chat_id})")
+                        if not sub.chat_type or sub.chat_type == "unknown":
+                            try:
+                                resolved = await self.chat_resolver.resolve(sub.chat_id)
+                                sub.chat_title = resolved.title
+                                sub.chat_type = resolved.chat_type
+                            except Exception:
+                                pass
+                        self.subscriptions.add(sub.chat_id)
+                        if not self.shard or self.shard.owns(sub.chat_id):
+                            if sub.chat_id not in owned_chats:
+                                owned_chats.append(sub.chat_id)
+                            owner = self.pool.assign(sub.chat_id)
+                            logger.info("   - %s (ID: %s, аккаунт %s)", sub.chat_title, sub.chat_id, owner.name)
+                        else:
+                            logger.info("   - %s (ID: %s)", sub.chat_title, sub.chat_id)
+                    await session.commit()
                 else:
-                    print("\nНет активных подписок. Добавьте подписку через Classic Bot: /add_subscription")
+                    logger.info("Нет активных подписок. Добавьте подписку через Classic Bot: /add_subscription")
             finally:
                 pass
 
-        print("Регистрирую обработчик сообщений...")
-        
-        @self.client.on_message()
+        # Чат без подписок больше не закреплен за аккаунтом пула
+        self.subscriptions.on_removed.append(self.pool.unassign)
+        self.subscriptions.start_refresh()
+        self.filter_cache.start_refresh()
+        self.ingestion.start()
+        self.match_log.start()
+        if SEMANTIC_WARMUP:
+            self.filter_engine.start_warm_up()
+
+        logger.info("Регистрирую обработчик сообщений...")
+        metrics.UPDATES_QUEUE_DEPTH.set_function(
+            lambda: sum(account.client.dispatcher.updates_queue.qsize() for account in self.pool.accounts)
+        )
+
         async def handle_message(client: Client, message: Message):
-            chat_id = message.chat.id if message.chat else None
-            chat_type = message.chat.type if message.chat else None
-            chat_title = message.chat.title if message.chat else "Unknown"
-            has_text = bool(message.text or message.caption)
-            from_user = message.from_user.username if message.from_user else "unknown"
-            
-            print(f"[DEBUG] Событие: chat={chat_id} ({chat_title}), type={chat_type}, from=@{from_user}, text={has_text}")
-            
-            await self.process_message(message)
-        
-        print("Обработчик зарегистрирован")
+            metrics.MESSAGES_SEEN.inc()
+            if message.chat and not self.pool.is_owner(client, message.chat.id):
+                metrics.MESSAGES_SKIPPED.inc("other_account")
+                return
+            if logger.isEnabledFor(logging.DEBUG):
+                chat = message.chat
+                logger.debug(
+                    "Событие: chat=%s (%s), type=%s, from=@%s, text=%s",
+                    chat.id if chat else None,
+                    chat.title if chat else "Unknown",
+                    chat.type if chat else None,
+                    message.from_user.username if message.from_user else "unknown",
+                    bool(message.text or message.caption)
+                )
 
-    async def process_message(self, message: Message):
-        """Обработка входящего сообщения."""
+            record = self._normalize(message)
+            if record:
+                self.live_first_ids.setdefault(record.chat_id, record.message_id)
+                if self.ingestion.submit(record):
+                    self.progress.begin(record.chat_id, record.message_id)
+
+        # Апдейты из чатов без подписок и чужих шардов, личных чатов, от ботов и
+        # без текста отсеиваются фильтрами диспетчера Pyrogram до вызова обработчика
+        message_filter = (
+            self.subscriptions.filter
+            & (filters.text | filters.caption)
+            & ~filters.private
+            & ~filters.bot
+        )
+        if self.shard:
+            message_filter = self.shard.filter & message_filter
+        for account in self.pool.accounts:
+            account.client.add_handler(MessageHandler(handle_message, message_filter))
+        logger.info("Обработчик зарегистрирован")
+
+        self.progress.start()
+        self.forward_retry.start()
+        self.digest.start()
+        self.top_k.start()
+        if THRESHOLD_RELOAD_INTERVAL > 0:
+            self._threshold_task = asyncio.create_task(self._threshold_reload_loop(), name="threshold-reload")
+        if BACKFILL_ENABLED and owned_chats:
+            self.backfiller.start(owned_chats)
+
+    async def _load_thresholds(self):
+        """Загрузка порогов, подобранных по оценкам пользователей."""
+        self.filter_engine.calibrated_thresholds = await feedback.load_thresholds()
+        if self.filter_engine.calibrated_thresholds:
+            logger.info("Загружено подобранных порогов: %d", len(self.filter_engine.calibrated_thresholds))
+
+    async def _threshold_reload_loop(self):
+        while True:
+            await asyncio.sleep(THRESHOLD_RELOAD_INTERVAL)
+            try:
+                await self._load_thresholds()
+            except Exception:
+                logger.exception("Не удалось загрузить подобранные пороги")
+
+    def _normalize(self, message: Message) -> Optional[MessageRecord]:
+        """Приведение апдейта к компактной записи; None, если сообщение не нужно обрабатывать."""
         if not message.text and not message.caption:
-            print(f"Пропущено: нет текста")
-            return
+            logger.debug("Пропущено: нет текста")
+            metrics.MESSAGES_SKIPPED.inc("no_text")
+            return None
 
-        chat_id = message.chat.id if message.chat else None
-        if not chat_id:
-            print(f"Пропущено: нет chat_id")
-            return
+        record = MessageRecord.from_message(message)
+        if not record.chat_id:
+            logger.debug("Пропущено: нет chat_id")
+            metrics.MESSAGES_SKIPPED.inc("no_chat")
+            return None
 
-        chat_type = message.chat.type if message.chat else None
-        
-        if chat_id > 0:
-            print(f"Пропущено: личный чат (ID: {chat_id})")
-            return
+        if self.shard and not self.shard.owns(record.chat_id):
+            metrics.MESSAGES_SKIPPED.inc("other_shard")
+            return None
+
+        if record.chat_id > 0:
+            logger.debug("Пропущено: личный чат (ID: %s)", record.chat_id)
+            metrics.MESSAGES_SKIPPED.inc("private")
+            return None
+
+        if record.from_bot:
+            logger.debug("Пропущено: сообщение от бота")
+            metrics.MESSAGES_SKIPPED.inc("bot")
+            return None
 
-        if message.from_user and message.from_user.is_bot:
-            print(f"Пропущено: сообщение от бота")
-            return
+        return record
 
-        text = message.text or message.caption or ""
-        chat_title = message.chat.title if message.chat else "Unknown"
-        print(f"ОБРАБОТКА: группа '{chat_title}' (ID: {chat_id}, тип: {chat_type})")
-        print(f"Текст: {text[:100]}...")
+    def _is_subscribed(self, chat_id: int) -> bool:
+        """Быстрая проверка по известным чатам с подписчиками."""
+        return chat_id in self.subscriptions
+
+    async def _consume_record(self, record: MessageRecord, allow_semantic: bool):
+        """Обработка записи потребителем очереди."""
+        started = time.perf_counter()
+        cancelled = False
+        try:
+            with tracing.start_trace(record.chat_id, record.message_id) as trace:
+                trace.set("queue_wait_ms", (time.monotonic() - record.received_at) * 1000)
+                await self.process_record(record, allow_semantic=allow_semantic)
+        except asyncio.CancelledError:
+            # Прерванное остановкой сообщение остается незавершенным, после перезапуска его догрузит backfill
+            cancelled = True
+            raise
+        finally:
+            # Сообщение с ошибкой обработки завершено, иначе граница чата встала бы навсегда
+            if not cancelled:
+                self.progress.mark(record.chat_id, record.message_id)
+        metrics.PROCESS_SECONDS.observe(time.perf_counter() - started)
+
+        if not self.first_message_processed and self.started_at is not None:
+            self.first_message_processed = True
+            elapsed = time.perf_counter() - self.started_at
+            metrics.FIRST_MESSAGE_SECONDS.set(elapsed)
+            logger.info("Первое сообщение обработано через %.1f сек после запуска", elapsed)
+
+    async def process_message(self, message: Message):
+        """Обработка входящего сообщения без очереди."""
+        record = self._normalize(message)
+        if record:
+            await self.process_record(record)
+
+    async def process_record(self, record: MessageRecord, allow_semantic: bool = True):
+        """
+        Фильтрация записи по подпискам и фильтрам пользователей и пересылка.
+
+        Args:
+            record: Нормализованное сообщение
+            allow_semantic: False при перегрузке - проверяются только ключевые слова
+        """
+        chat_id = record.chat_id
+        text = record.text
+        logger.debug("ОБРАБОТКА: группа '%s' (ID: %s, тип: %s)", record.chat_title, chat_id, record.chat_type)
+        logger.debug("Текст: %s...", text[:100])
+        if not self.filter_cache.loaded:
+            await self.filter_cache.load()
 
         async for session in get_session():
             try:
-                subscriptions_query = select(Subscription).where(Subscription.chat_id == chat_id)
-                result = await session.execute(subscriptions_query)
-                subscriptions = result.scalars().all()
+                with tracing.span("routing.subscriptions"):
+                    subscriptions_query = select(Subscription).where(Subscription.chat_id == chat_id)
+                    result = await session.execute(subscriptions_query)
+                    subscriptions = result.scalars().all()
 
                 if not subscriptions:
-                    print(f"Нет подписок на чат {chat_id}")
+                    logger.debug("Нет подписок на чат %s", chat_id)
+                    metrics.MESSAGES_SKIPPED.inc("no_subscribers")
+                    self.subscriptions.discard(chat_id)
                     return
-                
-                print(f"Найдено подписок: {len(subscriptions)}")
+
+                self.subscriptions.add(chat_id)
+                logger.debug("Найдено подписок: %d", len(subscriptions))
+                # Текст нормализуется один раз: результаты условий общие для фильтров всех подписчиков
+                prepared = self.filter_engine.prepare(text)
 
                 for subscription in subscriptions:
                     user_id = subscription.user_id
 
-                    user_query = select(User).where(User.user_id == user_id)
-                    user_result = await session.execute(user_query)
-                    user = user_result.scalar_one_or_none()
+                    with tracing.span("routing.user", user_id=user_id):
+                        user_query = (
+                            select(User, DeliverySettings)
+                            .outerjoin(DeliverySettings, DeliverySettings.user_id == User.user_id)
+                            .where(User.user_id == user_id)
+                        )
+                        user_result = await session.execute(user_query)
+                        user_row = user_result.one_or_none()
+
+                        if not user_row:
+                            continue
+                        user, delivery = user_row
 
-                    if not user:
+                    user_filters = self.filter_cache.get(user_id)
+                    if not user_filters:
+                        logger.debug("У пользователя %s нет фильтров", user_id)
                         continue
 
-                    filters_query = select(Filter).where(Filter.user_id == user_id)
-                    filters_result = await session.execute(filters_query)
-                    filters = filters_result.scalars().all()
+                    logger.debug("У пользователя %s найдено фильтров: %d", user_id, len(user_filters))
 
-                    if not filters:
-                        print(f"У пользователя {user_id} нет фильтров")
-                        continue
+                    if allow_semantic and self.filter_cache.has_semantic(user_id):
+                        # Пока модель прогревается в фоне, ждем ее, не блокируя других потребителей
+                        await self.filter_engine.wait_semantic_ready()
 
-                    print(f"У пользователя {user_id} найдено фильтров: {len(filters)}")
-
-                    filter_dicts = []
-                    print(f"Применяю фильтры:")
-                    for f in filters:
-                        filter_info = {
-                            "keywords": f.keywords,
-                            "topics": f.topics,
-                            "use_semantic": f.use_semantic
-                        }
-                        filter_dicts.append(filter_info)
-                        
-                        if f.use_semantic:
-                            print(f"   - ID {f.id}: Семантика '{f.topics}'")
-                        else:
-                            print(f"   - ID {f.id}: Ключевые слова '{f.keywords}'")
+                    with tracing.span("filters", user_id=user_id, count=len(user_filters)):
+                        # Для top-K важна лучшая оценка, а не первый сработавший фильтр
+                        match = await self.filter_engine.match_async(
+                            prepared, user_filters, allow_semantic=allow_semantic, user_id=user_id,
+                            best=bool(delivery and delivery.mode == "top")
+                        )
+                    if match:
+                        logger.debug(
+                            "Результат фильтрации: ПЕРЕСЛАТЬ (фильтр %s, %s '%s', оценка %.3f)",
+                            match.filter_id, match.kind, match.matched, match.score
+                        )
+                    else:
+                        logger.debug("Результат фильтрации: не соответствует фильтрам")
 
-                    should_forward = self.filter_engine.should_forward(text, filter_dicts)
-                    print(f"Результат фильтрации: {'ПЕРЕСЛАТЬ' if should_forward else 'не соответствует фильтрам'}")
-                    
-                    if should_forward:
-                        await self.forward_message(user, message)
+                    if match:
+                        metrics.MESSAGES_MATCHED.inc()
+                        self.match_log.record_match(user_id, record, match, delivery.mode if delivery else "instant")
+                        if delivery and delivery.mode == "digest":
+                            await self.digest.add(user, delivery, record)
+                        elif delivery and delivery.mode == "top":
+                            await self.top_k.add(user, record, match)
+                        else:
+                            forwarded = await self.forward_message(user, record)
+                            if forwarded and FEEDBACK_ENABLED and match.kind == "semantic":
+                                await feedback.record_match(user_id, record, match)
             finally:
                 pass
 
-    async def forward_message(self, user: User, message: Message):
-        """Пересылка сообщения в целевой чат пользователя."""
-        if not user.target_chat_id:
-            target_chat_id = user.user_id
-            print(f"Целевой чат не установлен, отправляю в личные сообщения: {target_chat_id}")
-        else:
-            target_chat_id = user.target_chat_id
-            print(f"Отправляю в целевой чат: {target_chat_id}")
+    async def forward_message(self, user: User, record: MessageRecord, attempt: int = 0) -> bool:
+        """
+        Пересылка сообщения в целевой чат пользователя; True, если сообщение доставлено.
+
+        Сообщение, которое уже доставлено в этот чат или пересылается сейчас
+        (повторный апдейт, общий чат доставки у нескольких подписчиков),
+        пропускается без обращения к Telegram. Если ни у одного аккаунта нет
+        квоты, пересылка откладывается в forward_retry (attempt - номер
+        повтора) и возвращается False.
+        """
+        key = (self.target_chat_id(user), record.chat_id, record.message_id)
+        if not await self.ledger.claim_async(key):
+            metrics.FORWARDS_DEDUPLICATED.inc()
+            logger.debug("Сообщение %s из чата %s уже переслано в чат %s", record.message_id, key[1], key[0])
+            return False
+
+        delivered = False
+        try:
+            with tracing.span("deliver", user_id=user.user_id):
+                delivered = await self._forward_message(user, record, attempt)
+        finally:
+            if not delivered:
+                self.ledger.release(key)
+        if delivered:
+            await self.ledger.record(key, user.user_id)
+        return delivered
+
+    @staticmethod
+    def target_chat_id(user: User) -> int:
+        """Чат доставки пользователя (по умолчанию личные сообщения)."""
+        return user.target_chat_id or user.user_id
+
+    async def _forward_message(self, user: User, record: MessageRecord, attempt: int = 0) -> bool:
+        """Пересылка с учетом интервала между пересылками и FloodWait."""
+        target_chat_id = self.target_chat_id(user)
+        logger.debug("Отправляю в чат: %s", target_chat_id)
 
         current_time = time.time()
         if target_chat_id in self.last_forward_time:
             time_since_last = current_time - self.last_forward_time[target_chat_id]
             if time_since_last < self.min_forward_interval:
                 wait_time = self.min_forward_interval - time_since_last
-                print(f"Задержка {wait_time:.1f} сек для избежания лимита...")
-                await asyncio.sleep(wait_time)
+                logger.debug("Задержка %.1f сек для избежания лимита...", wait_time)
+                with tracing.span("rate_limit", seconds=wait_time):
+                    await asyncio.sleep(wait_time)
+
+        source_chat_id = record.chat_id
+        tried = set()
+        denied = set()
+        while True:
+            account = self.pool.pick_forwarder(source_chat_id, exclude=tried)
+            if account is None:
+                if denied and all(acc.name in denied for acc in self.pool.forwarders(source_chat_id)):
+                    # Повтор не поможет: ни у одного аккаунта нет доступа к чату
+                    logger.error("Ни один аккаунт пула не может переслать сообщение %s из чата %s",
+                                 record.message_id, source_chat_id)
+                    return False
+                # Потребитель очереди не ждет квоту: пересылка повторится в фоне
+                metrics.FORWARD_ERRORS.inc("no_quota")
+                wait_time = self.pool.seconds_until_available(source_chat_id)
+                if wait_time <= MAX_FLOOD_SLEEP and self.forward_retry.schedule(
+                        user, record, max(1.0, wait_time), attempt + 1):
+                    logger.warning(
+                        "Нет аккаунтов с квотой, пересылка сообщения %s отложена на %.0f сек",
+                        record.message_id, wait_time
+                    )
+                else:
+                    logger.warning(
+                        "Нет аккаунтов с квотой для пересылки сообщения %s (ближайший освободится через %.0f сек)",
+                        record.message_id, wait_time
+                    )
+                return False
 
-        try:
-            await message.forward(chat_id=target_chat_id)
-            self.last_forward_time[target_chat_id] = time.time()
-            print(f"Сообщение успешно переслано в чат {target_chat_id}")
-        except FloodWait as e:
-            wait_time = e.value
-            print(f"Telegram просит подождать {wait_time} секунд...")
-            await asyncio.sleep(wait_time)
             try:
-                await message.forward(chat_id=target_chat_id)
+                await account.client.forward_messages(
+                    chat_id=target_chat_id,
+                    from_chat_id=source_chat_id,
+                    message_ids=record.message_id
+                )
+                account.record_forward()
                 self.last_forward_time[target_chat_id] = time.time()
-                print(f"Сообщение переслано после ожидания")
-            except Exception as retry_error:
-                print(f"Ошибка при повторной пересылке: {retry_error}")
-        except PeerFlood:
-            print(f"PEER_FLOOD: Аккаунт временно ограничен из-за частых пересылок")
-            print(f"Подождите несколько минут или используйте другой целевой чат")
-        except Exception as e:
-            print(f"Ошибка при пересылке сообщения: {e}")
-            if "PEER_FLOOD" not in str(e) and "FLOOD" not in str(e):
-                import traceback
-                traceback.print_exc()
+                self.match_log.record_forward(user.user_id, target_chat_id, record, account.name)
+                metrics.MESSAGES_FORWARDED.inc()
+                metrics.ACCOUNT_FORWARDS.inc(account.name)
+                logger.info(
+                    "Переслано сообщение %s из чата %s в чат %s (аккаунт %s)",
+                    record.message_id, source_chat_id, target_chat_id, account.name
+                )
+                return True
+            except FloodWait as e:
+                metrics.FORWARD_ERRORS.inc("flood_wait")
+                metrics.FLOOD_WAIT_SECONDS.inc(amount=e.value)
+                self.pool.mark_flood_wait(account, e.value)
+                tried.add(account.name)
+            except PeerFlood:
+                metrics.FORWARD_ERRORS.inc("peer_flood")
+                self.pool.mark_peer_flood(account)
+                tried.add(account.name)
+            except ACCESS_ERRORS as e:
+                # Аккаунт не видит исходный чат: пробуем другого участника
+                metrics.FORWARD_ERRORS.inc("no_access")
+                logger.debug("Аккаунт %s не может переслать из чата %s: %s", account.name, source_chat_id, e)
+                self.pool.mark_no_access(account, source_chat_id)
+                tried.add(account.name)
+                denied.add(account.name)
+            except Exception as e:
+                metrics.FORWARD_ERRORS.inc("other")
+                if "PEER_FLOOD" not in str(e) and "FLOOD" not in str(e):
+                    logger.exception("Ошибка при пересылке сообщения: %s", e)
+                else:
+                    logger.error("Ошибка при пересылке сообщения: %s", e)
+                return False
 
     async def stop(self):
         """Остановка user bot."""
-        await self.client.stop()
-        print("User Bot остановлен")
+        await self.backfiller.stop()
+        await self.forward_retry.stop()
+        await self.digest.stop()
+        await self.top_k.stop()
+        if self._threshold_task:
+            self._threshold_task.cancel()
+            await asyncio.gather(self._threshold_task, return_exceptions=True)
+        await self.subscriptions.stop_refresh()
+        if self.pool.unassign in self.subscriptions.on_removed:
+            self.subscriptions.on_removed.remove(self.pool.unassign)
+        await self.filter_cache.stop_refresh()
+        await self.ingestion.stop()
+        await self.match_log.stop()
+        await self.progress.stop()
+        await self.pool.stop()
+        await self.filter_engine.close()
+        logger.info("User Bot остановлен")
 
     def run(self):
         """Запуск user bot в цикле событий."""